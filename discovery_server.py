@@ -1,6 +1,8 @@
+import time
 import logging
 import pygnetic
-from pygnetic.discovery import DiscoveryServer
+from pygnetic.discovery import (DiscoveryServer, BatchedDiscoveryServer,
+                                run_workers)
 
 _logger = logging.getLogger(__name__)
 
@@ -11,6 +13,11 @@ if __name__ == '__main__':
                         help='Server host IP')
     parser.add_argument('-p', '--port', type=int, default=5000,
                         help='Server port')
+    parser.add_argument('-b', '--batched', action='store_true',
+                        help='Process datagrams in batches')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of batched worker processes '
+                             'sharing port (SO_REUSEPORT)')
     parser.add_argument('-d', '--debug', action='store_true',
                         help='Enable debugging')
     args = parser.parse_args()
@@ -20,7 +27,14 @@ if __name__ == '__main__':
         pygnetic.init()
     _logger.info('Server started (Use Control-C to exit)')
     try:
-        DiscoveryServer(args.host, args.port).serve_forever()
+        if args.workers > 1:
+            processes = run_workers(args.host, args.port, args.workers)
+            while any(p.is_alive() for p in processes):
+                time.sleep(1)
+        elif args.batched:
+            BatchedDiscoveryServer(args.host, args.port).serve_forever()
+        else:
+            DiscoveryServer(args.host, args.port).serve_forever()
     except KeyboardInterrupt:
         pass
     _logger.info('Exiting')
@@ -7,6 +7,7 @@ import event
 import message
 import network
 import serialization
+import syncobject
 from handler import Handler
 from network import Server, Client
 
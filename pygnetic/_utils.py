@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import math
 import logging
 from importlib import import_module
 
@@ -33,4 +34,90 @@ class lazyproperty(object):
             return self
         value = self._calculate(obj)
         setattr(obj, self._calculate.func_name, value)
-        return value
\ No newline at end of file
+        return value
+
+
+class TimerWheel(object):
+    """Hashed timing wheel scheduling deadlines of keys.
+
+    Scheduling, rescheduling and cancelling are O(1), :meth:`advance`
+    visits only slots passed since previous call, so its cost depends on
+    number of expiring keys rather than all scheduled ones. Keys expire
+    at most one resolution after their deadline, never before.
+
+    :param resolution: length of slot in seconds
+    :param slots: number of slots
+    """
+    def __init__(self, resolution=0.1, slots=1024):
+        self.resolution = float(resolution)
+        self._slots = [set() for _ in xrange(slots)]
+        self._ticks = {}  # key -> tick of deadline
+        self._tick = None  # next tick to process
+        self._lowest = None  # lowest tick scheduled before first advance
+
+    def __len__(self):
+        return len(self._ticks)
+
+    def __contains__(self, key):
+        return key in self._ticks
+
+    def schedule(self, key, deadline):
+        """Schedule (or reschedule) key to expire at deadline.
+
+        :param key: hashable object
+        :param deadline: time in seconds
+        """
+        tick = int(math.ceil(deadline / self.resolution))
+        if self._tick is None:
+            if self._lowest is None or tick < self._lowest:
+                self._lowest = tick
+        elif tick < self._tick:
+            tick = self._tick
+        n = len(self._slots)
+        old = self._ticks.get(key)
+        if old is not None:
+            self._slots[old % n].discard(key)
+        self._ticks[key] = tick
+        self._slots[tick % n].add(key)
+
+    def cancel(self, key):
+        """Remove key from wheel.
+
+        :return: False if key wasn't scheduled
+        """
+        tick = self._ticks.pop(key, None)
+        if tick is None:
+            return False
+        self._slots[tick % len(self._slots)].discard(key)
+        return True
+
+    def deadline(self, key):
+        """Return deadline of key rounded to resolution (None if it isn't
+        scheduled)."""
+        tick = self._ticks.get(key)
+        if tick is not None:
+            return tick * self.resolution
+
+    def advance(self, now):
+        """Remove and return keys with deadline not later than now.
+
+        :param now: current time in seconds
+        :return: list of keys
+        """
+        tick = int(now // self.resolution)
+        first = self._tick
+        if first is None:
+            first = tick if self._lowest is None else min(self._lowest, tick)
+        if tick < first:
+            return []
+        n = len(self._slots)
+        ticks = self._ticks
+        expired = []
+        for t in xrange(first, min(tick, first + n - 1) + 1):
+            slot = self._slots[t % n]
+            for key in [k for k in slot if ticks[k] <= tick]:
+                slot.remove(key)
+                del ticks[key]
+                expired.append(key)
+        self._tick = tick + 1
+        return expired
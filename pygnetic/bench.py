@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""Microbenchmarks of serialization, message dispatch, network adapters
+and discovery server.
+
+Usage::
+
+    python -m pygnetic.bench -o current.json -c baseline.json
+
+Results are saved as JSON, every case reports ``usec_per_op`` (lower is
+better) which is used to flag regressions against previous run.
+"""
+
+import sys
+import json
+import time
+import errno
+import select
+import socket
+import logging
+import platform
+import threading
+from timeit import default_timer
+from . import __version__
+from . import connection, discovery, handler, message, network, serialization
+
+_logger = logging.getLogger(__name__)
+
+serialization_adapters = ('msgpack', 'json')
+network_adapters = ('loopback', 'socket', 'enet')
+discovery_modes = ('threaded', 'batched')
+
+
+def position_mix(i):
+    """Small position update."""
+    return 'position', (i, 12.5 + i, 480.25 - i, 1.5707)
+
+
+def chat_mix(i):
+    """Chat message with short strings."""
+    return 'chat', ('player_%d' % (i % 16), 'Hello, this is message %d' % i)
+
+
+def bulk_mix(i):
+    """Bulk array of numbers."""
+    return 'bulk', (i, tuple(range(i % 7, i % 7 + 256)))
+
+
+def mixed(i):
+    """Realistic mix: mostly positions, some chat, occasional bulk."""
+    r = i % 20
+    if r < 16:
+        return position_mix(i)
+    elif r < 19:
+        return chat_mix(i)
+    return bulk_mix(i)
+
+
+mixes = (
+    ('position', position_mix),
+    ('chat', chat_mix),
+    ('bulk', bulk_mix),
+    ('mixed', mixed),
+)
+
+
+def create_factory(s_adapter):
+    """Return frozen MessageFactory with benchmark messages registered.
+
+    :param s_adapter: :term:`serialization adapter` module
+    :return: :class:`~.message.MessageFactory`
+    """
+    mf = message.MessageFactory(s_adapter)
+    mf.register('position', ('obj_id', 'x', 'y', 'angle'))
+    mf.register('chat', ('player', 'msg'))
+    mf.register('bulk', ('obj_id', 'values'))
+    mf.register('ping', ('time',))
+    mf.set_frozen()
+    return mf
+
+
+def create_messages(mf, mix, count=100):
+    return [mf.get_by_name(name)(*args)
+            for name, args in (mix(i) for i in xrange(count))]
+
+
+def measure(func, min_time=0.2, repeat=3):
+    """Return best time of single func call in seconds.
+
+    :param func: function without arguments
+    :param min_time: minimal time of measurement round
+    :param repeat: number of measurement rounds
+    """
+    number = 1
+    while True:
+        start = default_timer()
+        for _ in xrange(number):
+            func()
+        elapsed = default_timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed) + 1)
+    best = elapsed
+    for _ in xrange(repeat - 1):
+        start = default_timer()
+        for _ in xrange(number):
+            func()
+        best = min(best, default_timer() - start)
+    return best / number
+
+
+def _result(seconds, ops=1, **extra):
+    extra['usec_per_op'] = seconds * 1e6 / ops
+    extra['ops_per_sec'] = ops / seconds if seconds > 0 else 0
+    return extra
+
+
+class _Parent(object):
+    def _remove(self, c_key):
+        pass
+
+
+class _DispatchHandler(handler.Handler):
+    def __init__(self):
+        self.received = 0
+
+    def net_position(self, message, **kwargs):
+        self.received += 1
+
+    def net_chat(self, message, **kwargs):
+        self.received += 1
+
+    def on_recive(self, message, **kwargs):
+        self.received += 1
+
+
+class _DispatchConnection(connection.Connection):
+    def _send_data(self, data, **kwargs):
+        pass
+
+
+def bench_serialization(s_name, min_time=0.2):
+    """Benchmark pack / unpack of message mixes with serialization adapter.
+
+    :param s_name: name of :term:`serialization adapter`
+    :return: dict with results or None if adapter isn't available
+    """
+    s_adapter = serialization.get_adapter(s_name)
+    if s_adapter is None:
+        return
+    mf = create_factory(s_adapter)
+    results = {}
+    for mix_name, mix in mixes:
+        msgs = create_messages(mf, mix)
+        pack = mf.pack
+        packed = [pack(m) for m in msgs]
+        stream = ''.join(packed)
+        prefix = 'serialization.%s.%s.' % (s_name, mix_name)
+        t = measure(lambda: [pack(m) for m in msgs], min_time)
+        results[prefix + 'pack'] = _result(t, len(msgs),
+            bytes_per_msg=float(len(stream)) / len(msgs))
+        unpack = mf.unpack
+        t = measure(lambda: [unpack(d) for d in packed], min_time)
+        results[prefix + 'unpack'] = _result(t, len(msgs))
+
+        def unpack_all():
+            mf.reset_context(context)
+            for _ in mf.unpack_all(stream, context):
+                pass
+        context = _Parent()
+        t = measure(unpack_all, min_time)
+        results[prefix + 'unpack_all'] = _result(t, len(msgs))
+
+        parent = _Parent()
+        conn = _DispatchConnection(parent, None, mf)
+        conn.add_handler(_DispatchHandler())
+        t = measure(lambda: conn._receive(stream, channel=0), min_time)
+        results[prefix + 'dispatch'] = _result(t, len(msgs))
+    return results
+
+
+class _EchoHandler(handler.Handler):
+    def on_recive(self, message, **kwargs):
+        self.connection.send(message.__class__, *message)
+
+
+class _ClientHandler(handler.Handler):
+    def __init__(self):
+        self.connected = False
+        self.received = 0
+        self.latency = None
+
+    def on_connect(self):
+        self.connected = True
+
+    def net_ping(self, message, **kwargs):
+        self.latency = default_timer() - message.time
+
+    def on_recive(self, message, **kwargs):
+        self.received += 1
+
+
+def _pump(server, client, condition, timeout=5.0):
+    end = default_timer() + timeout
+    while not condition():
+        if default_timer() > end:
+            raise RuntimeError('Timeout')
+        server.update()
+        client.update()
+
+
+def bench_network(n_name, s_name='msgpack', count=2000, pings=200):
+    """Benchmark throughput and latency of loopback echo with
+    network adapter.
+
+    :param n_name: name of :term:`network adapter`
+    :param s_name: name of :term:`serialization adapter`
+    :param count: number of messages sent to measure throughput
+    :param pings: number of messages sent to measure latency
+    :return: dict with results or None if adapter isn't available
+    """
+    n_adapter = network.get_adapter(n_name)
+    s_adapter = serialization.get_adapter(s_name)
+    if n_adapter is None or s_adapter is None:
+        return
+    mf = create_factory(s_adapter)
+    server = n_adapter.Server('127.0.0.1', 0, conn_limit=4,
+                              handler=_EchoHandler, message_factory=mf)
+    client = n_adapter.Client(message_factory=mf)
+    conn = client.connect('127.0.0.1', server.address[1])
+    handler_ = _ClientHandler()
+    conn.add_handler(handler_)
+    _pump(server, client, lambda: handler_.connected)
+
+    latencies = []
+    ping = mf.get_by_name('ping')
+    for _ in xrange(pings):
+        handler_.latency = None
+        conn.send(ping, default_timer())
+        _pump(server, client, lambda: handler_.latency is not None)
+        latencies.append(handler_.latency)
+    latencies.sort()
+
+    msgs = create_messages(mf, mixed, count)
+    start = default_timer()
+    for i in xrange(0, count, 100):
+        for m in msgs[i:i + 100]:
+            conn.send(m.__class__, *m)
+        expected = min(i + 100, count)
+        _pump(server, client, lambda: handler_.received >= expected)
+    elapsed = default_timer() - start
+    conn.disconnect()
+    client.update()
+    server.update()
+
+    prefix = 'network.%s.%s.' % (n_name, s_name)
+    return {
+        prefix + 'latency': _result(latencies[len(latencies) // 2],
+            p99_usec=latencies[int(len(latencies) * 0.99)] * 1e6,
+            max_usec=latencies[-1] * 1e6),
+        prefix + 'throughput': _result(elapsed, count),
+    }
+
+
+def _discovery_requests(sock, make, count, window):
+    sent = received = lost = 0
+    start = default_timer()
+    while received < count:
+        while sent < count and sent - received < window:
+            sock.send(make(sent))
+            sent += 1
+        if not select.select([sock], [], [], 0.5)[0]:
+            lost += sent - received  # datagrams dropped by full buffers
+            received = sent
+            continue
+        try:
+            while True:
+                sock.recv(discovery.DiscoveryClient.max_packet_size)
+                received += 1
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+    return default_timer() - start, lost
+
+
+def bench_discovery(mode, count=5000, window=64):
+    """Benchmark registrations, pings and queries per second of
+    discovery server running in thread.
+
+    :param mode: ``'threaded'`` (DiscoveryServer) or ``'batched'``
+        (BatchedDiscoveryServer)
+    :param count: number of requests of each type
+    :param window: maximum number of requests waiting for response
+    :return: dict with results
+    """
+    serialization.select_adapter(('msgpack', 'json'))
+    if mode == 'threaded':
+        server = discovery.DiscoveryServer('127.0.0.1', 0)
+    else:
+        server = discovery.BatchedDiscoveryServer('127.0.0.1', 0)
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05})
+    thread.daemon = True
+    thread.start()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(server.server_address)
+    sock.setblocking(False)
+    pack = discovery.message_factory.pack
+    requests = (
+        ('register', lambda i: pack(discovery.register(
+            i, u'Server %d' % i, 1000 + i % 5000, u'ctf', i % 8))),
+        ('ping', lambda i: pack(discovery.ping(i, i % count + 1, i % 8))),
+        ('get_servers', lambda i: pack(discovery.get_servers(
+            i, i % count, 20, {}))),
+    )
+    results = {}
+    try:
+        for name, make in requests:
+            elapsed, lost = _discovery_requests(sock, make, count, window)
+            results['discovery.%s.%s' % (mode, name)] = _result(
+                elapsed, count, lost=lost)
+    finally:
+        sock.close()
+        server.shutdown()
+        thread.join()
+        server.server_close()
+    return results
+
+
+def run(s_names=serialization_adapters, n_names=network_adapters,
+        name_filter=None, min_time=0.2, d_modes=discovery_modes):
+    """Run benchmarks and return results.
+
+    :param s_names: names of serialization adapters
+    :param n_names: names of network adapters
+    :param name_filter: run only cases containing this string
+    :param d_modes: modes of discovery server
+    :return: dict
+    """
+    results = {}
+    for s_name in s_names:
+        r = bench_serialization(s_name, min_time)
+        if r is None:
+            _logger.warning('Serialization adapter %s not available', s_name)
+        else:
+            results.update(r)
+    for n_name in n_names:
+        for s_name in s_names:
+            if name_filter and name_filter not in 'network.%s.%s' % (
+                    n_name, s_name):
+                continue
+            r = bench_network(n_name, s_name)
+            if r is None:
+                _logger.warning('Network adapter %s not available', n_name)
+                break
+            results.update(r)
+    for mode in d_modes:
+        if name_filter and name_filter not in 'discovery.%s' % mode:
+            continue
+        results.update(bench_discovery(mode))
+    if name_filter:
+        results = {k: v for k, v in results.iteritems() if name_filter in k}
+    return {
+        'meta': {
+            'time': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'version': __version__,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """Compare results with baseline.
+
+    :param current: results returned by :func:`run`
+    :param baseline: results returned by :func:`run`
+    :param threshold:
+        relative increase of ``usec_per_op`` treated as regression
+    :return: list of (name, baseline usec, current usec, ratio, regression)
+    """
+    rows = []
+    old = baseline['results']
+    for name, r in sorted(current['results'].iteritems()):
+        if name not in old:
+            continue
+        o = old[name]['usec_per_op']
+        n = r['usec_per_op']
+        ratio = n / o if o > 0 else 1.0
+        rows.append((name, o, n, ratio, ratio > 1.0 + threshold))
+    return rows
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='pygnetic benchmarks.')
+    parser.add_argument('-o', '--output', help='save results to JSON file')
+    parser.add_argument('-c', '--compare',
+                        help='compare with results from JSON file')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help='relative slowdown flagged as regression')
+    parser.add_argument('-s', '--serialization', nargs='+',
+                        default=serialization_adapters,
+                        help='serialization adapters')
+    parser.add_argument('-n', '--network', nargs='+',
+                        default=network_adapters, help='network adapters')
+    parser.add_argument('-d', '--discovery', nargs='*',
+                        default=discovery_modes,
+                        help='discovery server modes')
+    parser.add_argument('-k', '--filter', help='run only matching cases')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimal time of single measurement')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    current = run(args.serialization, args.network, args.filter,
+                  args.min_time, args.discovery)
+    for name, r in sorted(current['results'].iteritems()):
+        print '%-48s %12.3f usec/op %14.1f op/s' % (
+            name, r['usec_per_op'], r['ops_per_sec'])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows = compare(current, baseline, args.threshold)
+        regressions = [row for row in rows if row[4]]
+        print
+        for name, o, n, ratio, regression in rows:
+            print '%-48s %10.3f -> %10.3f  %+6.1f%%%s' % (
+                name, o, n, (ratio - 1) * 100,
+                '  REGRESSION' if regression else '')
+        if regressions:
+            print '\n%d regression(s) found' % len(regressions)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 """Module containing base class for adapters representing network clients."""
 
+import time
 import logging
 import message
 import network
+import syncobject
+from _utils import TimerWheel
 
 _logger = logging.getLogger(__name__)
 
@@ -18,10 +21,16 @@ class Client(object):
     :param kwargs: additional keyword arguments for :term:`network adapter`
     """
     message_factory = message.message_factory
+    sync_manager = syncobject.sync_manager
+    lockstep = None  # LockstepClient of running session
+    _remote_clock = True  # connections synchronize clock with server
+    _declares_session = True  # connections tell server if they resume
 
     def __init__(self, conn_limit=1, message_factory=None, *args, **kwargs):
         super(Client, self).__init__(*args, **kwargs)
         self.conn_map = {}
+        self._timers = TimerWheel(0.05)
+        self._sending = set()  # connections with bulk transfers
         if message_factory is not None:
             self.message_factory = message_factory
         _logger.info('Client created, connections limit: %d', conn_limit)
@@ -45,8 +54,31 @@ class Client(object):
             message_factory, **kwargs)
         self.conn_map[c_key] = connection
         connection._key = c_key
+        connection._endpoint = host, port, message_factory, kwargs
         return connection
 
+    def reconnect(self, connection):
+        """Connect again to host of closed connection and resume its
+        session.
+
+        Handlers and remote objects of connection are moved to new one.
+        If server still keeps the session, it continues with the same
+        server side handler and only changes are synchronized, otherwise
+        remote objects are removed and synchronized from scratch.
+
+        :param connection: closed :class:`~.connection.Connection`
+        :return: new :class:`~.connection.Connection`
+        """
+        host, port, message_factory, kwargs = connection._endpoint
+        new = self.connect(host, port, message_factory, **kwargs)
+        if connection.resume_token is not None:
+            new._resume = connection.resume_token
+            new.remote_objects = connection.remote_objects
+            self.sync_manager.transfer(connection, new)
+        for h in connection.handlers:
+            new.add_handler(h)
+        return new
+
     def update(self, timeout=0):
         """Process network traffic and update connections.
 
@@ -56,6 +88,17 @@ class Client(object):
         """
         raise NotImplementedError('Should be implemented by adapter class')
 
+    def _tick(self):
+        """Run expired timers and send chunks of bulk transfers, called
+        by adapters after processing network events."""
+        for obj, method in self._timers.advance(time.time()):
+            getattr(obj, method)()
+        for connection in list(self._sending):
+            connection._pump()
+
+    def _suspend(self, connection):
+        return False
+
     def _get(self, c_key):
         return self.conn_map[c_key]
 
@@ -4,10 +4,15 @@ Module containing base class for adapters representing network connections.
 """
 
 import re
+import time
 import logging
 from weakref import proxy
+from collections import deque
 from functools import partial
 import event
+import rpc
+import lockstep
+import transfer
 
 _logger = logging.getLogger(__name__)
 
@@ -21,6 +26,23 @@ class Connection(object):
     """
     address = ('', '') # \
     connected = False  # / default values, should be overridden by adapter class
+    rtt = None  # smoothed round trip time in seconds, if known
+    rtt_var = None  # mean deviation of round trip time
+    packet_loss = None  # fraction of lost packets, if known
+    ping_interval = 1.0  # seconds between clock / rtt samples
+    clock_samples = 8  # number of samples used by clock filter
+    clock = staticmethod(time.time)
+    heartbeat_interval = 5.0  # seconds, None - no heartbeats and idle timeout
+    idle_timeout = 20.0  # seconds without received data before disconnection
+    bulk_budget = 65536  # bytes of bulk transfers sent per update
+    transfer_window = 262144  # bytes of transfer sent and not acknowledged
+    bulk_channel = 0  # channel of transfer data
+    max_transfer_size = 64 * 1024 * 1024  # bytes, larger transfers are refused
+    max_incoming_size = 128 * 1024 * 1024  # bytes of all open incoming
+    resume_token = None  # token of session issued by server
+    _resume = None  # token presented to server after connection
+    _sync_held = False  # replication waits until session is known
+    _measure_rtt = True  # False when rtt is provided by adapter
     __id_cnt = 0
 
     def __init__(self, parent, conn_obj, message_factory, *args, **kwargs):
@@ -33,8 +55,20 @@ class Connection(object):
         self.data_received = 0
         self.messages_sent = 0
         self.messages_received = 0
+        self.remote_objects = {}  # obj_id -> RemoteObject
         self.id = self.__class__.__id_cnt = self.__id_cnt + 1
         self._key = None
+        self.clock_offset = 0.0  # server clock - local clock
+        self._clock_samples = deque(maxlen=self.clock_samples)
+        self._next_ping = 0
+        self._calls = {}  # cid -> Future
+        self._call_id = 0
+        self._outgoing = {}  # tid -> transfer.Outgoing
+        self._incoming = {}  # tid -> transfer.Incoming
+        self._transfer_id = 0
+        self._hb_sent = 0  # messages_sent at previous heartbeat check
+        self._hb_received = 0  # data_received at previous heartbeat check
+        self._idle = 0.0  # time without received data
 
     def __getattr__(self, name):
         parts = name.split('_', 1)
@@ -66,16 +100,21 @@ class Connection(object):
         self._send_message(message, *args, **kwargs)
 
     def _send_message(self, message, *args, **kwargs):
-        name = message.__name__
-        params = self.message_factory.get_params(message)
         try:
             message_ = message(*args, **kwargs)
         except TypeError, e:
             e, f = re.findall(r'[^_a-z](\d+)', e.message, re.I)
             raise TypeError('%s takes exactly %d arguments (%d given)' %
                 (message.__doc__, int(e) - 1, int(f) - 1))
+        return self._send(message_)
+
+    def _send(self, message_, **kwargs):
+        params = self.message_factory.get_params(message_.__class__)
+        if kwargs:
+            params = dict(params, **kwargs)
         data = self.message_factory.pack(message_)
-        _logger.info('#%s Sent %s message', self.id, name)
+        _logger.info('#%s Sent %s message', self.id,
+                     message_.__class__.__name__)
         self.data_sent += len(data)
         self.messages_sent += 1
         return self._send_data(data, **params)
@@ -85,26 +124,365 @@ class Connection(object):
 
     def _receive(self, data, **kwargs):
         self.data_received += len(data)
+        internal = self.message_factory._internal
         for message in self.message_factory.unpack_all(data, self):
             self.messages_received += 1
-            name = message.__class__.__name__
-            _logger.info('#%s Received %s message', self.id, name)
-            event.received(self, message)
+            name = internal.get(message.__class__)
+            if name is not None:
+                getattr(self, name)(message, **kwargs)
+                continue
+            self._dispatch(message, **kwargs)
+        # handler could have disconnected
+        if self.connected and self.clock() >= self._next_ping:
+            self.ping()
+
+    def _dispatch(self, message, **kwargs):
+        name = message.__class__.__name__
+        _logger.info('#%s Received %s message', self.id, name)
+        event.received(self, message)
+        for h in self.handlers:
+            getattr(h, 'net_' + name, h.on_recive)(message, **kwargs)
+
+    def call(self, request, callback=None, timeout=None):
+        """Send request and return :class:`~.rpc.Future` of response.
+
+        Doesn't wait for response, calls are matched with responses by
+        correlation id.
+
+        :param request:
+            message of class registered with
+            :meth:`~.message.MessageFactory.register_call`
+        :param callback: function(future) called when call is done
+        :param timeout:
+            time in seconds after which call fails with
+            :data:`~.rpc.TIMEOUT` error (default: None - never)
+        :return: :class:`~.rpc.Future`
+        """
+        self.message_factory.get_response(request.__class__)
+        cid = self._call_id = self._call_id + 1
+        future = rpc.Future(self, cid)
+        if callback is not None:
+            future.add_callback(callback)
+        if not self.connected:
+            future._set(None, rpc.DISCONNECTED)
+            return future
+        self._calls[cid] = future
+        if timeout is not None:
+            self.parent._timers.schedule((future, '_timeout'),
+                                         time.time() + timeout)
+        call = self.message_factory.get_internal('rpc_call')
+        self._send(call(cid, self.message_factory._encode(request)))
+        return future
+
+    def _net_rpc_call(self, message, **kwargs):
+        request = self.message_factory._process_message(message.message)
+        if request is None:
+            return
+        try:
+            response = self.message_factory.get_response(request.__class__)
+        except ValueError:
+            _logger.warning('#%s Call of %s message, which is not a request',
+                            self.id, request.__class__.__name__)
+            return
+        self._dispatch(request, reply=rpc.Reply(self, message.cid, response),
+                       **kwargs)
+
+    def _net_rpc_reply(self, message, **kwargs):
+        future = self._calls.pop(message.cid, None)
+        if future is None:
+            return  # timed out
+        self.parent._timers.cancel((future, '_timeout'))
+        response = None
+        if message.message is not None:
+            response = self.message_factory._process_message(message.message)
+        future._set(response, message.error)
+
+    def server_time(self):
+        """Return current time of server clock.
+
+        On client it's estimated from samples with the lowest round trip
+        time, on server it's local time.
+
+        :return: float (seconds since epoch)
+        """
+        return self.clock() + self.clock_offset
+
+    def _syncs_clock(self):
+        return getattr(self.parent, '_remote_clock', False)
+
+    def ping(self):
+        """Send request for sample of round trip time and clock offset.
+
+        Connections do it automatically every ping_interval seconds
+        when they receive data.
+        """
+        self._next_ping = self.clock() + self.ping_interval
+        if self._measure_rtt or self._syncs_clock():
+            ping = self.message_factory.get_internal('rtt_ping')
+            self._send(ping(self.clock()))
+
+    def _net_rtt_ping(self, message, **kwargs):
+        pong = self.message_factory.get_internal('rtt_pong')
+        self._send(pong(message.time, self.clock()))
+
+    def _net_rtt_pong(self, message, **kwargs):
+        now = self.clock()
+        sample = now - message.time
+        if sample < 0:
+            return
+        if self._measure_rtt:
+            # smoothing the same as in TCP (RFC 6298)
+            if self.rtt is None:
+                self.rtt = sample
+                self.rtt_var = sample / 2
+            else:
+                self.rtt_var += (abs(self.rtt - sample) - self.rtt_var) / 4
+                self.rtt += (sample - self.rtt) / 8
+        if self._syncs_clock():
+            # NTP-like filter: offset of sample with the lowest rtt is the
+            # least affected by asymmetric delays
+            samples = self._clock_samples
+            samples.append((sample, message.remote_time + sample / 2 - now))
+            self.clock_offset = min(samples)[1]
+
+    def send_file(self, source, name=None, offset=0, chunk_size=16384,
+                  on_progress=None):
+        """Start bulk transfer of file or buffer.
+
+        Data is sent in chunks during updates of client / server,
+        interleaved with other messages (see :mod:`~pygnetic.transfer`).
+
+        :param source:
+            path of file, file object or buffer (bytearray, str wrapped
+            with :func:`buffer`, mmap)
+        :param name: name of transfer (default: name of file)
+        :param offset:
+            position to start from, e.g.
+            :attr:`~.transfer.Outgoing.acked` of interrupted transfer
+        :param chunk_size: maximum size of chunk in bytes
+        :param on_progress:
+            function(transfer) called when remote host acknowledges chunks
+        :return: :class:`~.transfer.Outgoing`
+        """
+        tid = self._transfer_id = self._transfer_id + 1
+        t = transfer.Outgoing(self, tid, source, name, offset, chunk_size,
+                              on_progress)
+        self._outgoing[tid] = t
+        t._start()
+        self.parent._sending.add(self)
+        return t
+
+    def _send_backlog(self):
+        """Return number of bytes waiting in send buffer of adapter."""
+        return 0
+
+    def _pump(self):
+        # called by parent after update, sends chunks within budget and
+        # window of unacknowledged data of each transfer
+        budget = self.bulk_budget - self._send_backlog()
+        window = self.transfer_window
+        sending = False
+        for t in sorted(self._outgoing.itervalues(), key=lambda t: t.tid):
+            while budget > 0 and t.sent < t.size:
+                limit = min(budget, window - (t.sent - t.acked))
+                if limit <= 0:
+                    break
+                budget -= t._send_chunk(limit)
+            if t.sent < t.size:
+                sending = True
+        if not sending:
+            self.parent._sending.discard(self)
+
+    def _net_transfer_start(self, message, **kwargs):
+        size, offset = message.size, message.offset
+        # targets are allocated at start, so size of all is limited
+        incoming = sum(t.size for tid, t in self._incoming.iteritems()
+                       if tid != message.tid)
+        if not 0 <= offset <= size <= self.max_transfer_size or \
+                incoming + size > self.max_incoming_size:
+            # refused before handlers can allocate anything for it
+            _logger.warning('#%s Transfer %d of %s bytes from %s refused',
+                            self.id, message.tid, size, offset)
+            cancel = self.message_factory.get_internal('transfer_cancel')
+            self._send(cancel(message.tid, True))
+            return
+        t = transfer.Incoming(self, message.tid, message.name, message.size,
+                              message.offset)
+        for h in self.handlers:
+            h.on_transfer_start(t)
+        if t.cancelled:
+            return
+        try:
+            t._open()
+        except (IOError, ValueError, MemoryError) as e:
+            _logger.error('#%s Can\'t open target of transfer %d: %s',
+                          self.id, t.tid, e)
+            self._incoming[t.tid] = t
+            t.cancel()
+            return
+        self._incoming[t.tid] = t
+        if t.done:
+            self._transfer_received(t)
+
+    def _net_transfer_chunk(self, message, **kwargs):
+        t = self._incoming.get(message.tid)
+        if t is None or not t._write(message.offset, message.data):
+            return
+        self._transfer_received(t)
+
+    def _transfer_received(self, t):
+        ack = self.message_factory.get_internal('transfer_ack')
+        self._send(ack(t.tid, t.received))
+        for h in self.handlers:
+            h.on_transfer_progress(t)
+        if t.done:
+            del self._incoming[t.tid]
+            t.close()
+            for h in self.handlers:
+                h.on_transfer_done(t)
+
+    def _net_transfer_ack(self, message, **kwargs):
+        t = self._outgoing.get(message.tid)
+        if t is not None:
+            t._ack(message.offset)
+            if t.done:
+                del self._outgoing[t.tid]
+
+    def _net_transfer_cancel(self, message, **kwargs):
+        if message.incoming:  # cancelled by receiver
+            t = self._outgoing.pop(message.tid, None)
+        else:
+            t = self._incoming.pop(message.tid, None)
+        if t is not None:
+            _logger.info('#%s Transfer %d cancelled by remote host',
+                         self.id, t.tid)
+            t.cancelled = True
+            t.close()
+
+    def _heartbeat(self):
+        # called by timer wheel of parent every heartbeat_interval,
+        # active connections only compare counters
+        interval = self.heartbeat_interval
+        if interval is None or not self.connected:
+            return
+        if self.data_received == self._hb_received:
+            self._idle += interval
+            if self.idle_timeout is not None and \
+                    self._idle >= self.idle_timeout:
+                _logger.info('#%s Idle for %.1f s, disconnecting', self.id,
+                             self._idle)
+                self.disconnect()
+                return
+        else:
+            self._hb_received = self.data_received
+            self._idle = 0.0
+        if self.messages_sent == self._hb_sent:
+            self._send(self.message_factory.get_internal('heartbeat')())
+        self._hb_sent = self.messages_sent
+        self.parent._timers.schedule((self, '_heartbeat'),
+                                     time.time() + interval)
+
+    def _net_heartbeat(self, message, **kwargs):
+        pass
+
+    def _net_session_token(self, message, **kwargs):
+        self.resume_token = message.token
+
+    def _net_session_resume(self, message, **kwargs):
+        self._sync_held = False
+        if message.token is None:
+            return  # new session
+        resumed = self.parent._resume(self, message.token)
+        if not resumed:
+            self.parent.sync_manager.reset(self)
+        reply = self.message_factory.get_internal('session_resumed')
+        self._send(reply(resumed))
+
+    def _net_session_resumed(self, message, **kwargs):
+        if message.resumed:
+            _logger.info('#%s Session resumed', self.id)
             for h in self.handlers:
-                getattr(h, 'net_' + name, h.on_recive)(message, **kwargs)
+                h.on_resume()
+            return
+        _logger.info('#%s Session expired, resynchronizing', self.id)
+        objs, self.remote_objects = self.remote_objects, {}
+        for obj in objs.itervalues():
+            obj.on_remove()
+        self.parent.sync_manager.reset(self)
+
+    def _expire_session(self):
+        if self.parent._sessions.pop(self.resume_token, None) is self:
+            _logger.info('#%s Session expired', self.id)
+            self._close()
+
+    def _net_sync_batch(self, message, **kwargs):
+        self.parent.sync_manager.apply(self, message)
+
+    def _net_sync_snapshot(self, message, **kwargs):
+        self.parent.sync_manager.apply_snapshot(self, message)
+
+    def _net_sync_ack(self, message, **kwargs):
+        self.parent.sync_manager.ack(self, message.seq)
+
+    def _lockstep(self, cls, message):
+        session = self.parent.lockstep
+        if isinstance(session, cls):
+            return session
+        _logger.warning('#%s Received %s message outside of lockstep session',
+                        self.id, message.__class__.__name__)
+
+    def _net_lockstep_start(self, message, **kwargs):
+        session = self._lockstep(lockstep.LockstepClient, message)
+        if session is not None:
+            session.on_start(message)
+
+    def _net_lockstep_input(self, message, **kwargs):
+        session = self._lockstep(lockstep.LockstepServer, message)
+        if session is not None:
+            session.on_input(self, message)
+
+    def _net_lockstep_frames(self, message, **kwargs):
+        session = self._lockstep(lockstep.LockstepClient, message)
+        if session is not None:
+            session.on_frames(message)
 
     def _connect(self):
         _logger.info('#%s Connected to %s', self.id, self.address)
         event.connected(self)
         for h in self.handlers:
             h.on_connect()
+        self.ping()
+        if getattr(self.parent, '_declares_session', False):
+            # sent also without token, server doesn't replicate objects
+            # before it knows whether session is resumed
+            resume = self.message_factory.get_internal('session_resume')
+            self._send(resume(self._resume))
+        if self.heartbeat_interval is not None:
+            self._hb_sent = self.messages_sent
+            self._hb_received = self.data_received
+            self.parent._timers.schedule((self, '_heartbeat'),
+                                         time.time() + self.heartbeat_interval)
 
     def _disconnect(self):
         _logger.info('#%s Disconnected from %s', self.id, self.address)
+        if self.resume_token is None or not self.parent._suspend(self):
+            self._close()
+        self.parent._timers.cancel((self, '_heartbeat'))
+        self.parent._sending.discard(self)
+        for t in self._outgoing.values() + self._incoming.values():
+            t.close()
+        self._outgoing.clear()
+        self._incoming.clear()
+        calls, self._calls = self._calls, {}
+        for future in calls.itervalues():
+            self.parent._timers.cancel((future, '_timeout'))
+            future._set(None, rpc.DISCONNECTED)
+        self.parent._remove(self._key)
+
+    def _close(self):
         event.disconnected(self)
         for h in self.handlers:
             h.on_disconnect()
-        self.parent._remove(self._key)
 
     def disconnect(self, *args):
         """Request a disconnection.
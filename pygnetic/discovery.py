@@ -1,87 +1,524 @@
+import os
+import sys
+import time
+import random
+import errno
 import logging
 import socket
 import select
 import threading
 import SocketServer
-from collections import OrderedDict
-from itertools import islice
+from bisect import bisect_left, bisect_right, insort
+from collections import namedtuple, deque, OrderedDict
 import message
+from _utils import TimerWheel
 
 _logger = logging.getLogger(__name__)
 
 message_factory = message.MessageFactory()
 
 register = message_factory.register('register', (
-    'oid', 'name', 'port'
+    'oid', 'name', 'port', 'mode', 'slots'
 ))
 get_servers = message_factory.register('get_servers', (
-    'oid', 'current', 'part_size'
+    'oid', 'cursor', 'limit', 'filters'
 ))
 ping = message_factory.register('ping', (
-    'oid', 'sid'
+    'oid', 'sid', 'slots'
+))
+replicate = message_factory.register('replicate', (
+    'oid', 'ops'
 ))
 response = message_factory.register('response', (
     'oid', 'mid', 'value', 'error'
 ))
+chunk = message_factory.register('chunk', (
+    'oid', 'seq', 'total', 'data', 'cookie'
+))
+resend = message_factory.register('resend', (
+    'oid', 'chunks', 'cookie'
+))
+announce = message_factory.register('announce', (
+    'oid', 'name', 'port', 'mode', 'slots'
+))
+probe = message_factory.register('probe', (
+    'oid', 'nonce'
+))
+probe_reply = message_factory.register('probe_reply', (
+    'oid', 'nonce', 'players', 'slots'
+))
+
+probe_port_offset = 1  # port of ProbeResponder relative to game port
 
 
 class Errors(object):
     NO_ERROR = 0
     TIMEOUT = 1
+    NO_RESPONSE = 2  # set by client when request timed out
+    INVALID = 3  # request with fields of wrong types
 
 
-class ServerHandler(SocketServer.BaseRequestHandler, object):
-    def handle(self):
-        data, socket = self.request
+def _is_int(value):
+    return isinstance(value, (int, long)) and not isinstance(value, bool)
+
+
+def _check_server(name, port, mode, slots):
+    """Raise ValueError if fields of server received from network have
+    wrong types."""
+    if not isinstance(name, basestring) or not isinstance(mode, basestring):
+        raise ValueError('Name and mode of server have to be strings')
+    if not _is_int(port) or not 0 <= port <= 65535:
+        raise ValueError('Invalid port of server')
+    if not _is_int(slots):
+        raise ValueError('Slots of server have to be integer')
+
+
+ServerInfo = namedtuple('ServerInfo', 'sid name host port mode slots')
+
+
+class Snapshot(object):
+    """Immutable view of registered servers with secondary indexes.
+
+    Indexes are sorted lists, built from servers if they aren't given.
+
+    :param servers: dict: sid -> :class:`ServerInfo`
+    :param sids: sids
+    :param names: (lower case name, sid) pairs
+    :param slots: (slots, sid) pairs
+    :param modes: (mode, sid) pairs
+    """
+    def __init__(self, servers, sids=None, names=None, slots=None,
+                 modes=None):
+        self.servers = servers
+        if sids is None:
+            sids = sorted(servers)
+            names = sorted((s.name.lower(), sid)
+                           for sid, s in servers.iteritems())
+            slots = sorted((s.slots, sid) for sid, s in servers.iteritems())
+            modes = sorted((s.mode, sid) for sid, s in servers.iteritems())
+        self.sids = sids
+        self.names = names
+        self.slots = slots
+        self.modes = modes
+        self._results = {}  # filters -> sorted list of matching sids
+        self._lock = threading.Lock()
+
+    def _match(self, prefix, mode, min_slots):
+        key = (prefix, mode, min_slots)
+        sids = self._results.get(key)
+        if sids is not None:
+            return sids
+        if mode is not None:
+            modes = self.modes
+            i = bisect_left(modes, (mode,))
+            j = bisect_right(modes, (mode, float('inf')), i)
+            sids = [sid for _, sid in modes[i:j]]
+        else:
+            sids = self.sids
+        if prefix:
+            prefix = prefix.lower()
+            names = self.names
+            i = bisect_left(names, (prefix,))
+            j = bisect_left(names, (prefix + u'\uffff',), i)
+            matching = set(sid for _, sid in names[i:j])
+            sids = [sid for sid in sids if sid in matching]
+        if min_slots:
+            i = bisect_left(self.slots, (min_slots,))
+            matching = set(sid for _, sid in self.slots[i:])
+            sids = [sid for sid in sids if sid in matching]
+        with self._lock:
+            if len(self._results) > 64:
+                self._results.clear()
+            self._results[key] = sids
+        return sids
+
+    def query(self, cursor=0, limit=10, prefix=None, mode=None,
+              min_slots=None):
+        """Return page of servers matching filters.
+
+        :param cursor: sid of last server of previous page (0 - first page)
+        :param limit: maximum number of servers
+        :param prefix: prefix of name (case insensitive)
+        :param mode: game mode
+        :param min_slots: minimal number of free slots
+        :return: list of :class:`ServerInfo`, cursor of next page
+            (None if it's the last page)
+        """
+        sids = self._match(prefix, mode, min_slots)
+        i = bisect_right(sids, cursor)
+        page = sids[i:i + limit]
+        next_cursor = page[-1] if i + limit < len(sids) else None
+        return [self.servers[sid] for sid in page], next_cursor
+
+
+# secondary indexes of ServerStore: attribute, key of ServerInfo
+_index_keys = (
+    ('_names', lambda s: (s.name.lower(), s.sid)),
+    ('_slots', lambda s: (s.slots, s.sid)),
+    ('_modes', lambda s: (s.mode, s.sid)),
+)
+
+
+class ServerStore(object):
+    """Thread safe registry of game servers.
+
+    Writes are done under lock, readers get immutable :class:`Snapshot`,
+    created only when listed data changed, so iterating never races with
+    registration or expiration. Sorted indexes are updated incrementally
+    and shared with snapshot, index is copied only when it's changed
+    after snapshot was taken, e.g. change of slots copies only index of
+    slots. Server ids grow monotonically, which
+    keeps cursors stable when servers are added or removed.
+
+    Stores of several processes can be kept in sync by exchanging
+    operations recorded in journal (see :meth:`apply`), sids are then
+    allocated as id_cnt * id_step + id_offset. As operations can be
+    lost, :meth:`state` returns operations recreating servers allocated
+    by store, which are sent periodically.
+
+    Servers expire timeout seconds after last registration or ping.
+    Deadlines are kept in :class:`~._utils.TimerWheel`, so ping only
+    reschedules server and :meth:`expire` visits expiring ones.
+
+    :param id_offset: offset of allocated sids
+    :param id_step: step of allocated sids
+    :param timeout: time in seconds after which silent servers expire
+    :param resolution: precision of expiry in seconds
+    """
+    def __init__(self, id_offset=1, id_step=1, timeout=60, resolution=1.0):
+        self._lock = threading.Lock()
+        self._servers = {}  # sid -> ServerInfo
+        self._sids = []
+        self._names = []  # (lower case name, sid)
+        self._slots = []  # (slots, sid)
+        self._modes = []  # (mode, sid)
+        self._shared = set()  # attributes shared with snapshot
+        self.timeout = timeout
+        self._wheel = TimerWheel(resolution,
+                                 int(timeout / resolution) + 2)
+        self._snapshot = None
+        self.id_cnt = 0
+        self.id_offset = id_offset
+        self.id_step = id_step
+        self.journal = None  # list of recorded operations, None - disabled
+
+    def __len__(self):
+        return len(self._servers)
+
+    def add(self, name, host, port, mode='', slots=0):
+        """Register server and return its sid.
+
+        :raise ValueError: when fields have wrong types
+        """
+        _check_server(name, port, mode, slots)
+        with self._lock:
+            self.id_cnt += 1
+            sid = self.id_cnt * self.id_step + self.id_offset - 1
+            self._add(sid, name, host, port, mode, slots)
+        return sid
+
+    def _own(self, attr):
+        """Return index for modification, copied if snapshot shares it."""
+        value = getattr(self, attr)
+        if attr in self._shared:
+            self._shared.remove(attr)
+            value = value.copy() if isinstance(value, dict) else value[:]
+            setattr(self, attr, value)
+        return value
+
+    def _insert(self, attr, key):
+        insort(self._own(attr), key)
+
+    def _delete(self, attr, key):
+        index = self._own(attr)
+        i = bisect_left(index, key)
+        if i < len(index) and index[i] == key:
+            del index[i]
+
+    def _index(self, old, new):
+        """Update indexes of changed server (old or new can be None)."""
+        for attr, key in _index_keys:
+            k_old = old and key(old)
+            k_new = new and key(new)
+            if k_old == k_new:
+                continue
+            if old is not None:
+                self._delete(attr, k_old)
+            if new is not None:
+                self._insert(attr, k_new)
+        self._snapshot = None
+
+    def _add(self, sid, name, host, port, mode, slots):
+        info = ServerInfo(sid, name, host, port, mode, slots)
+        servers = self._own('_servers')
+        old = servers.get(sid)
+        servers[sid] = info
+        if old is None:
+            self._insert('_sids', sid)
+        self._index(old, info)
+        self._wheel.schedule(sid, time.time() + self.timeout)
+        if self.journal is not None:
+            self.journal.append(('add', sid, name, host, port, mode, slots))
+
+    def ping(self, sid, slots=None):
+        """Refresh server and optionally update number of free slots.
+
+        :return: False if server isn't registered
+        :raise ValueError: when slots aren't integer
+        """
+        if slots is not None and not _is_int(slots):
+            raise ValueError('Slots of server have to be integer')
+        with self._lock:
+            return self._ping(sid, slots)
+
+    def _ping(self, sid, slots):
+        info = self._servers.get(sid)
+        if info is None:
+            return False
+        self._wheel.schedule(sid, time.time() + self.timeout)
+        if slots is not None and slots != info.slots:
+            new = self._own('_servers')[sid] = info._replace(slots=slots)
+            self._index(info, new)
+        if self.journal is not None:
+            self.journal.append(('ping', sid, slots))
+        return True
+
+    def remove(self, sids):
+        """Remove servers with given sids."""
+        with self._lock:
+            self._remove(sids)
+
+    def _remove(self, sids):
+        for sid in sids:
+            if sid in self._servers:
+                info = self._own('_servers').pop(sid)
+                self._delete('_sids', sid)
+                self._index(info, None)
+                self._wheel.cancel(sid)
+                if self.journal is not None:
+                    self.journal.append(('remove', sid))
+
+    def apply(self, ops):
+        """Apply operations recorded in journal of other store.
+
+        Applied operations aren't recorded in journal.
+
+        :param ops: sequence of operations
+        """
+        with self._lock:
+            journal, self.journal = self.journal, None
+            try:
+                for op in ops:
+                    if op[0] == 'add':
+                        info = self._servers.get(op[1])
+                        if info is not None and tuple(info) == tuple(op[1:]):
+                            self._ping(op[1], None)  # repeated by sync
+                            continue
+                        self._add(*op[1:])
+                        # keep sids growing in all stores
+                        self.id_cnt = max(self.id_cnt, op[1] // self.id_step)
+                    elif op[0] == 'ping':
+                        self._ping(*op[1:])
+                    elif op[0] == 'remove':
+                        self._remove(op[1:])
+            finally:
+                self.journal = journal
+
+    def state(self):
+        """Return add operations of servers allocated by this store."""
+        step, offset = self.id_step, self.id_offset
+        with self._lock:
+            return [('add',) + tuple(info)
+                    for sid, info in self._servers.iteritems()
+                    if (sid - offset + 1) % step == 0]
+
+    def expire(self, now=None):
+        """Remove servers not seen for timeout seconds.
+
+        :param now: current time (default: time.time())
+        :return: list of removed sids
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            sids = self._wheel.advance(now)
+            self._remove(sids)
+        return sids
+
+    def snapshot(self):
+        """Return current :class:`Snapshot`."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = Snapshot(
+                        self._servers, self._sids, self._names, self._slots,
+                        self._modes)
+                    self._shared.update(('_servers', '_sids', '_names',
+                                         '_slots', '_modes'))
+        return snapshot
+
+
+class RequestProcessor(object):
+    """Processes requests of discovery server.
+
+    Responses longer than chunk_size of server are split into chunk
+    messages with sequence number and total count. Only first chunk is
+    sent in response to request, as source address of request can be
+    spoofed. It carries random cookie, which client returns in resend
+    message to get remaining chunks, so server doesn't send more than
+    one datagram to address which didn't prove it receives them. Chunks
+    of recent responses are kept for max_resends resend messages.
+
+    :param server:
+        server with store, max_page_size, chunk_size, max_chunked and
+        max_resends attributes
+    """
+    def __init__(self, server):
+        self.server = server
+        # (address, oid) -> [chunks, cookie, resends left]
+        self._chunked = OrderedDict()
+
+    def process(self, data, address):
+        """Process received datagram and return list of response datagrams.
+        """
         _logger.debug('Received data: %r', data)
         message = message_factory.unpack(data)
         if message is None:
-            return
+            return []
         name = message.__class__.__name__
-        _logger.info('Received %s message from %s', name, self.client_address)
-        ret_val, err = getattr(self, 'net_' + name)(message)
+        _logger.debug('Received %s message from %s', name, address)
+        if message.__class__ is resend:
+            return self.resend(message, address)
+        method = getattr(self, 'net_' + name, None)
+        if method is None:
+            self.unknown_msg(message, address)
+            return []
+        ret_val, err = method(message, address)
         mid = message_factory.get_type_id(message.__class__)
-        ack_data = message_factory.pack(response(message.oid, mid, ret_val, err))
-        cnt = socket.sendto(ack_data, self.client_address)
-        _logger.info('Sent response to %s', self.client_address)
-        _logger.debug('Sent %d bytes: %r', cnt, ack_data)
+        data = message_factory.pack(response(message.oid, mid, ret_val, err))
+        return self.split(data, message.oid, address)
+
+    def split(self, data, oid, address):
+        """Return list of datagrams with response data.
 
-    def unknown_msg(self, message):
+        :param data: packed response
+        :param oid: id of request
+        :param address: address of client
+        """
+        size = self.server.chunk_size
+        if len(data) <= size:
+            return [data]
+        total = (len(data) + size - 1) // size
+        cookie = os.urandom(8).encode('hex')
+        chunks = [message_factory.pack(chunk(oid, seq, total,
+                                             data[i:i + size], cookie))
+                  for seq, i in enumerate(xrange(0, len(data), size))]
+        chunked = self._chunked
+        chunked[address, oid] = [chunks, cookie, self.server.max_resends]
+        while len(chunked) > self.server.max_chunked:
+            chunked.popitem(last=False)
+        _logger.debug('Response to %s split into %d chunks', address, total)
+        return chunks[:1]
+
+    def resend(self, message, address):
+        """Return requested chunks of response."""
+        key = address, message.oid
+        entry = self._chunked.get(key)
+        if entry is None or entry[1] != message.cookie:
+            _logger.info('Requested chunks of unknown response %d from %s',
+                         message.oid, address)
+            return []
+        chunks = entry[0]
+        entry[2] -= 1
+        if entry[2] <= 0:
+            del self._chunked[key]
+        try:
+            seqs = set(message.chunks)
+        except TypeError:
+            return []
+        return [chunks[seq] for seq in sorted(seqs)
+                if isinstance(seq, int) and 0 <= seq < len(chunks)]
+
+    def unknown_msg(self, message, address):
         name = message.__class__.__name__
         _logger.warning('Received unknown %s message from %s',
-                        name, self.client_address)
+                        name, address)
 
-    def net_register(self, message):
-        sid = self.server.id_cnt = self.server.id_cnt + 1
-        self.server.servers[sid] = [(message.name, self.client_address[0], message.port), 0]
+    def net_register(self, message, address):
+        try:
+            sid = self.server.store.add(message.name, address[0],
+                                        message.port, message.mode,
+                                        message.slots)
+        except ValueError as e:
+            _logger.info('Invalid registration from %s: %s', address, e)
+            return None, Errors.INVALID
         return sid, Errors.NO_ERROR
 
-    def net_get_servers(self, message):
-        s = message.current * message.part_size
-        e = s + message.part_size
-        servers = self.server.servers
-        d = {k: servers[k][0] for k in islice(servers.iterkeys(), s, e)}
-        return d, Errors.NO_ERROR
-
-    def net_ping(self, message):
-        s = self.server.servers.get(message.sid)
-        if s is not None:
-            s[1] = 0
+    def net_get_servers(self, message, address):
+        filters = self._filters(message)
+        if filters is None:
+            _logger.info('Invalid query from %s', address)
+            return None, Errors.INVALID
+        limit = self.server.max_page_size
+        if message.limit is not None:
+            limit = min(message.limit, limit)
+        page, cursor = self.server.store.snapshot().query(
+            message.cursor, limit, filters.get('prefix'), filters.get('mode'),
+            filters.get('min_slots'))
+        return (page, cursor), Errors.NO_ERROR
+
+    def _filters(self, message):
+        """Return filters of get_servers message, None if it's invalid."""
+        filters = message.filters or {}
+        if not isinstance(filters, dict) or not _is_int(message.cursor) or \
+                not (message.limit is None or _is_int(message.limit)):
+            return
+        for key, valid in (('prefix', lambda v: isinstance(v, basestring)),
+                           ('mode', lambda v: isinstance(v, basestring)),
+                           ('min_slots', _is_int)):
+            value = filters.get(key)
+            if value is not None and not valid(value):
+                return
+        return filters
+
+    def net_ping(self, message, address):
+        try:
+            found = self.server.store.ping(message.sid, message.slots)
+        except ValueError:
+            return None, Errors.INVALID
+        if found:
             return None, Errors.NO_ERROR
         else:
             return None, Errors.TIMEOUT
 
 
+class ServerHandler(SocketServer.BaseRequestHandler, object):
+    def handle(self):
+        data, socket = self.request
+        for ack_data in self.server.processor.process(data,
+                                                      self.client_address):
+            cnt = socket.sendto(ack_data, self.client_address)
+            _logger.info('Sent response to %s', self.client_address)
+            _logger.debug('Sent %d bytes: %r', cnt, ack_data)
+
+
 class DiscoveryServer(SocketServer.UDPServer, object):
     allow_reuse_address = True
     max_packet_size = 8192
-    cleaner_period = 10
-    ping_timeout = 6
+    max_page_size = 100
+    chunk_size = 1200  # longer responses are sent in chunks
+    max_chunked = 64  # number of chunked responses kept for resending
+    max_resends = 4  # resend messages accepted for chunked response
+    ping_timeout = 60  # in seconds
+    expiry_resolution = 1.0  # in seconds
 
     def __init__(self, host='', port=5000):
         super(DiscoveryServer, self).__init__((host, port), ServerHandler)
-        self.servers = OrderedDict()
-        self.id_cnt = 0
+        self.store = ServerStore(timeout=self.ping_timeout,
+                                 resolution=self.expiry_resolution)
+        self.processor = RequestProcessor(self)
         self.c_stop = threading.Event()
         self.c_thread = threading.Thread(target=self.cleaner)
         self.c_thread.daemon = True
@@ -90,20 +527,334 @@ class DiscoveryServer(SocketServer.UDPServer, object):
     def __del__(self):
         self.c_stop.set()
 
+    def server_close(self):
+        self.c_stop.set()
+        super(DiscoveryServer, self).server_close()
+
     def cleaner(self):
         while not self.c_stop.is_set():
-            keys = []
-            for k, v in self.servers.iteritems():
-                v[1] += 1
-                if v[1] > self.ping_timeout:
-                    keys.append(k)
-            for k in keys:
-                del self.servers[k]
-            self.c_stop.wait(self.cleaner_period)
+            self.store.expire()
+            self.c_stop.wait(self.expiry_resolution)
+
+
+def _reuse_port_option():
+    option = getattr(socket, 'SO_REUSEPORT', None)
+    if option is None and sys.platform.startswith('linux'):
+        option = 15  # not exported by Python 2
+    return option
+
+
+class BatchedDiscoveryServer(object):
+    """Single threaded discovery server processing datagrams in batches.
+
+    Socket is non-blocking, each :meth:`update` drains up to batch_size
+    waiting datagrams, processes them with one
+    :class:`RequestProcessor` and sends responses afterwards. Expired
+    servers are removed by the same loop, without cleaner thread.
+
+    Several servers (usually in separate processes, see
+    :func:`run_workers`) can share one port with reuse_port and keep
+    their stores in sync with replication sockets. Replication uses
+    UDP, so every sync_interval seconds each server also sends state of
+    servers it registered, which repairs lost operations (removals are
+    repaired by expiry).
+
+    :param host: IP address or name of host
+    :param port: port of host
+    :param reuse_port: bind with SO_REUSEPORT
+    :param repl_socket: UDP socket receiving replicated operations
+    :param peers: addresses of replication sockets of other workers
+    :param worker: number of worker
+    :param workers: number of workers
+    """
+    max_packet_size = 8192
+    max_page_size = 100
+    chunk_size = 1200  # longer responses are sent in chunks
+    max_chunked = 64  # number of chunked responses kept for resending
+    max_resends = 4  # resend messages accepted for chunked response
+    batch_size = 256
+    ops_per_packet = 100  # replicated operations in single datagram
+    max_repl_size = 4096  # bytes of replication datagram (if ops allow)
+    sync_interval = 10.0  # seconds between full state replication
+    ping_timeout = 60  # in seconds
+    expiry_resolution = 1.0  # in seconds
+
+    def __init__(self, host='', port=5000, reuse_port=False,
+                 repl_socket=None, peers=(), worker=0, workers=1):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            option = _reuse_port_option()
+            if option is None:
+                raise ValueError('SO_REUSEPORT not supported')
+            self.socket.setsockopt(socket.SOL_SOCKET, option, 1)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.store = ServerStore(worker + 1, workers, self.ping_timeout,
+                                 self.expiry_resolution)
+        self.processor = RequestProcessor(self)
+        self.repl_socket = repl_socket
+        self.peers = list(peers)
+        if repl_socket is not None:
+            repl_socket.setblocking(False)
+            self.store.journal = []
+        self._next_sync = time.time()
+        self._stop = False
+        self.received = 0
+        self.sent = 0
+
+    def _drain(self, sock):
+        datagrams = []
+        recvfrom = sock.recvfrom
+        size = self.max_packet_size
+        try:
+            for _ in xrange(self.batch_size):
+                datagrams.append(recvfrom(size))
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                _logger.debug('Receiving error: %s', e)
+        return datagrams
+
+    def update(self, timeout=0):
+        """Process waiting datagrams.
+
+        :param int timeout: waiting time for datagrams in milliseconds
+        """
+        sockets = [self.socket]
+        if self.repl_socket is not None:
+            sockets.append(self.repl_socket)
+        r = select.select(sockets, [], [], timeout / 1000.0)[0]
+        if self.socket in r:
+            datagrams = self._drain(self.socket)
+            self.received += len(datagrams)
+            process = self.processor.process
+            responses = []
+            for data, address in datagrams:
+                # malformed datagram mustn't stop the server
+                try:
+                    responses.append((process(data, address), address))
+                except Exception:
+                    _logger.exception('Error while processing datagram '
+                                      'from %s', address)
+            sendto = self.socket.sendto
+            for datagrams, address in responses:
+                for data in datagrams:
+                    try:
+                        sendto(data, address)
+                        self.sent += 1
+                    except socket.error as e:
+                        _logger.debug('Sending error: %s', e)
+        if self.repl_socket is not None:
+            if self.repl_socket in r:
+                for data, address in self._drain(self.repl_socket):
+                    message = message_factory.unpack(data)
+                    if message.__class__ is not replicate:
+                        continue
+                    try:
+                        self.store.apply(message.ops)
+                    except Exception:
+                        _logger.exception('Error while applying operations '
+                                          'from %s', address)
+            self._replicate()
+        now = time.time()
+        if self.sync_interval is not None and now >= self._next_sync:
+            self._next_sync = now + self.sync_interval
+            if self.repl_socket is not None:
+                self._send_ops(self.store.state())
+        self.store.expire(now)
+
+    def _replicate(self):
+        journal = self.store.journal
+        if not journal:
+            return
+        self.store.journal = []
+        self._send_ops(journal)
+
+    def _send_ops(self, ops):
+        n = self.ops_per_packet
+        for i in xrange(0, len(ops), n):
+            self._send_batch(ops[i:i + n])
+
+    def _send_batch(self, ops):
+        data = message_factory.pack(replicate(0, ops))
+        # longer datagrams would be truncated by receiving peers
+        if len(data) > self.max_repl_size and len(ops) > 1:
+            half = len(ops) // 2
+            self._send_batch(ops[:half])
+            self._send_batch(ops[half:])
+            return
+        for peer in self.peers:
+            try:
+                self.repl_socket.sendto(data, peer)
+            except socket.error as e:
+                _logger.debug('Replication error: %s', e)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Process datagrams until :meth:`shutdown` is called."""
+        try:
+            while not self._stop:
+                self.update(poll_interval * 1000)
+        finally:
+            # shutdown called before serving started isn't lost
+            self._stop = False
+
+    def shutdown(self):
+        self._stop = True
+
+    def server_close(self):
+        self.socket.close()
+        if self.repl_socket is not None:
+            self.repl_socket.close()
+
+
+def _worker(host, port, index, repl_sockets):
+    server = BatchedDiscoveryServer(host, port, True, repl_sockets[index],
+        [s.getsockname() for i, s in enumerate(repl_sockets) if i != index],
+        index, len(repl_sockets))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(host='', port=5000, workers=2):
+    """Start processes of :class:`BatchedDiscoveryServer` sharing port
+    with SO_REUSEPORT and replicating registrations to each other.
+
+    :param host: IP address or name of host
+    :param port: port of host
+    :param workers: number of processes
+    :return: list of :class:`multiprocessing.Process`
+    """
+    import multiprocessing
+    repl_sockets = []
+    for _ in xrange(workers):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        repl_sockets.append(s)
+    processes = []
+    for i in xrange(workers):
+        p = multiprocessing.Process(target=_worker,
+                                    args=(host, port, i, repl_sockets))
+        p.daemon = True
+        p.start()
+        processes.append(p)
+    for s in repl_sockets:
+        s.close()
+    return processes
+
+
+class ProbeResult(object):
+    """Result of probing game server with :meth:`DiscoveryClient.probe`.
+
+    :param server: :class:`ServerInfo` or (host, port) of game server
+    """
+    def __init__(self, server):
+        self.server = server
+        host, port = (server.host, server.port) \
+            if isinstance(server, ServerInfo) else server
+        self.probe_address = host, port + probe_port_offset
+        self.sent = 0
+        self.received = 0
+        self.rtt = None  # average round trip time in seconds
+        self.min_rtt = None
+        self.players = None
+        self.slots = None
+
+    def __repr__(self):
+        return '<ProbeResult %s:%d rtt=%s loss=%s>' % (
+            self.probe_address[0], self.probe_address[1] - probe_port_offset,
+            self.rtt, self.loss)
+
+    @property
+    def loss(self):
+        """Fraction of pings without reply (None if nothing was sent)."""
+        if self.sent:
+            return 1 - float(self.received) / self.sent
+
+    def _reply(self, rtt, players, slots):
+        self.received += 1
+        if self.rtt is None:
+            self.rtt = self.min_rtt = rtt
+        else:
+            self.rtt += (rtt - self.rtt) / self.received
+            self.min_rtt = min(self.min_rtt, rtt)
+        self.players = players
+        self.slots = slots
+
+    def _sort_key(self):
+        return self.rtt is None, self.rtt
+
+
+class ProbeResponder(object):
+    """Replies to probes of :meth:`DiscoveryClient.probe`, used by game
+    server.
+
+    Listens on UDP port game port + probe_port_offset, players and slots
+    attributes are sent in replies.
+
+    :param port: port of game server
+    :param host: IP address or name of host
+    :param players: number of players
+    :param slots: number of free slots
+    """
+    max_packet_size = 512
+
+    def __init__(self, port, host='', players=0, slots=0):
+        self.players = players
+        self.slots = slots
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port + probe_port_offset))
+        self.socket.setblocking(False)
+
+    def update(self, timeout=0):
+        """Reply to waiting probes, should be called periodically.
+
+        :param int timeout: waiting time for first probe in milliseconds
+        """
+        timeout /= 1000.0
+        while select.select([self.socket], [], [], timeout)[0]:
+            timeout = 0
+            try:
+                data, address = self.socket.recvfrom(self.max_packet_size)
+            except socket.error as e:
+                _logger.debug('Error: %s', e)
+                break
+            message = message_factory.unpack(data)
+            if message.__class__ is not probe:
+                continue
+            try:
+                self.socket.sendto(message_factory.pack(probe_reply(
+                    message.oid, message.nonce, self.players, self.slots)),
+                    address)
+            except socket.error as e:
+                _logger.debug('Probe reply error: %s', e)
+
+    def close(self):
+        self.socket.close()
 
 
 class DiscoveryClient(object):
+    """Client of discovery server.
+
+    Responses are passed to callbacks from :meth:`update`. Chunked
+    responses are reassembled, remaining chunks are requested after
+    receiving first one and chunks missing for chunk_timeout seconds
+    are requested again (at most chunk_retries times). Requests without
+    response for request_timeout seconds get response with
+    :attr:`Errors.NO_RESPONSE` error.
+
+    :param host: IP address or name of discovery server
+    :param port: port of discovery server
+    """
     max_packet_size = 8192
+    chunk_timeout = 0.2
+    chunk_retries = 3
+    # page of max_page_size (100) servers with entries up to ~1 KB in
+    # 1200 bytes chunks of server
+    max_chunks = 100
+    request_timeout = 2.0
 
     def __init__(self, host, port=5000):
         self.address = socket.gethostbyname(host), port
@@ -112,35 +863,197 @@ class DiscoveryClient(object):
         self.callbacks = {}
         self.default_callback = lambda r: None
         self.oid = 0
+        self._requests = OrderedDict()  # oid -> (deadline, message type id)
+        self._partial = {}  # oid -> [chunks, deadline, retries, cookie]
+        self._assembled = deque(maxlen=16)  # oids of reassembled responses
+        self._probes = []  # running probes
+        self._nonces = {}  # nonce -> (ProbeResult, time of sending)
 
     def _send_msg(self, message_cls, *args):
         oid = self.oid = self.oid + 1
         data = message_factory.pack(message_cls(oid, *args))
         cnt = self.socket.sendto(data, self.address)
         self.response = None
+        self._requests[oid] = (time.time() + self.request_timeout,
+                               message_factory.get_type_id(message_cls))
         _logger.info('Sent %s message to %s', message_cls.__name__, self.address)
         _logger.debug('Sent %d bytes: %r', cnt, data)
         return oid
 
     def update(self, timeout=0):
-        r = select.select([self.socket], [], [], timeout / 1000.0)[0]
-        # sending to closed socket puts some data in receive buffer causing
-        # error while calling recvfrom
-        if len(r) > 0:
+        """Receive waiting datagrams and call callbacks of responses.
+
+        :param int timeout: waiting time for first datagram in milliseconds
+        """
+        timeout /= 1000.0
+        while select.select([self.socket], [], [], timeout)[0]:
+            timeout = 0
+            # sending to closed socket puts some data in receive buffer
+            # causing error while calling recvfrom
             try:
                 data, address = self.socket.recvfrom(self.max_packet_size)
             except Exception as e:
                 _logger.debug('Error: %s', e)
-                return
+                break
             if address == self.address:
                 _logger.debug('Received data: %r', data)
-                r = self.response = message_factory.unpack(data)
-                if r.__class__ != response:
-                    return
-                _logger.info('Received response from %s', address)
-                self.callbacks.pop(r.oid, self.default_callback)(r)
+                self._receive(message_factory.unpack(data))
             else:
-                _logger.info('Unexpected data from %s', address)
+                message = message_factory.unpack(data)
+                if message.__class__ is probe_reply:
+                    self._probe_reply(message, address)
+                else:
+                    _logger.info('Unexpected data from %s', address)
+        if self._partial:
+            self._check_chunks()
+        if self._requests:
+            self._check_requests()
+        if self._probes:
+            self._check_probes()
+
+    def _receive(self, r):
+        if r.__class__ == chunk:
+            r = self._add_chunk(r)
+            if r is None:
+                return
+        self.response = r
+        if r.__class__ != response:
+            return
+        if self._requests.pop(r.oid, None) is None:
+            _logger.info('Unexpected response %s from %s', r.oid,
+                         self.address)
+            return
+        _logger.info('Received response from %s', self.address)
+        self.callbacks.pop(r.oid, self.default_callback)(r)
+
+    def _add_chunk(self, r):
+        partial = self._partial.get(r.oid)
+        if partial is None:
+            if r.oid in self._assembled or r.oid not in self._requests:
+                return  # duplicate of resent chunk or expired request
+            if not _is_int(r.total) or not 0 < r.total <= self.max_chunks:
+                _logger.info('Invalid chunk count %r of response %d',
+                             r.total, r.oid)
+                return
+            partial = self._partial[r.oid] = [[None] * r.total, 0, 0,
+                                              r.cookie]
+        chunks = partial[0]
+        if r.total != len(chunks) or not 0 <= r.seq < len(chunks):
+            _logger.info('Invalid chunk %d/%d of response %d',
+                         r.seq, r.total, r.oid)
+            return
+        new = all(c is None for c in chunks)
+        chunks[r.seq] = r.data
+        partial[1] = time.time() + self.chunk_timeout
+        if None in chunks:
+            if new:  # first chunk proves address, request the rest
+                self._request_chunks(r.oid, partial)
+            return
+        del self._partial[r.oid]
+        self._assembled.append(r.oid)
+        return message_factory.unpack(''.join(chunks))
+
+    def _request_chunks(self, oid, partial):
+        missing = [seq for seq, c in enumerate(partial[0]) if c is None]
+        data = message_factory.pack(resend(oid, missing, partial[3]))
+        self.socket.sendto(data, self.address)
+        _logger.info('Requested %d missing chunks of response %d',
+                     len(missing), oid)
+
+    def _check_chunks(self):
+        now = time.time()
+        for oid, partial in self._partial.items():
+            deadline, retries = partial[1:3]
+            if now < deadline:
+                continue
+            if retries >= self.chunk_retries:
+                _logger.info('Dropped incomplete response %d', oid)
+                del self._partial[oid]
+                continue
+            self._request_chunks(oid, partial)
+            partial[1] = now + self.chunk_timeout
+            partial[2] = retries + 1
+
+    def _check_requests(self):
+        now = time.time()
+        requests = self._requests
+        # deadlines are increasing, as timeout is the same for all requests
+        while requests:
+            oid, (deadline, mid) = next(requests.iteritems())
+            if now < deadline:
+                break
+            del requests[oid]
+            self._partial.pop(oid, None)
+            _logger.info('Request %d timed out', oid)
+            r = response(oid, mid, None, Errors.NO_RESPONSE)
+            self.callbacks.pop(oid, self.default_callback)(r)
+
+    def probe(self, servers, callback=None, timeout=1000, count=3):
+        """Measure latency of game servers concurrently.
+
+        Game servers have to run :class:`ProbeResponder`. Each server
+        gets count pings with random nonces, spread over first part of
+        timeout, all sent from socket of client. Replies are matched by
+        nonce and address and collected by :meth:`update`.
+
+        :param servers:
+            sequence of :class:`ServerInfo` or (host, port) addresses of
+            game servers (hosts as IP addresses)
+        :param callback:
+            function(results) called by :meth:`update` after timeout,
+            with list of :class:`ProbeResult` sorted by rtt
+            (unreachable servers last)
+        :param timeout: duration of probing in milliseconds
+        :param count: number of pings sent to each server
+        :return: list of :class:`ProbeResult`, updated as replies arrive
+        """
+        results = [ProbeResult(s) for s in servers]
+        now = time.time()
+        state = [results, callback, now + timeout / 1000.0, now, count,
+                 timeout / 1000.0 / (count + 1), []]
+        self._probes.append(state)
+        self._send_probes(state, now)
+        return results
+
+    def _send_probes(self, state, now):
+        results, _, _, _, left, interval, nonces = state
+        sendto = self.socket.sendto
+        for r in results:
+            nonce = random.getrandbits(32)
+            while nonce in self._nonces:
+                nonce = random.getrandbits(32)
+            self._nonces[nonce] = r, now
+            nonces.append(nonce)
+            try:
+                sendto(message_factory.pack(probe(0, nonce)), r.probe_address)
+            except socket.error as e:
+                _logger.debug('Probing error: %s', e)
+            r.sent += 1
+        state[3] = now + interval
+        state[4] = left - 1
+
+    def _probe_reply(self, message, address):
+        # nonce is kept for the real server when reply is spoofed
+        entry = self._nonces.get(message.nonce)
+        if entry is None or entry[0].probe_address != address:
+            _logger.info('Unexpected probe reply from %s', address)
+            return
+        del self._nonces[message.nonce]
+        result, sent = entry
+        result._reply(time.time() - sent, message.players, message.slots)
+
+    def _check_probes(self):
+        now = time.time()
+        for state in self._probes[:]:
+            results, callback, deadline, next_round, left = state[:5]
+            if now >= deadline:
+                self._probes.remove(state)
+                for nonce in state[6]:
+                    self._nonces.pop(nonce, None)
+                if callback is not None:
+                    callback(sorted(results, key=ProbeResult._sort_key))
+            elif left > 0 and now >= next_round:
+                self._send_probes(state, now)
 
     def close(self):
         self.socket.close()
@@ -149,14 +1062,183 @@ class DiscoveryClient(object):
         if callback is not None and callable(callback):
             self.callbacks[oid] = callback
         if len(self.callbacks) > 10:
-            keep = sorted(self.callbacks.iterkeys())[:-10]
-            self.callbacks = {k: v for k, v in self.callbacks.iter(keep)}
+            for k in sorted(self.callbacks.iterkeys())[:-10]:
+                del self.callbacks[k]
+
+    def register(self, name, port, mode='', slots=0):
+        return self._send_msg(register, name, port, mode, slots)
+
+    def ping(self, sid, slots=None):
+        return self._send_msg(ping, sid, slots)
+
+    def get_servers(self, cursor=0, limit=10, **filters):
+        """Request page of registered servers.
+
+        Response value is a pair: list of (sid, name, host, port, mode,
+        slots) and cursor of next page (None if it's the last page).
+        Large pages are sent in chunks, so whole listing can be fetched
+        with single request.
+
+        :param cursor: cursor returned with previous page (0 - first page)
+        :param limit:
+            maximum number of servers (None - max_page_size of server)
+        :param filters: prefix (of name), mode and min_slots
+        :return: oid of request
+        """
+        return self._send_msg(get_servers, cursor, limit, filters)
+
+
+def _is_multicast(host):
+    try:
+        return 224 <= int(host.split('.', 1)[0]) <= 239
+    except ValueError:
+        return False
+
+
+class LanAnnouncer(object):
+    """Game server announcing itself on LAN, without discovery server.
+
+    Announcements are sent every interval seconds to multicast group,
+    broadcast address (``'<broadcast>'``) or any single address.
+
+    :param name: name of game server
+    :param port: port of game server
+    :param mode: game mode
+    :param slots: number of free slots
+    :param group: address announcements are sent to
+    :param group_port: port announcements are sent to
+    :param interval: time between announcements in seconds
+    :param ttl: time to live of multicast datagrams (1 - local network)
+    """
+    def __init__(self, name, port, mode='', slots=0, group='239.255.80.80',
+                 group_port=5001, interval=1.0, ttl=1):
+        self.name = name
+        self.port = port
+        self.mode = mode
+        self.slots = slots
+        self.address = group, group_port
+        self.interval = interval
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if group == '<broadcast>':
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        elif _is_multicast(group):
+            self.socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_MULTICAST_TTL, ttl)
+        self.oid = 0
+        self._next = 0
+
+    def announce(self):
+        """Send announcement now."""
+        self.oid += 1
+        data = message_factory.pack(announce(self.oid, self.name, self.port,
+                                             self.mode, self.slots))
+        try:
+            self.socket.sendto(data, self.address)
+        except socket.error as e:
+            _logger.debug('Announcing error: %s', e)
+        self._next = time.time() + self.interval
 
-    def register(self, name, port):
-        return self._send_msg(register, name, port)
+    def update(self):
+        """Send announcement if interval passed, should be called
+        periodically."""
+        if time.time() >= self._next:
+            self.announce()
 
-    def ping(self, sid):
-        return self._send_msg(ping, sid)
+    def close(self):
+        self.socket.close()
+
+
+class LanDiscoveryClient(object):
+    """Client listening to :class:`LanAnnouncer` announcements.
+
+    Announced servers are kept in :class:`ServerStore`, repeated
+    announcements only refresh them and servers not announced for
+    timeout seconds expire. Listing is served from this cache, without
+    any request.
+
+    :param group: multicast group or address to listen on
+        (``''`` - all interfaces, e.g. for broadcast)
+    :param group_port: port to listen on
+    :param timeout: time in seconds after which silent servers expire
+    """
+    max_packet_size = 8192
+
+    def __init__(self, group='239.255.80.80', group_port=5001, timeout=5.0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        option = _reuse_port_option()
+        if option is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, option, 1)
+        if _is_multicast(group):
+            self.socket.bind(('', group_port))
+            self.socket.setsockopt(socket.IPPROTO_IP,
+                                   socket.IP_ADD_MEMBERSHIP,
+                                   socket.inet_aton(group) +
+                                   socket.inet_aton('0.0.0.0'))
+        else:
+            self.socket.bind((group, group_port))
+        self.socket.setblocking(False)
+        self.store = ServerStore(timeout=timeout,
+                                 resolution=min(1.0, timeout / 4.0))
+        self._sids = {}  # (host, port) -> sid
+        self._keys = {}  # sid -> (host, port)
+
+    def update(self, timeout=0):
+        """Receive waiting announcements and expire silent servers.
 
-    def get_servers(self, current=0, part_size=10):
-        return self._send_msg(get_servers, current, part_size)
+        :param int timeout: waiting time for first datagram in milliseconds
+        """
+        timeout /= 1000.0
+        while select.select([self.socket], [], [], timeout)[0]:
+            timeout = 0
+            try:
+                data, address = self.socket.recvfrom(self.max_packet_size)
+            except socket.error as e:
+                _logger.debug('Error: %s', e)
+                break
+            message = message_factory.unpack(data)
+            if message.__class__ is announce:
+                self._announced(message, address[0])
+        for sid in self.store.expire():
+            del self._sids[self._keys.pop(sid)]
+
+    def _announced(self, message, host):
+        try:
+            _check_server(message.name, message.port, message.mode,
+                          message.slots)
+        except ValueError as e:
+            _logger.info('Invalid announcement from %s: %s', host, e)
+            return
+        key = host, message.port
+        store = self.store
+        sid = self._sids.get(key)
+        if sid is not None:
+            info = store._servers.get(sid)
+            if info is not None and info.name == message.name and \
+                    info.mode == message.mode:
+                store.ping(sid, message.slots)
+                return
+            store.remove([sid])
+            del self._keys[sid]
+        sid = store.add(message.name, host, message.port, message.mode,
+                        message.slots)
+        self._sids[key] = sid
+        self._keys[sid] = key
+        _logger.info('Found server %s at %s:%d', message.name, host,
+                     message.port)
+
+    def get_servers(self, cursor=0, limit=None, **filters):
+        """Return page of announced servers.
+
+        :param cursor: cursor returned with previous page (0 - first page)
+        :param limit: maximum number of servers (None - all)
+        :param filters: prefix (of name), mode and min_slots
+        :return: list of :class:`ServerInfo`, cursor of next page
+            (None if it's the last page)
+        """
+        if limit is None:
+            limit = len(self.store) or 1
+        return self.store.snapshot().query(cursor, limit, **filters)
+
+    def close(self):
+        self.socket.close()
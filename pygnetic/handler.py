@@ -13,6 +13,37 @@ class Handler(object):
         """Called when connection is closed."""
         pass
 
+    def on_resume(self):
+        """Called when session is resumed with new connection after
+        reconnection (see :meth:`.Client.reconnect`).
+
+        On server, handler created for new connection is replaced by
+        handler of resumed session, and gets :meth:`on_disconnect`.
+        """
+        pass
+
+    def on_transfer_start(self, transfer):
+        """Called when remote host starts bulk transfer, target can be
+        chosen by setting :attr:`~.transfer.Incoming.target`.
+
+        :param transfer: :class:`~.transfer.Incoming`
+        """
+        pass
+
+    def on_transfer_progress(self, transfer):
+        """Called when chunks of bulk transfer are received.
+
+        :param transfer: :class:`~.transfer.Incoming`
+        """
+        pass
+
+    def on_transfer_done(self, transfer):
+        """Called when bulk transfer is complete.
+
+        :param transfer: :class:`~.transfer.Incoming`
+        """
+        pass
+
     def on_recive(self, message, **kwargs):
         """Called when message is received, but no corresponding
         net_message_name method exist.
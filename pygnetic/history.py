@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Module containing history of synchronized objects for lag compensation.
+
+Server records state of all synchronized objects every tick. When client
+reports action (e.g. shot), server can rewind objects to the moment seen
+by client, taking into account latency of connection and interpolation
+delay of client, and check action against past state.
+
+Example::
+
+    history = History(sync_manager, size=64, cell_size=100)
+
+    # every tick, after update of objects
+    history.record()
+
+    # in handler
+    def net_shoot(self, message, **kwargs):
+        frame = history.rewind_for(self.connection)
+        for obj_id in frame.query((message.x, message.y), 10):
+            ...
+"""
+
+import time
+import logging
+from array import array
+from bisect import bisect_right
+from itertools import product
+
+_logger = logging.getLogger(__name__)
+
+
+class Frame(object):
+    """State of synchronized objects at past tick.
+
+    :param tick: tick number
+    :param time: time of tick
+    :param states: dict: obj_id -> (type_id, values)
+    :param positions: dict: obj_id -> position tuple
+    :param cell_size: size of cell of spatial index
+    """
+    def __init__(self, tick, time, states, positions, cell_size):
+        self.tick = tick
+        self.time = time
+        self.states = states
+        self.positions = positions
+        self.cell_size = float(cell_size)
+        self._grid = None
+
+    def _cell(self, position):
+        c = self.cell_size
+        return tuple(int(v // c) for v in position)
+
+    @property
+    def grid(self):
+        """Spatial index: cell -> list of obj_ids (built on first use)."""
+        if self._grid is None:
+            grid = self._grid = {}
+            for obj_id, position in self.positions.iteritems():
+                grid.setdefault(self._cell(position), []).append(obj_id)
+        return self._grid
+
+    def query(self, position, radius):
+        """Return ids of objects within radius from position.
+
+        :param position: tuple of coordinates
+        :param radius: distance
+        :return: list of obj_ids
+        """
+        grid = self.grid
+        low = self._cell([v - radius for v in position])
+        high = self._cell([v + radius for v in position])
+        r2 = radius * radius
+        positions = self.positions
+        found = []
+        for cell in product(*[xrange(l, h + 1) for l, h in zip(low, high)]):
+            for obj_id in grid.get(cell, ()):
+                d2 = sum((a - b) ** 2
+                         for a, b in zip(positions[obj_id], position))
+                if d2 <= r2:
+                    found.append(obj_id)
+        return found
+
+
+class History(object):
+    """Ring buffers of past states of objects synchronized by manager.
+
+    :param manager: :class:`~.syncobject.SyncObjectManager`
+    :param size: number of recorded ticks
+    :param position:
+        names of variables with position used by spatial index,
+        types without them aren't indexed
+    :param cell_size: size of cell of spatial index
+    """
+    clock = staticmethod(time.time)
+
+    def __init__(self, manager, size=64, position=('x', 'y'), cell_size=64):
+        self.manager = manager
+        self.size = size
+        self.position = tuple(position)
+        self.cell_size = cell_size
+        self.tick = 0  # number of last recorded tick
+        self._ticks = array('l', [-1]) * size  # slot -> tick
+        self._times = array('d', [0.0]) * size  # slot -> time of tick
+        self._objects = {}  # obj_id -> [type_id, last tick, ticks, values]
+        self._pos_ids = {}  # type_id -> var ids of position or None
+        self._frames = {}  # tick -> Frame
+
+    def _position_ids(self, type_id):
+        try:
+            return self._pos_ids[type_id]
+        except KeyError:
+            names = self.manager._types[type_id][2]
+            if all(n in names for n in self.position):
+                ids = tuple(names.index(n) for n in self.position)
+            else:
+                ids = None
+            self._pos_ids[type_id] = ids
+            return ids
+
+    def record(self, tick=None):
+        """Record state of all synchronized objects.
+
+        Should be called once per tick, after state of objects was updated.
+
+        :param tick: tick number (default: last tick + 1)
+        :return: tick number
+        """
+        last = self.tick
+        tick = self.tick = last + 1 if tick is None else tick
+        size = self.size
+        ticks = self._ticks
+        times = self._times
+        frames = self._frames
+        # skipped ticks are cleared, keeping times ordered for tick_at
+        last_time = times[last % size] if ticks[last % size] == last else 0.0
+        for skipped in xrange(max(last + 1, tick - size + 1), tick):
+            s = skipped % size
+            frames.pop(ticks[s], None)
+            ticks[s] = -1
+            times[s] = last_time
+        slot = tick % size
+        frames.pop(ticks[slot], None)
+        ticks[slot] = tick
+        times[slot] = self.clock()
+        manager = self.manager
+        objects = self._objects
+        for obj_id, r in manager._objs.iteritems():
+            obj = r()
+            rec = manager._sync_objs.get(obj) if obj is not None else None
+            if rec is None:
+                continue
+            h = objects.get(obj_id)
+            if h is None:
+                h = objects[obj_id] = [rec[0], tick, array('l', [-1]) * size,
+                                       [None] * size]
+            h[1] = tick
+            h[2][slot] = tick
+            h[3][slot] = tuple(getattr(obj, n, None)
+                               for n in manager._types[rec[0]][2])
+        for obj_id in [k for k, h in objects.iteritems()
+                       if tick - h[1] >= size]:
+            del objects[obj_id]
+        return tick
+
+    def tick_at(self, t):
+        """Return newest recorded tick not later than time t
+        (oldest recorded one if there is none).
+
+        :param t: time
+        :return: tick number or None if nothing was recorded
+        """
+        ticks = self._ticks
+        times = self._times
+        size = self.size
+        # slots starting after the last tick are in order of time
+        first = (self.tick + 1) % size
+        if first and times[0] <= t:
+            end = size - first + bisect_right(times, t, 0, first)
+        else:
+            end = bisect_right(times, t, first, size) - first
+        for i in xrange(end - 1, -1, -1):
+            tick = ticks[(first + i) % size]
+            if tick >= 0:
+                return tick
+        for i in xrange(end, size):  # oldest one
+            tick = ticks[(first + i) % size]
+            if tick >= 0:
+                return tick
+
+    def time_of(self, tick):
+        """Return time of recorded tick (None if it isn't recorded)."""
+        slot = tick % self.size
+        if self._ticks[slot] == tick:
+            return self._times[slot]
+
+    def rewind(self, tick):
+        """Return :class:`Frame` with state of objects at given tick.
+
+        :param tick: tick number
+        :return: :class:`Frame` or None if tick isn't recorded
+        """
+        frame = self._frames.get(tick)
+        if frame is not None:
+            return frame
+        slot = tick % self.size
+        if self._ticks[slot] != tick:
+            return
+        states = {}
+        positions = {}
+        for obj_id, (type_id, _, ticks, values) in self._objects.iteritems():
+            if ticks[slot] == tick:
+                v = values[slot]
+                states[obj_id] = (type_id, v)
+                pos_ids = self._position_ids(type_id)
+                if pos_ids is not None:
+                    positions[obj_id] = tuple(v[i] for i in pos_ids)
+        frame = self._frames[tick] = Frame(tick, self._times[slot], states,
+                                           positions, self.cell_size)
+        return frame
+
+    def rewind_for(self, connection, render_delay=0.1, now=None):
+        """Return :class:`Frame` with state seen by remote host
+        of connection.
+
+        :param connection: :class:`~.connection.Connection`
+        :param render_delay:
+            interpolation delay of client
+            (see :attr:`.RemoteObject.render_delay`)
+        :param now: current time (default: clock())
+        :return: :class:`Frame` or None if nothing was recorded
+        """
+        if now is None:
+            now = self.clock()
+        latency = (connection.rtt or 0) / 2.0
+        tick = self.tick_at(now - latency - render_delay)
+        if tick is not None:
+            return self.rewind(tick)
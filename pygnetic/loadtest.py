@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""Headless load generator spawning many clients across processes.
+
+Usage::
+
+    python -m pygnetic.loadtest config.json -o report.json
+
+Example configuration (JSON)::
+
+    {
+        "host": "localhost",
+        "port": 1337,
+        "n_adapter": "enet",
+        "s_adapter": "msgpack",
+        "clients": 2000,
+        "processes": 8,
+        "connect_rate": 200,
+        "duration": 60,
+        "report_interval": 1,
+        "messages": [["echo", ["msg", "msg_id"]]],
+        "mix": [
+            {"message": "echo", "rate": 10, "args": ["move", 0]}
+        ],
+        "ping": {"message": "echo", "rate": 1, "field": "msg_id",
+                 "args": ["ping", "$seq"]}
+    }
+
+``messages`` have to be listed in the same order as they are registered
+on server. ``mix`` describes messages sent by every client with ``rate``
+per second (entries with rate 0 are disabled). ``ping`` message is used
+to measure round trip time and must be echoed by server with ``field``
+unchanged, pings without reply for ``timeout`` seconds (default: 10) are
+counted as lost. Arguments can contain placeholders: ``$seq`` (sequence
+number), ``$client`` (client number) and ``$time`` (current time).
+
+Server throughput is reported as messages and bytes per second sent by
+clients to server (in) and received from it (out).
+"""
+
+import sys
+import json
+import time
+import logging
+import multiprocessing
+from Queue import Empty
+from collections import OrderedDict
+from . import handler, message, network, serialization
+
+_logger = logging.getLogger(__name__)
+
+defaults = {
+    'host': 'localhost',
+    'port': 1337,
+    'n_adapter': ('enet', 'socket'),
+    's_adapter': ('msgpack', 'json'),
+    'clients': 10,
+    'processes': 1,
+    'connect_rate': 100,
+    'duration': 10,
+    'report_interval': 1,
+    'messages': (),
+    'mix': (),
+    'ping': None,
+}
+
+
+def percentile(values, p):
+    """Return p-th percentile of sorted list of values (None if empty)."""
+    if not values:
+        return
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+class Stats(object):
+    """Counters of single report interval."""
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.lost = 0  # pings without reply
+        self.rtt = []
+        self.connect = []
+        self.disconnects = 0
+        self.errors = 0
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+
+class Bot(handler.Handler):
+    """Client following scripted message mix."""
+    def __init__(self, bot_id, config, message_factory, stats):
+        self.bot_id = bot_id
+        self.stats = stats
+        self.seq = 0
+        self.connected = False
+        self.connect_time = time.time()
+        self.pings = OrderedDict()  # seq -> send time, oldest first
+        self.schedule = [e for e in (self._entry(entry, message_factory)
+                                     for entry in config['mix'])
+                         if e is not None]
+        ping = config['ping']
+        self.ping = ping and self._entry(ping, message_factory)
+        if self.ping is not None:
+            self.ping_cls = self.ping[1]
+            self.ping_field = self.ping_cls._fields.index(ping['field'])
+            self.ping_timeout = ping.get('timeout', 10.0)
+            self.schedule.append(self.ping)
+        else:
+            self.ping_cls = None
+
+    def _entry(self, entry, message_factory):
+        # [next send time, message class, interval, args], None - disabled
+        if entry['rate'] <= 0:
+            return None
+        return [0, message_factory.get_by_name(entry['message']),
+                1.0 / entry['rate'], entry.get('args', ())]
+
+    def _args(self, args, now):
+        for a in args:
+            if a == '$seq':
+                yield self.seq
+            elif a == '$client':
+                yield self.bot_id
+            elif a == '$time':
+                yield now
+            else:
+                yield a
+
+    def on_connect(self):
+        self.connected = True
+        now = time.time()
+        self.stats.connect.append(now - self.connect_time)
+        for entry in self.schedule:
+            entry[0] = now + entry[2] * (self.bot_id % 100) / 100.0
+
+    def on_disconnect(self):
+        self.stats.disconnects += 1
+        if not self.connected:
+            self.stats.errors += 1
+        self.connected = False
+
+    def on_recive(self, message, **kwargs):
+        self.stats.received += 1
+        if message.__class__ is self.ping_cls:
+            sent = self.pings.pop(message[self.ping_field], None)
+            if sent is not None:
+                self.stats.rtt.append(time.time() - sent)
+
+    def _expire_pings(self, now):
+        pings = self.pings
+        deadline = now - self.ping_timeout
+        while pings:
+            seq, sent = next(pings.iteritems())
+            if sent > deadline:
+                break
+            del pings[seq]
+            self.stats.lost += 1
+
+    def update(self, now):
+        if not self.connected:
+            return
+        if self.pings:
+            self._expire_pings(now)
+        for entry in self.schedule:
+            while entry[0] <= now:
+                entry[0] += entry[2]
+                self.seq += 1
+                if entry is self.ping:
+                    self.pings[self.seq] = now
+                try:
+                    self.connection.send(entry[1],
+                                         *self._args(entry[3], now))
+                    self.stats.sent += 1
+                except Exception as e:
+                    _logger.debug('Sending error: %s', e)
+                    self.stats.errors += 1
+
+
+def worker(index, config, n_clients, queue):
+    """Run clients in single process, reporting stats to queue.
+
+    :param index: worker number
+    :param config: configuration dict
+    :param n_clients: number of clients created by worker
+    :param queue: :class:`multiprocessing.Queue` receiving stats
+    """
+    serialization.select_adapter(config['s_adapter'])
+    n_adapter = network.get_adapter(config['n_adapter'])
+    mf = message.MessageFactory()
+    for m in config['messages']:
+        mf.register(m[0], m[1])
+    client = n_adapter.Client(conn_limit=n_clients, message_factory=mf)
+    stats = Stats()
+    bots = []
+    connections = []  # kept for data counters of closed ones
+    data_sent = data_received = 0
+    start = now = time.time()
+    end = start + config['duration']
+    interval = config['report_interval']
+    next_report = start + interval
+    reports = 0
+    connect_period = config['processes'] / float(config['connect_rate'])
+    next_connect = start
+    while now < end:
+        while len(bots) < n_clients and next_connect <= now:
+            bot = Bot(index + len(bots) * config['processes'], config, mf,
+                      stats)
+            bots.append(bot)
+            try:
+                connection = client.connect(config['host'], config['port'])
+                connection.add_handler(bot)
+                connections.append(connection)
+            except Exception as e:
+                _logger.debug('Connecting error: %s', e)
+                stats.errors += 1
+            next_connect += connect_period
+        client.update(1)
+        now = time.time()
+        for bot in bots:
+            bot.update(now)
+        if now >= next_report:
+            reports += 1
+            total = sum(c.data_sent for c in connections)
+            stats.bytes_sent, data_sent = total - data_sent, total
+            total = sum(c.data_received for c in connections)
+            stats.bytes_received, data_received = total - data_received, total
+            report = stats.as_dict()
+            report['t'] = reports * interval
+            report['connected'] = sum(1 for b in bots if b.connected)
+            queue.put((index, report))
+            stats.__init__()
+            next_report += interval
+    queue.put((index, None))
+
+
+def run(config, callback=None):
+    """Run load test and return list of per interval reports.
+
+    :param config: configuration dict (see module documentation)
+    :param callback: function called with every completed interval report
+    :return: list of dicts
+    """
+    c = dict(defaults)
+    c.update(config)
+    queue = multiprocessing.Queue()
+    processes = []
+    n = c['processes']
+    for i in xrange(n):
+        n_clients = c['clients'] // n + (1 if i < c['clients'] % n else 0)
+        p = multiprocessing.Process(target=worker,
+                                    args=(i, c, n_clients, queue))
+        p.daemon = True
+        p.start()
+        processes.append(p)
+    timeout = c['duration'] + 10 * c['report_interval'] + 10
+    reports = collect(queue, n, timeout, callback)
+    for p in processes:
+        p.join(1)
+    return reports
+
+
+def collect(queue, workers, timeout, callback=None):
+    """Merge reports of workers into per interval reports.
+
+    :param queue: queue receiving (worker index, report) pairs
+    :param workers: number of workers
+    :param timeout: maximum waiting time for report in seconds
+    :param callback: function called with every completed interval report
+    :return: list of dicts
+    """
+    intervals = {}
+    latest = [0] * workers  # last reported interval of each worker
+    completed = 0  # intervals up to this time were passed to callback
+    while min(latest) < float('inf'):
+        try:
+            index, report = queue.get(timeout=timeout)
+        except Empty:
+            _logger.error('Workers not responding')
+            break
+        if report is None:
+            latest[index] = float('inf')
+        else:
+            t = latest[index] = report['t']
+            r = intervals.get(t)
+            if r is None:
+                intervals[t] = report
+            else:
+                for k in ('sent', 'received', 'bytes_sent', 'bytes_received',
+                          'lost', 'disconnects', 'errors', 'connected'):
+                    r[k] += report[k]
+                r['rtt'].extend(report['rtt'])
+                r['connect'].extend(report['connect'])
+        if callback is not None:
+            # interval is completed when all workers reported it
+            done = min(latest)
+            for k in sorted(intervals):
+                if completed < k <= done:
+                    completed = k
+                    callback(intervals[k])
+    reports = [intervals[t] for t in sorted(intervals)]
+    if callback is not None:
+        for r in reports:
+            if r['t'] > completed:
+                callback(r)
+    return reports
+
+
+def format_interval(r, interval):
+    """Return line describing single interval report."""
+    rtt = sorted(r['rtt'])
+    interval = float(interval)
+    return '%7.1fs conn %6d  server in %9.1f/s %8.1f KB/s  out %9.1f/s ' \
+        '%8.1f KB/s  rtt ms p50 %s p99 %s  lost %d  disc %d  err %d' % (
+            r['t'], r['connected'], r['sent'] / interval,
+            r['bytes_sent'] / interval / 1024, r['received'] / interval,
+            r['bytes_received'] / interval / 1024, _ms(percentile(rtt, 50)),
+            _ms(percentile(rtt, 99)), r['lost'], r['disconnects'],
+            r['errors'])
+
+
+def _ms(value):
+    return '-' if value is None else '%.1f' % (value * 1000)
+
+
+def summary(reports, config):
+    """Return dict summarizing reports returned by :func:`run`."""
+    rtt = sorted(v for r in reports for v in r['rtt'])
+    connect = sorted(v for r in reports for v in r['connect'])
+    duration = float(len(reports) * config['report_interval']) or 1
+    return {
+        'sent_per_sec': sum(r['sent'] for r in reports) / duration,
+        'received_per_sec': sum(r['received'] for r in reports) / duration,
+        'bytes_sent_per_sec': sum(r['bytes_sent'] for r in reports) /
+        duration,
+        'bytes_received_per_sec': sum(r['bytes_received'] for r in reports) /
+        duration,
+        'lost': sum(r['lost'] for r in reports),
+        'rtt': {p: percentile(rtt, p) for p in (50, 90, 95, 99, 100)},
+        'connect_time': {p: percentile(connect, p)
+                         for p in (50, 90, 95, 99, 100)},
+        'connected': len(connect),
+        'disconnects': sum(r['disconnects'] for r in reports),
+        'errors': sum(r['errors'] for r in reports),
+    }
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description='pygnetic load test.')
+    parser.add_argument('config', help='JSON configuration file')
+    parser.add_argument('-c', '--clients', type=int,
+                        help='override number of clients')
+    parser.add_argument('-p', '--processes', type=int,
+                        help='override number of processes')
+    parser.add_argument('-d', '--duration', type=float,
+                        help='override duration in seconds')
+    parser.add_argument('-o', '--output', help='save report to JSON file')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+    with open(args.config) as f:
+        config = dict(defaults)
+        config.update(json.load(f))
+    for k in ('clients', 'processes', 'duration'):
+        if getattr(args, k) is not None:
+            config[k] = getattr(args, k)
+
+    def print_interval(r):
+        print format_interval(r, config['report_interval'])
+    reports = run(config, print_interval)
+    s = summary(reports, config)
+    print
+    print 'server in %.1f/s %.1f KB/s, out %.1f/s %.1f KB/s, connected %d, ' \
+        'lost %d, disconnects %d, errors %d' % (
+            s['sent_per_sec'], s['bytes_sent_per_sec'] / 1024,
+            s['received_per_sec'], s['bytes_received_per_sec'] / 1024,
+            s['connected'], s['lost'], s['disconnects'], s['errors'])
+    for name in ('rtt', 'connect_time'):
+        print '%-12s ms: %s' % (name, '  '.join(
+            'p%d %s' % (p, _ms(s[name][p])) for p in sorted(s[name])))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'config': config, 'summary': s, 'intervals': reports},
+                      f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
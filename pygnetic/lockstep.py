@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""Module containing deterministic lockstep sessions.
+
+In lockstep mode only player inputs are exchanged. Every client
+simulates the same frames with inputs of all players, so simulation has
+to be deterministic. Input given at frame N is scheduled for frame
+N + input_delay, which hides latency. Server gathers inputs of frame from
+all players and broadcasts frame when it's complete. Packets are sent
+unreliably, each one carries all unacknowledged inputs (at most
+redundancy frames), so single lost packet doesn't stall simulation.
+Clients periodically report checksums of simulation state, which are
+compared by server to detect desynchronization. Detected
+desynchronization is repeated in every packet sent to clients.
+Disconnected players are dropped from session, their inputs of next
+frames are None.
+
+Example::
+
+    # server
+    session = LockstepServer(server, input_delay=3)
+    session.start(server.connections())
+    while True:
+        server.update()
+        session.update()
+
+    # client
+    session = LockstepClient(connection)
+    while True:
+        client.update()
+        inputs = session.next_frame()  # None until frame is complete
+        if inputs is not None:
+            simulate(inputs)
+            session.send_input(read_input())
+            if session.frame % 30 == 0:
+                session.report_checksum(session.frame - 1, state_hash())
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class LockstepServer(object):
+    """Server side of lockstep session, relaying inputs of players.
+
+    :param server: :class:`~.server.Server`
+    :param input_delay: number of frames between input and its execution
+    :param redundancy: maximum number of frames sent in single packet
+    :param send_params: keyword arguments for sending (default: unreliable)
+    """
+    def __init__(self, server, input_delay=3, redundancy=8,
+                 send_params=None):
+        self.server = server
+        self.input_delay = input_delay
+        self.redundancy = redundancy
+        self.send_params = {'flags': 0} if send_params is None \
+            else send_params
+        self.players = []  # connections in player order
+        self.complete = input_delay - 1  # last frame with all inputs
+        self._player_ids = {}  # connection -> player number
+        self._joined = set()  # players who received start message
+        self._inputs = []  # player -> {frame: input}
+        self._received = []  # player -> last contiguous frame of inputs
+        self._acked = []  # player -> last complete frame received by player
+        self._frames = {}  # frame -> inputs of all players
+        self._checksums = {}  # frame -> {player: checksum}
+        self._reported = []  # player -> last frame with checksum
+        self._dropped = set()  # players without inputs
+        self.desynced = None  # first frame with different checksums
+        server.lockstep = self
+
+    def start(self, connections):
+        """Start session with given connections as players.
+
+        :param connections: iterable over connections
+        """
+        self.players = list(connections)
+        n = len(self.players)
+        self._player_ids = dict((c, i) for i, c in enumerate(self.players))
+        self._inputs = [{} for _ in xrange(n)]
+        self._received = [self.input_delay - 1] * n
+        self._acked = [self.input_delay - 1] * n
+        self._reported = [-1] * n
+        self._checksums = {}
+        self._joined = set()
+        self._dropped = set()
+        for i, c in enumerate(self.players):
+            self._start(i, c)
+
+    def _start(self, player, connection):
+        start = connection.message_factory.get_internal('lockstep_start')
+        connection._send(start(player, len(self.players), self.input_delay))
+
+    def on_input(self, connection, message):
+        """Process inputs received from player
+        """
+        player = self._player_ids.get(connection)
+        if player is None or player in self._dropped:
+            _logger.warning('Input from connection outside of session')
+            return
+        self._joined.add(player)
+        inputs = self._inputs[player]
+        received = self._received[player]
+        # player can't be further ahead, as it waits for complete frames
+        limit = self.complete + self.input_delay + self.redundancy
+        for frame, data in enumerate(message.inputs, message.frame):
+            if frame > limit:
+                _logger.warning('Input of player %d for frame %d beyond %d',
+                                player, frame, limit)
+                break
+            if frame > received:
+                inputs[frame] = data
+        while received + 1 in inputs:
+            received += 1
+        self._received[player] = received
+        self._acked[player] = max(self._acked[player], message.ack)
+        if message.checksum is not None:
+            self._checksum(player, message.checksum_frame, message.checksum)
+        self._assemble()
+
+    def _active(self, values):
+        """Return values of players which weren't dropped."""
+        dropped = self._dropped
+        return [v for p, v in enumerate(values) if p not in dropped]
+
+    def _assemble(self):
+        received = self._active(self._received)
+        complete = min(received) if received else self.complete
+        for frame in xrange(self.complete + 1, complete + 1):
+            self._frames[frame] = tuple(i.pop(frame, None)
+                                        for i in self._inputs)
+        self.complete = complete
+        acked = self._active(self._acked)
+        acked = min(acked) if acked else complete
+        for frame in [f for f in self._frames if f <= acked]:
+            del self._frames[frame]
+
+    def drop(self, player):
+        """Remove player from session, so it doesn't stall other players.
+
+        Inputs of player are None in frames which weren't complete.
+        Disconnected players are dropped by :meth:`update`.
+
+        :param player: player number
+        """
+        if player in self._dropped:
+            return
+        _logger.info('Player %d dropped from lockstep session', player)
+        self._dropped.add(player)
+        self._inputs[player].clear()
+        self._assemble()
+
+    def _checksum(self, player, frame, checksum):
+        self._reported[player] = max(self._reported[player], frame)
+        checksums = self._checksums.setdefault(frame, {})
+        checksums[player] = checksum
+        if len(checksums) >= len(self.players) - len(self._dropped):
+            del self._checksums[frame]
+            self._compare(frame, checksums)
+        # checksums are sent unreliably and only the newest one is
+        # reported, so older frames won't get missing reports
+        reported = [r for r in self._active(self._reported) if r >= 0]
+        oldest = min(reported) if reported else -1
+        for f in [f for f in self._checksums if f < oldest]:
+            self._compare(f, self._checksums.pop(f))
+
+    def _compare(self, frame, checksums):
+        if len(set(checksums.itervalues())) > 1:
+            self.on_desync(frame, checksums)
+
+    def on_desync(self, frame, checksums):
+        """Called when players reported different checksums of frame.
+
+        Default implementation notifies all players with next packets.
+
+        :param frame: frame number
+        :param checksums: dict: player number -> checksum
+        """
+        _logger.error('Desynchronization at frame %d: %s', frame, checksums)
+        if self.desynced is None or frame < self.desynced:
+            self.desynced = frame
+
+    def update(self):
+        """Send complete frames not acknowledged by players.
+
+        Should be called once per tick.
+        """
+        for player, c in enumerate(self.players):
+            if not c.connected:
+                self.drop(player)
+                continue
+            if player in self._dropped:
+                continue
+            if player not in self._joined:
+                self._start(player, c)  # start message could be lost
+                continue
+            first = self._acked[player] + 1
+            last = min(self.complete, first + self.redundancy - 1)
+            frames = tuple(self._frames[f] for f in xrange(first, last + 1))
+            message = c.message_factory.get_internal('lockstep_frames')
+            c._send(message(first, frames, self._received[player],
+                            self.desynced), **self.send_params)
+
+
+class LockstepClient(object):
+    """Client side of lockstep session.
+
+    :param connection: :class:`~.connection.Connection` to server
+    :param redundancy: maximum number of inputs sent in single packet
+    :param send_params: keyword arguments for sending (default: unreliable)
+    """
+    def __init__(self, connection, redundancy=8, send_params=None):
+        self.connection = connection
+        self.redundancy = redundancy
+        self.send_params = {'flags': 0} if send_params is None \
+            else send_params
+        self.player = None  # number of local player
+        self.players = 0  # number of players
+        self.input_delay = 0
+        self.frame = 0  # next frame to simulate
+        self.desynced = None  # first frame with different checksums
+        self._next_input = 0  # frame of next local input
+        self._inputs = {}  # frame -> local input not acknowledged by server
+        self._acked = -1  # last input frame received by server
+        self._frames = {}  # frame -> inputs of all players
+        self._complete = -1  # last frame of contiguous complete frames
+        self._checksum = None  # (frame, checksum) to send
+        connection.parent.lockstep = self
+
+    @property
+    def started(self):
+        return self.player is not None
+
+    def on_start(self, message):
+        """Process start of session
+        """
+        if self.started:
+            return
+        self.player = message.player
+        self.players = message.players
+        self.input_delay = message.input_delay
+        self._next_input = message.input_delay
+        self._acked = self._complete = message.input_delay - 1
+
+    def send_input(self, data):
+        """Send local input for next frame, should be called once per frame.
+
+        :param data: input (serializable value)
+        :return: frame number of input
+        """
+        if not self.started:
+            raise ValueError('Lockstep session not started')
+        frame = self._next_input
+        self._next_input += 1
+        self._inputs[frame] = data
+        self._send()
+        return frame
+
+    def report_checksum(self, frame, checksum):
+        """Send checksum of simulation state after given frame.
+
+        :param frame: frame number
+        :param checksum: int or string
+        """
+        self._checksum = (frame, checksum)
+
+    def _send(self):
+        # server needs contiguous inputs, so oldest unacknowledged are
+        # sent first
+        first = self._acked + 1
+        last = min(self._next_input, first + self.redundancy)
+        inputs = tuple(self._inputs[f] for f in xrange(first, last))
+        if self._checksum is not None:
+            checksum_frame, checksum = self._checksum
+            self._checksum = None
+        else:
+            checksum_frame = checksum = None
+        message = self.connection.message_factory.get_internal(
+            'lockstep_input')
+        self.connection._send(message(first, inputs, self._complete,
+                                      checksum_frame, checksum),
+                              **self.send_params)
+
+    def on_frames(self, message):
+        """Process complete frames received from server
+        """
+        for frame, inputs in enumerate(message.frames, message.frame):
+            if frame > self._complete:
+                self._frames[frame] = inputs
+        while self._complete + 1 in self._frames:
+            self._complete += 1
+        if message.ack > self._acked:
+            for frame in xrange(self._acked + 1, message.ack + 1):
+                self._inputs.pop(frame, None)
+            self._acked = message.ack
+        if message.desynced is not None and self.desynced is None:
+            self.on_desync(message.desynced)
+
+    def on_desync(self, frame):
+        """Called when server detected desynchronization.
+
+        :param frame: frame number
+        """
+        _logger.error('Desynchronization at frame %d', frame)
+        self.desynced = frame
+
+    def update(self):
+        """Resend unacknowledged inputs, should be called once per tick
+        when simulation is waiting for frames.
+        """
+        if self.started:
+            self._send()
+
+    def next_frame(self):
+        """Return inputs of all players for next frame and advance
+        simulation, or None when frame isn't complete yet.
+
+        :return: tuple of inputs indexed by player number
+        """
+        if not self.started:
+            return
+        frame = self.frame
+        if frame < self.input_delay:
+            inputs = (None,) * self.players
+        elif frame <= self._complete:
+            inputs = self._frames.pop(frame)
+        else:
+            return
+        self.frame += 1
+        return inputs
@@ -5,9 +5,37 @@ import logging
 from collections import namedtuple
 from weakref import WeakKeyDictionary, WeakValueDictionary
 import serialization
+import quantize
+from _utils import lazyproperty
 
 _logger = logging.getLogger(__name__)
 
+# messages used internally by library: name, field names, send kwargs,
+# registered in every MessageFactory with negative type ids and handled
+# by Connection._net_<name> methods instead of handlers
+internal_messages = (
+    ('sync_batch', ('created', 'updated', 'removed', 'time'), {}),
+    ('sync_snapshot', ('seq', 'base_seq', 'created', 'updated', 'removed',
+                       'time'), {}),
+    ('sync_ack', ('seq',), {}),
+    ('lockstep_start', ('player', 'players', 'input_delay'), {}),
+    ('lockstep_input', ('frame', 'inputs', 'ack', 'checksum_frame',
+                        'checksum'), {}),
+    ('lockstep_frames', ('frame', 'frames', 'ack', 'desynced'), {}),
+    ('rtt_ping', ('time',), {}),
+    ('rtt_pong', ('time', 'remote_time'), {}),
+    ('rpc_call', ('cid', 'message'), {}),
+    ('rpc_reply', ('cid', 'message', 'error'), {}),
+    ('heartbeat', (), {}),
+    ('session_token', ('token',), {}),
+    ('session_resume', ('token',), {}),
+    ('session_resumed', ('resumed',), {}),
+    ('transfer_start', ('tid', 'name', 'size', 'offset'), {}),
+    ('transfer_chunk', ('tid', 'offset', 'data'), {}),
+    ('transfer_ack', ('tid', 'offset'), {}),
+    ('transfer_cancel', ('tid', 'incoming'), {}),
+)
+
 
 class MessageFactory(object):
     """Class allowing to register new message types and pack/unpack them.
@@ -20,6 +48,8 @@ class MessageFactory(object):
         self._message_names = {}  # name -> message
         self._message_types = WeakValueDictionary()  # type_id -> message
         self._message_params = WeakKeyDictionary()  # message -> type_id, send kwargs
+        self._layouts = WeakKeyDictionary()  # message -> quantize.Layout
+        self._responses = WeakKeyDictionary()  # request -> response message
         if s_adapter is None:
             self.s_adapter = serialization
         else:
@@ -27,12 +57,20 @@ class MessageFactory(object):
         self._type_id_cnt = 0
         self._frozen = False
         self._hash = None
+        self._internal = {}  # message -> name of Connection method
+        self._internal_names = {}  # name -> internal message
+        for i, (name, field_names, kwargs) in enumerate(internal_messages):
+            packet = self._register(-i - 1, name, field_names, kwargs)
+            self._internal[packet] = '_net_' + name
+            self._internal_names[name] = packet
 
     def register(self, name, field_names=tuple(), **kwargs):
         """Register new message type.
 
         :param name: name of message class
-        :param field_names: list of names of message fields
+        :param field_names:
+            list of names of message fields, numeric fields can be declared
+            as (name, :class:`~.quantize.Quantized`) to send them bit-packed
         :param kwargs: additional keyword arguments for send method
         :return: message class (namedtuple)
         """
@@ -41,10 +79,47 @@ class MessageFactory(object):
                             "establishment")
             return
         type_id = self._type_id_cnt = self._type_id_cnt + 1
-        packet = namedtuple(name, field_names)
+        packet = self._register(type_id, name, field_names, kwargs)
         self._message_names[name] = packet
+        return packet
+
+    def register_call(self, name, field_names, response_name,
+                      response_fields=tuple(), **kwargs):
+        """Register pair of request and response messages used by
+        :meth:`~.connection.Connection.call`.
+
+        :param name: name of request message class
+        :param field_names: list of names of request fields
+        :param response_name: name of response message class
+        :param response_fields: list of names of response fields
+        :param kwargs: additional keyword arguments for send method
+        :return: request class, response class
+        """
+        request = self.register(name, field_names, **kwargs)
+        response = self.register(response_name, response_fields, **kwargs)
+        if request is not None and response is not None:
+            self._responses[request] = response
+        return request, response
+
+    def get_response(self, request_cls):
+        """Return response class of request registered with
+        :meth:`register_call`.
+
+        :param request_cls: request message class
+        :return: message class (namedtuple)
+        """
+        try:
+            return self._responses[request_cls]
+        except KeyError:
+            raise ValueError('Message is not a request')
+
+    def _register(self, type_id, name, field_names, kwargs):
+        packet = namedtuple(name, map(quantize.field_name, field_names))
         self._message_types[type_id] = packet
         self._message_params[packet] = (type_id, kwargs)
+        layout = quantize.layout(field_names)
+        if layout is not None:
+            self._layouts[packet] = layout
         return packet
 
     def pack(self, message):
@@ -53,12 +128,21 @@ class MessageFactory(object):
         :param message: object of class created by register
         :return: string
         """
-        type_id = self.get_type_id(message.__class__)
-        message = (type_id,) + message
-        data = self.s_adapter.pack(message)
+        data = self._pack(self._encode(message))
         _logger.debug("Packing message (length: %d)", len(data))
         return data
 
+    def _encode(self, message):
+        type_id = self.get_type_id(message.__class__)
+        layout = self._layouts.get(message.__class__)
+        if layout is not None:
+            message = layout.encode(message)
+        return (type_id,) + message
+
+    @lazyproperty
+    def _pack(self):
+        return self.s_adapter.packer()
+
     def set_frozen(self):
         """Disable ability to register new messages to allow generation
         of hash.
@@ -75,7 +159,11 @@ class MessageFactory(object):
     def _process_message(self, message):
         try:
             type_id = message[0]
-            return self._message_types[type_id](*message[1:])
+            packet = self._message_types[type_id]
+            layout = self._layouts.get(packet)
+            if layout is not None:
+                return packet(*layout.decode(message[1:]))
+            return packet(*message[1:])
         except KeyError:
             _logger.error('Unknown message type_id: %s', type_id)
         except:
@@ -109,7 +197,7 @@ class MessageFactory(object):
                 yield self._process_message(message)
         except:
             _logger.error('Data corrupted')
-            self._reset_unpacker()  # prevent from corrupting next data
+            self.reset_context(context)  # prevent from corrupting next data
             return
 
     def get_by_name(self, name):
@@ -135,6 +223,17 @@ class MessageFactory(object):
         except KeyError:
             raise ValueError('Unknown message type_id')
 
+    def get_internal(self, name):
+        """Returns internal message class with given name.
+
+        :param name: name of internal message
+        :return: message class (namedtuple)
+        """
+        try:
+            return self._internal_names[name]
+        except KeyError:
+            raise ValueError('Unknown internal message name')
+
     def get_params(self, message_cls):
         """Return dict containing sending keyword arguments
 
@@ -174,6 +273,8 @@ class MessageFactory(object):
                 for i in ids:
                     p = self._message_types[i]
                     l.append((i, p.__name__, p._fields))
+                    if p in self._layouts:
+                        l.append(self._layouts[p].spec())
                 # should be the same on 32 & 64 platforms
                 self._hash = hash(tuple(l)) & 0xffffffff
             return self._hash
@@ -182,8 +283,4 @@ class MessageFactory(object):
 
 
 message_factory = MessageFactory()
-#update_remoteobject = message_factory.register('update_remoteobject', (
-#    'type_id',
-#    'obj_id',
-#    'variables'
-#), channel=1, flags=0)
+
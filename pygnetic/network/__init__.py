@@ -8,14 +8,34 @@ from .. import server
 selected_adapter = None
 
 
+def _find_adapter(names):
+    if isinstance(names, basestring):
+        names = (names,)
+    for i, name in enumerate(names):
+        adapter = _utils.find_adapter(__name__, name)
+        if adapter is None:
+            continue
+        wrap = getattr(adapter, 'wrap', None)
+        if wrap is None:
+            return adapter
+        # wrapping adapter, wrap first available of remaining adapters
+        adapter = _find_adapter(names[i + 1:])
+        if adapter is not None:
+            return wrap(adapter)
+        return
+
+
 def select_adapter(names):
     """Select first found adapter
 
+    Wrapping adapter (e.g. netsim) is applied to first available adapter
+    following it on the list.
+
     :param names: string or list of strings with names of libraries
     :return: adapter module
     """
     global selected_adapter
-    selected_adapter = _utils.find_adapter(__name__, names)
+    selected_adapter = _find_adapter(names)
     return selected_adapter
 
 
@@ -25,7 +45,7 @@ def get_adapter(names):
     :param names: string or list of strings with names of libraries
     :return: adapter module
     """
-    return _utils.find_adapter(__name__, names)
+    return _find_adapter(names)
 
 
 class Client(object):
@@ -42,6 +42,25 @@ class Connection(connection.Connection):
         """Connection state."""
         return self.peer.state == enet.PEER_STATE_CONNECTED
 
+    _measure_rtt = False  # peer statistics are used instead of pings
+    heartbeat_interval = None  # enet peers have own pings and timeouts
+    bulk_channel = 1  # transfers don't delay messages on channel 0
+
+    @property
+    def rtt(self):
+        """Mean round trip time in seconds."""
+        return self.peer.roundTripTime / 1000.0
+
+    @property
+    def rtt_var(self):
+        """Mean deviation of round trip time in seconds."""
+        return self.peer.roundTripTimeVariance / 1000.0
+
+    @property
+    def packet_loss(self):
+        """Mean fraction of lost packets."""
+        return self.peer.packetLoss / 65536.0  # ENET_PEER_PACKET_LOSS_SCALE
+
     @lazyproperty
     def address(self):
         """Connection address."""
@@ -73,6 +92,7 @@ class Server(server.Server):
                 self._get(event.peer.data)._receive(event.packet.data,
                         channel=event.channelID)
             event = host.check_events()
+        self._tick()
 
     @lazyproperty
     def address(self):
@@ -85,7 +105,7 @@ class Client(client.Client):
         super(Client, self).__init__(*args, **kwargs)
         self.host = enet.Host(None, conn_limit)
 
-    def _create_connection(self, host, port, message_factory, channels=1,
+    def _create_connection(self, host, port, message_factory, channels=2,
                            **kwargs):
         host = enet.Address(host, port)
         peer = self.host.connect(host, channels, message_factory.get_hash())
@@ -107,3 +127,4 @@ class Client(client.Client):
                 self._get(event.peer.data)._receive(event.packet.data,
                                                     channel=event.channelID)
             event = host.check_events()
+        self._tick()
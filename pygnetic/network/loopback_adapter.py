@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""Module containing in-memory network adapter.
+
+Connections exchange data through in-process queues, without sockets.
+Data is handed over to remote connection as is (without copying) and
+is processed in order during next :meth:`update` call of receiving side,
+which makes adapter deterministic and suitable for tests and benchmarks.
+Servers are identified only by port, host is ignored.
+"""
+
+import logging
+from collections import deque
+from weakref import WeakValueDictionary
+from .. import connection, server, client
+
+_logger = logging.getLogger(__name__)
+
+EVENT_CONNECT = 0
+EVENT_DISCONNECT = 1
+EVENT_RECEIVE = 2
+
+_servers = WeakValueDictionary()  # port -> Server
+_first_free_port = 49152
+
+
+class Connection(connection.Connection):
+    def __init__(self, parent, peer, message_factory, address,
+                 *args, **kwargs):
+        super(Connection, self).__init__(parent, peer, message_factory,
+                                         *args, **kwargs)
+        self.peer = peer  # remote Connection
+        self.address = address
+        self.connected = False
+        self._pending = []  # data sent before connection establishment
+
+    def _send_data(self, data, channel=0, **kwargs):
+        peer = self.peer
+        if peer is not None:
+            peer.parent._events.append((EVENT_RECEIVE, peer, data, channel))
+        elif self._pending is not None:
+            self._pending.append((data, channel))
+
+    def _link(self, peer):
+        self.peer = peer
+        self.connected = True
+        pending, self._pending = self._pending, None
+        # pending data already passed through _send_data (which can be
+        # shadowed by wrapping adapter), so it's handed over directly
+        for data, channel in pending:
+            peer.parent._events.append((EVENT_RECEIVE, peer, data, channel))
+
+    def disconnect(self, *args):
+        """Request a disconnection."""
+        peer, self.peer = self.peer, None
+        self._pending = None
+        self.connected = False
+        if peer is not None:
+            peer.peer = None
+            peer.parent._events.append((EVENT_DISCONNECT, peer, None, 0))
+        self.parent._events.append((EVENT_DISCONNECT, self, None, 0))
+
+
+class _Host(object):
+    def update(self, timeout=0):
+        """Process queued network events.
+
+        :param int timeout: ignored, there is nothing to wait for
+        """
+        events = self._events
+        conn_map = self.conn_map
+        # events queued while processing are left for next update
+        for _ in xrange(len(events)):
+            e_type, conn, data, channel = events.popleft()
+            if e_type == EVENT_RECEIVE:
+                if conn.connected:
+                    conn._receive(data, channel=channel)
+            elif e_type == EVENT_CONNECT:
+                self._handle_connect(conn, data)
+            elif conn._key in conn_map:
+                conn.connected = False
+                conn._pending = None
+                conn._disconnect()
+        self._tick()
+
+
+class Server(_Host, server.Server):
+    def __init__(self, host='', port=0, conn_limit=4, handler=None,
+                 message_factory=None, *args, **kwargs):
+        global _first_free_port
+        super(Server, self).__init__(host, port, conn_limit, handler,
+                                     message_factory, *args, **kwargs)
+        if port == 0:
+            while _first_free_port in _servers:
+                _first_free_port += 1
+            port = _first_free_port
+        elif port in _servers:
+            raise ValueError('Port %d is already in use' % port)
+        _servers[port] = self
+        self.address = (host, port)
+        self._events = deque()
+
+    def _create_connection(self, peer, message_factory):
+        connection = Connection(self, peer, message_factory,
+                                ('loopback', peer.id))
+        peer.parent._events.append((EVENT_CONNECT, peer, None, 0))
+        peer._link(connection)
+        connection._link(peer)
+        return connection, connection.id
+
+    def _handle_connect(self, peer, mf_hash):
+        if peer._pending is None:  # disconnected before acceptance
+            return
+        if len(self.conn_map) >= self.conn_limit:
+            _logger.info('Connection with %s refused, connections limit '
+                         'reached', peer.address)
+        elif self._accept(peer, peer.address, mf_hash):
+            return
+        peer.parent._events.append((EVENT_DISCONNECT, peer, None, 0))
+
+
+class Client(_Host, client.Client):
+    def __init__(self, conn_limit=1, *args, **kwargs):
+        super(Client, self).__init__(conn_limit, *args, **kwargs)
+        self._events = deque()
+
+    def _create_connection(self, host, port, message_factory, **kwargs):
+        connection = Connection(self, None, message_factory, (host, port))
+        server_ = _servers.get(port)
+        if server_ is not None:
+            server_._events.append((EVENT_CONNECT, connection,
+                                    message_factory.get_hash(), 0))
+        else:
+            _logger.info('Connection with %s:%d refused, no server', host,
+                         port)
+            self._events.append((EVENT_DISCONNECT, connection, None, 0))
+        return connection, connection.id
+
+    def _handle_connect(self, connection, data):
+        if connection.connected:
+            connection._connect()
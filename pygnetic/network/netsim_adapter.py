@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""Module containing network adapter simulating network conditions.
+
+It's a wrapper placed in front of other network adapter, selected with
+list of adapter names, e.g. ``n_adapter=('netsim', 'enet', 'socket')``
+wraps first available adapter following ``netsim``.
+
+Conditions are applied to data sent through connection (one message
+per packet), so :class:`Server` simulates downstream and :class:`Client`
+upstream direction. Random decisions are taken from generator seeded
+with ``seed`` and connection id, which makes runs reproducible.
+
+Example::
+
+    server = pygnetic.Server(port=1337, n_adapter=('netsim', 'enet'),
+        conditions=Conditions(latency=80, jitter=20, loss=0.02), seed=1)
+"""
+
+import time
+import heapq
+import random
+import logging
+from functools import partial
+
+_logger = logging.getLogger(__name__)
+
+
+class Conditions(object):
+    """Simulated conditions of network link.
+
+    :param latency: mean one way delay in milliseconds (default: 0)
+    :param jitter: delay variation in milliseconds (default: 0)
+    :param distribution:
+        distribution of delay variation: ``'uniform'`` (latency +/- jitter),
+        ``'normal'`` (jitter is standard deviation) or ``'exponential'``
+        (long tail, jitter is mean of additional delay)
+    :param loss: probability of packet loss (default: 0)
+    :param duplicate: probability of packet duplication (default: 0)
+    :param reorder:
+        probability of sending packet without delay, overtaking
+        packets sent earlier (default: 0)
+    :param bandwidth: link capacity in bytes per second (default: None)
+    :param buffer_size:
+        maximum amount of bytes waiting for bandwidth, packets above
+        are dropped (default: 64KiB)
+    """
+    def __init__(self, latency=0, jitter=0, distribution='uniform', loss=0,
+                 duplicate=0, reorder=0, bandwidth=None,
+                 buffer_size=64 * 1024):
+        if distribution not in ('uniform', 'normal', 'exponential'):
+            raise ValueError('Unknown distribution: %s' % distribution)
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.bandwidth = bandwidth
+        self.buffer_size = buffer_size
+
+    def delay(self, rng):
+        """Return random delay in seconds.
+
+        :param rng: instance of :class:`random.Random`
+        """
+        jitter = self.jitter
+        if not jitter:
+            d = self.latency
+        elif self.distribution == 'uniform':
+            d = self.latency + rng.uniform(-jitter, jitter)
+        elif self.distribution == 'normal':
+            d = rng.gauss(self.latency, jitter)
+        else:
+            d = self.latency + rng.expovariate(1.0 / jitter)
+        return max(d, 0) / 1000.0
+
+
+class Link(object):
+    """Simulation state of single connection.
+
+    :param send: original function sending data
+    :param conditions: :class:`Conditions`
+    :param rng: instance of :class:`random.Random`
+    """
+    def __init__(self, send, conditions, rng):
+        self.send = send
+        self.conditions = conditions
+        self.random = rng
+        self.free_time = 0  # time when link bandwidth will be available
+        self.closed = False
+        self.packets = 0
+        self.dropped = 0
+        self.duplicated = 0
+
+
+class _Simulator(object):
+    clock = staticmethod(time.time)
+
+    def __init__(self, *args, **kwargs):
+        self.conditions = kwargs.pop('conditions', None) or Conditions()
+        self.seed = kwargs.pop('seed', 0)
+        super(_Simulator, self).__init__(*args, **kwargs)
+        self.links = {}  # c_key -> Link
+        # heap of release time, counter, link, data, channel, kwargs
+        self._queue = []
+        self._queue_cnt = 0
+
+    def _create_connection(self, *args, **kwargs):
+        connection, c_key = super(_Simulator, self)._create_connection(
+            *args, **kwargs)
+        conditions = self.conditions
+        if callable(conditions):
+            conditions = conditions(connection)
+        rng = random.Random(self.seed * 1000003 + connection.id)
+        link = Link(connection._send_data, conditions or Conditions(), rng)
+        self.links[c_key] = link
+        # shadow adapter method, Connection._send_message will use it
+        connection._send_data = partial(self._queue_data, link)
+        return connection, c_key
+
+    def _remove(self, c_key):
+        link = self.links.pop(c_key, None)
+        if link is not None:
+            link.closed = True
+        super(_Simulator, self)._remove(c_key)
+
+    def set_conditions(self, connection, conditions):
+        """Change conditions of connection.
+
+        :param connection: :class:`~.connection.Connection`
+        :param conditions: :class:`Conditions`
+        """
+        self.links[connection._key].conditions = conditions
+
+    def _queue_data(self, link, data, channel=0, **kwargs):
+        c = link.conditions
+        rng = link.random
+        link.packets += 1
+        if c.loss and rng.random() < c.loss:
+            link.dropped += 1
+            return
+        now = self.clock()
+        if c.bandwidth:
+            start = max(now, link.free_time)
+            if (start - now) * c.bandwidth > c.buffer_size:
+                link.dropped += 1
+                return
+            link.free_time = now = start + float(len(data)) / c.bandwidth
+        copies = 1
+        if c.duplicate and rng.random() < c.duplicate:
+            link.duplicated += 1
+            copies = 2
+        for _ in xrange(copies):
+            if c.reorder and rng.random() < c.reorder:
+                release = now
+            else:
+                release = now + c.delay(rng)
+            self._queue_cnt += 1
+            heapq.heappush(self._queue, (release, self._queue_cnt, link,
+                                         data, channel, kwargs))
+
+    def _flush(self):
+        queue = self._queue
+        now = self.clock()
+        while queue and queue[0][0] <= now:
+            _, _, link, data, channel, kwargs = heapq.heappop(queue)
+            if not link.closed:
+                link.send(data, channel, **kwargs)
+
+    def update(self, timeout=0):
+        """Send delayed data and process network traffic.
+
+        :param int timeout:
+            waiting time for network events in milliseconds,
+            shortened to release time of first delayed packet
+        """
+        self._flush()
+        if self._queue and timeout > 0:
+            wait = (self._queue[0][0] - self.clock()) * 1000
+            timeout = max(0, min(timeout, int(wait)))
+        super(_Simulator, self).update(timeout)
+        self._flush()
+
+
+class Adapter(object):
+    """Network adapter wrapping other adapter.
+
+    :param adapter: wrapped :term:`network adapter` module
+    """
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.__name__ = '%s(%s)' % (__name__, adapter.__name__.split('.')[-1])
+        self.Server = type('Server', (_Simulator, adapter.Server), {})
+        self.Client = type('Client', (_Simulator, adapter.Client), {})
+
+
+_adapters = {}
+
+
+def wrap(adapter):
+    """Return adapter simulating network conditions in front of
+    given adapter.
+
+    :param adapter: :term:`network adapter` module
+    :return: :class:`Adapter`
+    """
+    try:
+        return _adapters[adapter]
+    except KeyError:
+        a = _adapters[adapter] = Adapter(adapter)
+        return a
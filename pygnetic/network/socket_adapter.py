@@ -52,6 +52,9 @@ class Connection(connection.Connection, Dispacher):
             return
         self.send_buffer = self.send_buffer[num_sent:]
 
+    def _send_backlog(self):
+        return len(self.send_buffer)
+
     def writable(self):
         return (not self.connected) or len(self.send_buffer)
 
@@ -134,6 +137,7 @@ class Server(server.Server, Dispacher):
 
     def update(self, timeout=0):
         asyncore.loop(timeout / 1000.0, False, None, 1)
+        self._tick()
 
     @lazyproperty
     def address(self):
@@ -156,3 +160,4 @@ class Client(client.Client):
 
     def update(self, timeout=0):
         asyncore.poll(timeout / 1000.0, self.conn_map)
+        self._tick()
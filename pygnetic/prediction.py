@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Module containing client side prediction with server reconciliation.
+
+Inputs of locally controlled object are sent as registered messages with
+sequence number field and applied immediately by step function. Server
+applies received inputs with the same function and replicates object
+state together with sequence number of last processed input. When it
+arrives, :class:`Predictor` takes authoritative state and replays inputs
+not processed by server yet.
+
+Example::
+
+    # on both hosts
+    mf.register('move', ('seq', 'dx', 'dy'))
+
+    def step(state, move):
+        return state[0] + move.dx, state[1] + move.dy
+
+    # server
+    class Player(SyncObject):
+        sync_var = ('x', 'y', 'last_input')
+
+    class Handler(pygnetic.Handler):
+        def net_move(self, message, **kwargs):
+            p = self.player
+            p.x, p.y = step((p.x, p.y), message)
+            p.last_input = message.seq
+
+    # client
+    predictor = Predictor(step, (0, 0), state_vars=('x', 'y'))
+
+    class RemotePlayer(RemoteObject):
+        def on_change(self, var_names):
+            predictor.update(self)
+
+    predictor.send(connection, 'move', dx=1, dy=0)
+    x, y = predictor.state  # used for rendering
+"""
+
+import logging
+from collections import deque
+
+_logger = logging.getLogger(__name__)
+
+
+class Predictor(object):
+    """Predicted state of locally controlled object.
+
+    :param step:
+        function(state, input message) returning new state,
+        the same as used by server
+    :param state: initial state
+    :param state_vars:
+        names of variables of :class:`~.syncobject.RemoteObject`
+        forming state, used by :meth:`update`
+    :param seq_var:
+        name of variable of :class:`~.syncobject.RemoteObject` with
+        sequence number of last input processed by server
+    :param seq_field: name of sequence number field of input messages
+    :param max_pending:
+        maximum number of inputs waiting for acknowledgement,
+        oldest are forgotten when exceeded
+    """
+    def __init__(self, step, state=None, state_vars=(), seq_var='last_input',
+                 seq_field='seq', max_pending=128):
+        self.step = step
+        self.state = state
+        self.state_vars = tuple(state_vars)
+        self.seq_var = seq_var
+        self.seq_field = seq_field
+        self.pending = deque(maxlen=max_pending)
+        self.seq = 0  # sequence number of last input
+        self.acked = 0  # sequence number of last input processed by server
+        self.replayed = 0  # number of inputs replayed by last reconcile
+
+    def predict(self, message):
+        """Apply input message locally and remember it for replay.
+
+        :param message: input message with sequence number field
+        :return: predicted state
+        """
+        if len(self.pending) == self.pending.maxlen:
+            _logger.warning('Too many unacknowledged inputs, dropping %s',
+                            self._seq(self.pending[0]))
+        self.pending.append(message)
+        self.state = self.step(self.state, message)
+        return self.state
+
+    def send(self, connection, message, *args, **kwargs):
+        """Create input message with next sequence number, apply it
+        locally and send it to server.
+
+        :param connection: :class:`~.connection.Connection`
+        :param message: message class or message name
+        :param args: parameters used to initialize message object
+        :param kwargs: keyword parameters used to initialize message object
+        :return: sequence number of input
+        """
+        if isinstance(message, basestring):
+            message = connection.message_factory.get_by_name(message)
+        self.seq += 1
+        kwargs[self.seq_field] = self.seq
+        message_ = message(*args, **kwargs)
+        self.predict(message_)
+        connection._send(message_)
+        return self.seq
+
+    def _seq(self, message):
+        return getattr(message, self.seq_field)
+
+    def reconcile(self, seq, state):
+        """Replace state with authoritative one and replay inputs
+        following it.
+
+        :param seq: sequence number of last input included in state
+        :param state: state received from server
+        :return: predicted state
+        """
+        pending = self.pending
+        if seq < self.acked:
+            return self.state  # outdated
+        while pending and self._seq(pending[0]) <= seq:
+            pending.popleft()
+        for message in pending:
+            state = self.step(state, message)
+        self.replayed = len(pending)
+        self.acked = seq
+        self.state = state
+        return state
+
+    def update(self, obj):
+        """Reconcile with state of remote object.
+
+        :param obj: :class:`~.syncobject.RemoteObject`
+        :return: predicted state
+        """
+        seq = getattr(obj, self.seq_var, None)
+        if seq is None:
+            return self.state
+        return self.reconcile(seq, tuple(getattr(obj, n)
+                                         for n in self.state_vars))
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Module containing quantization and bit-packing of numeric fields.
+
+Fields of messages and synchronized objects can be declared as
+``(name, Quantized(min, max, precision))`` instead of plain name. Such
+values are sent as integers using minimal number of bits, e.g. value
+in range 0..4096 with 0.01 precision takes 19 bits instead of 9 bytes
+of msgpack float.
+
+Example::
+
+    pos = Quantized(0, 4096, 0.01)
+    message_factory.register('move', (('x', pos), ('y', pos), 'name'))
+
+note:
+    Bit-packed data is sent as binary string, which requires
+    serialization adapter supporting binary data (msgpack).
+"""
+
+import logging
+from itertools import izip
+from binascii import hexlify
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_logger = logging.getLogger(__name__)
+
+
+class Quantized(object):
+    """Numeric field with bounded range and fixed precision.
+
+    Values outside of range are clamped.
+
+    :param min: minimal value
+    :param max: maximal value
+    :param precision: quantization step
+    """
+    def __init__(self, min, max, precision):
+        if max <= min or precision <= 0:
+            raise ValueError('Invalid range or precision of Quantized')
+        self.min = min
+        self.max = max
+        self.precision = precision
+        self.steps = int((max - min) / float(precision) + 0.5)
+        self.bits = self.steps.bit_length() or 1
+
+    def __repr__(self):
+        return 'Quantized(%r, %r, %r)' % (self.min, self.max, self.precision)
+
+    def encode(self, value):
+        """Return integer code of value."""
+        if value < self.min:
+            value = self.min
+        elif value > self.max:
+            value = self.max
+        return int((value - self.min) / float(self.precision) + 0.5)
+
+    def decode(self, code):
+        """Return value of integer code."""
+        return self.min + min(code, self.steps) * self.precision
+
+    def encode_array(self, values):
+        """Return array of codes (numpy.uint64) of numpy array of values."""
+        values = numpy.clip(values, self.min, self.max)
+        codes = numpy.floor((values - self.min) / float(self.precision) + 0.5)
+        return codes.astype(numpy.uint64)
+
+    def decode_array(self, codes):
+        """Return array of values (numpy.float64) of numpy array of codes."""
+        codes = numpy.minimum(codes, self.steps).astype(numpy.float64)
+        return codes * self.precision + self.min
+
+
+class BitWriter(object):
+    """Writer of integers using given number of bits.
+
+    Values are stored from least significant bit, bytes in little-endian
+    order.
+    """
+    def __init__(self):
+        self._value = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        """Write unsigned integer using given number of bits."""
+        self._value |= (value & ((1 << bits) - 1)) << self.bits
+        self.bits += bits
+
+    def getvalue(self):
+        """Return written data as string."""
+        value = self._value
+        return str(bytearray((value >> i) & 0xff
+                             for i in xrange(0, self.bits, 8)))
+
+
+class BitReader(object):
+    """Reader of data created by :class:`BitWriter`.
+
+    :param data: string
+    """
+    def __init__(self, data):
+        self._value = int(hexlify(data[::-1]), 16) if data else 0
+        self.bits = len(data) * 8
+
+    def read(self, bits):
+        """Read unsigned integer written with given number of bits."""
+        if bits > self.bits:
+            raise ValueError('Not enough data')
+        value = self._value & ((1 << bits) - 1)
+        self._value >>= bits
+        self.bits -= bits
+        return value
+
+
+def field_name(field):
+    """Return name of field declared as name or (name, Quantized)."""
+    return field if isinstance(field, basestring) else field[0]
+
+
+class Layout(object):
+    """Layout of fields, where quantized ones are bit-packed together.
+
+    Encoded values contain plain fields in original order followed by
+    single string with codes of quantized fields.
+
+    :param fields: sequence of names or (name, :class:`Quantized`) pairs
+    """
+    def __init__(self, fields):
+        self.names = tuple(field_name(f) for f in fields)
+        self.quantized = tuple((i, f[1]) for i, f in enumerate(fields)
+                               if not isinstance(f, basestring))
+        self.q_ids = q_ids = frozenset(i for i, _ in self.quantized)
+        self.plain = tuple(i for i in xrange(len(self.names))
+                           if i not in q_ids)
+        self.bits = sum(q.bits for _, q in self.quantized)
+        self.size = (self.bits + 7) // 8
+
+    def spec(self):
+        """Return hashable description of layout."""
+        return tuple((i, q.min, q.max, q.precision) for i, q in self.quantized)
+
+    def encode(self, values):
+        """Return tuple of encoded values.
+
+        :param values: sequence of field values
+        """
+        w = BitWriter()
+        for i, q in self.quantized:
+            w.write(q.encode(values[i]), q.bits)
+        return tuple(values[i] for i in self.plain) + (w.getvalue(),)
+
+    def decode(self, data):
+        """Return tuple of field values from encoded values.
+
+        :param data: sequence returned by :meth:`encode`
+        """
+        values = [None] * len(self.names)
+        for i, v in izip(self.plain, data):
+            values[i] = v
+        r = BitReader(data[len(self.plain)])
+        for i, q in self.quantized:
+            values[i] = q.decode(r.read(q.bits))
+        return tuple(values)
+
+    def encode_many(self, rows):
+        """Return list of encoded rows, vectorized with numpy if available.
+
+        :param rows: sequence of sequences of field values
+        """
+        n = len(rows)
+        if numpy is None or self.bits > 64 or n < 2:
+            return [self.encode(r) for r in rows]
+        acc = numpy.zeros(n, numpy.uint64)
+        offset = 0
+        for i, q in self.quantized:
+            values = numpy.fromiter((r[i] for r in rows), numpy.float64, n)
+            acc |= q.encode_array(values) << numpy.uint64(offset)
+            offset += q.bits
+        size = self.size
+        data = acc.astype('<u8').view(numpy.uint8).reshape(n, 8)[:, :size]
+        data = data.tobytes()
+        plain = self.plain
+        return [tuple(r[i] for i in plain) + (data[k:k + size],)
+                for k, r in izip(xrange(0, n * size, size), rows)]
+
+    def decode_many(self, rows):
+        """Return list of decoded rows, vectorized with numpy if available.
+
+        :param rows: sequence of rows returned by :meth:`encode_many`
+        """
+        n = len(rows)
+        if numpy is None or self.bits > 64 or n < 2:
+            return [self.decode(r) for r in rows]
+        blob = len(self.plain)
+        size = self.size
+        data = numpy.zeros((n, 8), numpy.uint8)
+        try:
+            data[:, :size] = numpy.frombuffer(
+                ''.join(r[blob] for r in rows), numpy.uint8).reshape(n, size)
+        except ValueError:
+            raise ValueError('Not enough data')
+        acc = data.view('<u8').reshape(n)
+        columns = []
+        offset = 0
+        for i, q in self.quantized:
+            codes = (acc >> numpy.uint64(offset)) & numpy.uint64(
+                (1 << q.bits) - 1)
+            columns.append((i, q.decode_array(codes).tolist()))
+            offset += q.bits
+        result = []
+        for k, r in enumerate(rows):
+            values = [None] * len(self.names)
+            for i, v in izip(self.plain, r):
+                values[i] = v
+            for i, column in columns:
+                values[i] = column[k]
+            result.append(tuple(values))
+        return result
+
+
+def layout(fields):
+    """Return :class:`Layout` of fields or None if none is quantized."""
+    if any(not isinstance(f, basestring) for f in fields):
+        return Layout(fields)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Module containing request / response calls over connections.
+
+Request and response messages are declared in pairs with
+:meth:`~.message.MessageFactory.register_call`. Calls are sent with
+:meth:`~.connection.Connection.call`, which returns :class:`Future`
+immediately, so any number of calls can be in flight. Responses are
+matched with calls by correlation id. Handler of request gets
+:class:`Reply` as ``reply`` keyword argument and can answer
+immediately or keep it and answer later.
+
+Example::
+
+    # on both hosts
+    get_item, item = mf.register_call('get_item', ('item_id',),
+                                      'item', ('name', 'count'))
+
+    # server
+    class Handler(pygnetic.Handler):
+        def net_get_item(self, message, reply=None, **kwargs):
+            reply(*self.inventory[message.item_id])
+
+    # client
+    def show(future):
+        if future.error is None:
+            print future.result.name, future.result.count
+
+    for i in xrange(10):  # sent without waiting for responses
+        connection.call(get_item(i), show, timeout=5)
+"""
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+# errors of calls which didn't get response
+TIMEOUT = 'timeout'
+DISCONNECTED = 'disconnected'
+
+
+class Future(object):
+    """Result of call, available when response arrives.
+
+    :param connection: :class:`~.connection.Connection` of call
+    :param cid: correlation id of call
+    """
+    def __init__(self, connection, cid):
+        self.connection = connection
+        self.cid = cid
+        self.done = False
+        self.result = None  # response message
+        self.error = None  # error sent by remote host, TIMEOUT or DISCONNECTED
+        self._callbacks = []
+
+    def __repr__(self):
+        return '<Future #%d %s>' % (self.cid, 'done' if self.done else
+                                    'pending')
+
+    def add_callback(self, callback):
+        """Add function(future) called when call is done (immediately if
+        it's already done).
+        """
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _set(self, result, error):
+        if self.done:
+            return
+        self.done = True
+        self.result = result
+        self.error = error
+        callbacks, self._callbacks = self._callbacks, None
+        for callback in callbacks:
+            callback(self)
+
+    def _timeout(self):
+        if self.connection._calls.pop(self.cid, None) is not None:
+            _logger.info('#%s Call %d timed out', self.connection.id,
+                         self.cid)
+            self._set(None, TIMEOUT)
+
+
+class Reply(object):
+    """Sends response to received call, can be kept and used later.
+
+    Calling object sends response message initialized with given
+    arguments.
+
+    :param connection: :class:`~.connection.Connection` of call
+    :param cid: correlation id of call
+    :param response: class of response message
+    """
+    def __init__(self, connection, cid, response):
+        self.connection = connection
+        self.cid = cid
+        self.response = response
+        self.sent = False
+
+    def __call__(self, *args, **kwargs):
+        self.send(self.response(*args, **kwargs))
+
+    def send(self, message):
+        """Send response message."""
+        self._send(message, None)
+
+    def error(self, error):
+        """Send error instead of response.
+
+        :param error: serializable value
+        """
+        self._send(None, error)
+
+    def _send(self, message, error):
+        if self.sent:
+            raise ValueError('Reply already sent')
+        self.sent = True
+        c = self.connection
+        if not c.connected:
+            return
+        mf = c.message_factory
+        encoded = None if message is None else mf._encode(message)
+        c._send(mf.get_internal('rpc_reply')(self.cid, encoded, error))
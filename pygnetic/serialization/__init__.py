@@ -4,16 +4,17 @@
 from .. import _utils
 
 selected_adapter = None
-pack = unpack = unpacker = None
+pack = unpack = unpacker = packer = None
 
 
 def select_adapter(names):
-    global selected_adapter, pack, unpack, unpacker
+    global selected_adapter, pack, unpack, unpacker, packer
     selected_adapter = _utils.find_adapter(__name__, names)
     if selected_adapter is not None:
         pack = selected_adapter.pack
         unpack = selected_adapter.unpack
         unpacker = selected_adapter.unpacker
+        packer = selected_adapter.packer
 
 
 def get_adapter(name):
@@ -10,6 +10,9 @@ class JSONDecoder(json.JSONDecoder):
         super(JSONDecoder, self).__init__()
         self.buffer = bytearray()
 
+    def __iter__(self):
+        return self
+
     def feed(self, data):
         self.buffer.extend(data)
 
@@ -31,5 +34,9 @@ def unpack(*args):
         pass
 
 
+def packer():
+    return json.JSONEncoder().encode
+
+
 pack = json.dumps
 unpacker = JSONDecoder
@@ -1,8 +1,106 @@
 # -*- coding: utf-8 -*-
 """Module containing serialization adapter for msgpack."""
 
+import struct
 import msgpack
 
-pack = msgpack.packb
-unpack = msgpack.unpackb
-unpacker = msgpack.Unpacker
+EXT_RECT = 1
+EXT_VECTOR2 = 2
+EXT_VECTOR3 = 3
+
+# keyword arguments for msgpack.Packer
+packer_options = {
+    'use_bin_type': True,  # keep str (bin) and unicode (str) apart
+}
+# keyword arguments for msgpack.Unpacker and msgpack.unpackb,
+# limits protect against memory abuse by malformed data
+unpacker_options = {
+    'use_list': False,
+    'raw': False,
+    'max_str_len': 64 * 1024,
+    'max_bin_len': 1024 * 1024,
+    'max_array_len': 64 * 1024,
+    'max_map_len': 16 * 1024,
+    'max_ext_len': 1024,
+}
+# maximum amount of buffered stream data waiting for unpacking
+max_buffer_size = 4 * 1024 * 1024
+
+_ext_encoders = {}  # class -> code, encode function
+_ext_decoders = {}  # code -> decode function
+
+
+def register_ext_type(code, cls, encode, decode):
+    """Register class packed as msgpack extension type.
+
+    :param int code: extension type code (0 - 127)
+    :param cls: class of packed objects
+    :param encode: function returning string with packed object
+    :param decode: function returning object from packed string
+    """
+    if not 0 <= code <= 127:
+        raise ValueError('Extension type code out of range')
+    _ext_encoders[cls] = (code, encode)
+    _ext_decoders[code] = decode
+
+
+def _default(obj):
+    try:
+        code, encode = _ext_encoders[obj.__class__]
+    except KeyError:
+        raise TypeError('Can\'t serialize %r' % (obj,))
+    return msgpack.ExtType(code, encode(obj))
+
+
+def _ext_hook(code, data):
+    try:
+        decode = _ext_decoders[code]
+    except KeyError:
+        return msgpack.ExtType(code, data)
+    try:
+        return decode(data)
+    except Exception as e:
+        # e.g. struct.error of data with wrong length
+        raise ValueError('Corrupted extension type %d: %s' % (code, e))
+
+
+def packer():
+    """Return pack function of new, reusable Packer instance."""
+    return msgpack.Packer(default=_default, **packer_options).pack
+
+
+def unpacker():
+    """Return new stream Unpacker instance."""
+    return msgpack.Unpacker(ext_hook=_ext_hook,
+                            max_buffer_size=max_buffer_size,
+                            **unpacker_options)
+
+
+def unpack(data):
+    try:
+        return msgpack.unpackb(data, ext_hook=_ext_hook, **unpacker_options)
+    except (ValueError, msgpack.UnpackException):
+        pass
+
+
+pack = packer()
+
+try:
+    import pygame
+except ImportError:
+    pass
+else:
+    _rect_struct = struct.Struct('!iiii')
+    register_ext_type(EXT_RECT, pygame.Rect,
+        lambda r: _rect_struct.pack(*r),
+        lambda d: pygame.Rect(_rect_struct.unpack(d)))
+    _math = getattr(pygame, 'math', None)  # pygame >= 1.9.2
+    if _math is not None:
+        _vector2_struct = struct.Struct('!dd')
+        _vector3_struct = struct.Struct('!ddd')
+        register_ext_type(EXT_VECTOR2, _math.Vector2,
+            lambda v: _vector2_struct.pack(*v),
+            lambda d: _math.Vector2(_vector2_struct.unpack(d)))
+        register_ext_type(EXT_VECTOR3, _math.Vector3,
+            lambda v: _vector3_struct.pack(*v),
+            lambda d: _math.Vector3(_vector3_struct.unpack(d)))
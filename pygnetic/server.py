@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 """Module containing base class for adapters representing network servers."""
 
+import os
+import time
 import logging
 from weakref import proxy
 import message
 import event
+import syncobject
 from handler import Handler
+from _utils import TimerWheel
 
 _logger = logging.getLogger(__name__)
 
@@ -25,21 +29,27 @@ class Server(object):
     """
     address = ('', '')
     message_factory = message.message_factory
+    sync_manager = syncobject.sync_manager
+    lockstep = None  # LockstepServer of running session
     handler = None
+    resume_grace = 30.0  # seconds sessions are kept after disconnection
 
     def __init__(self, host='', port=0, conn_limit=4, handler=None,
                  message_factory=None, *args, **kwargs):
         super(Server, self).__init__(*args, **kwargs)
         _logger.info('Server created %s:%d, connections limit: %d',
                      host, port, conn_limit)
-        self.message_factory.set_frozen()
         self.conn_map = {}
         self.conn_limit = conn_limit
         if handler is not None:
             self.handler = handler
             _logger.debug("Using %s handler", handler.__name__)
+        self._timers = TimerWheel(0.05)
+        self._sending = set()  # connections with bulk transfers
+        self._sessions = {}  # resume token -> suspended connection
         if message_factory is not None:
             self.message_factory = message_factory
+        self.message_factory.set_frozen()
 
     def update(self, timeout=0):
         """Process network traffic and update connections.
@@ -50,6 +60,22 @@ class Server(object):
         """
         raise NotImplementedError('Should be implemented by adapter class')
 
+    def _tick(self):
+        """Run expired timers and send chunks of bulk transfers, called
+        by adapters after processing network events."""
+        for obj, method in self._timers.advance(time.time()):
+            getattr(obj, method)()
+        for connection in list(self._sending):
+            connection._pump()
+
+    def send_updates(self):
+        """Send changes of synchronized objects to all connections.
+
+        Should be called once per tick, after game state was updated.
+        """
+        self.sync_manager.update(c for c in self.connections()
+                                 if not c._sync_held)
+
     def _create_connection(self, socket, message_factory):
         raise NotImplementedError('Should be implemented by adapter class')
 
@@ -66,14 +92,67 @@ class Server(object):
                 _logger.error('xxx') # TODO
             self.conn_map[c_key] = connection
             connection._key = c_key
+            # objects are replicated after client tells whether it
+            # resumes session, so they aren't sent to it twice
+            connection._sync_held = self.resume_grace is not None
             event.accepted(self)
             connection._connect()
+            if self.resume_grace is not None:
+                token = connection.resume_token = os.urandom(16).encode('hex')
+                message = connection.message_factory.get_internal(
+                    'session_token')
+                connection._send(message(token))
             return True
         else:
             _logger.info('Connection with %s refused, MessageFactory'
                             ' hash incorrect', address)
             return False
 
+    def _suspend(self, connection):
+        if self.resume_grace is None:
+            return False
+        _logger.info('#%s Session suspended for %.1f s', connection.id,
+                     self.resume_grace)
+        self._sessions[connection.resume_token] = connection
+        self._timers.schedule((connection, '_expire_session'),
+                              time.time() + self.resume_grace)
+        return True
+
+    def _resume(self, connection, token):
+        old = self._sessions.pop(token, None)
+        if old is not None:
+            self._timers.cancel((old, '_expire_session'))
+        else:
+            # connection of session can be still open, when client
+            # detected broken link earlier than server
+            old = next((c for c in self.conn_map.itervalues()
+                        if c.resume_token == token and c is not connection),
+                       None)
+            if token is None or old is None:
+                _logger.info('#%s Unknown or expired session', connection.id)
+                return False
+        _logger.info('#%s Resumed session of #%s', connection.id, old.id)
+        # handler created for new connection is discarded, it got
+        # on_connect, so it gets on_disconnect too
+        for h in connection.handlers:
+            h.on_disconnect()
+        handlers, old.handlers = old.handlers, []
+        connection.handlers = []
+        for h in handlers:
+            connection.add_handler(h)
+        connection.remote_objects, old.remote_objects = old.remote_objects, {}
+        self.sync_manager.transfer(old, connection)
+        # old connection posts disconnected event without calling
+        # on_disconnect of handlers, which were moved to new connection
+        if old.connected:
+            old.resume_token = None  # closed instead of suspended
+            old.disconnect()
+        else:
+            old._close()
+        for h in connection.handlers:
+            h.on_resume()
+        return True
+
     def _get(self, c_key):
         return self.conn_map[c_key]
 
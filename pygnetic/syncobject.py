@@ -1,8 +1,20 @@
 # -*- coding: utf-8 -*-
 """Module containing base classes for synchronized objects."""
 
-from weakref import WeakKeyDictionary
-from message import *
+import time
+import logging
+from array import array
+from collections import OrderedDict
+from itertools import izip
+from weakref import WeakKeyDictionary, ref
+import quantize
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_logger = logging.getLogger(__name__)
 
 
 class Mode(object):
@@ -15,25 +27,32 @@ class SyncObject(object):
 
     The base class for local objects to be automatically
     synchronized with remote host. Derived class should replace sync_var
-    to specify a tuple of variable names for synchronization.
+    to specify a tuple of variable names for synchronization and has to be
+    registered with :meth:`SyncObjectManager.register`. Numeric variables
+    can be declared as (name, :class:`~.quantize.Quantized`) to send them
+    with limited precision.
     Each assignment to a variable defined in sync_var will notify
     SyncObjectManager which, depending on sync_mode, will either
     prepare update message (Mode.AUTO) or
     wait with preparation for send_changes call (Mode.MANUAL).
     sync_flags overrides default enet sending flags.
+    sync_priority is base priority of type used by PriorityManager.
     """
     sync_var = ()
     sync_mode = Mode.AUTO
     sync_flags = None
+    sync_priority = 1.0
+    sync_manager = None  # default: syncobject.sync_manager
+    _sync_names = frozenset()  # names of sync_var, set by register
 
     def __init__(self, *args, **kwargs):
         super(SyncObject, self).__init__(*args, **kwargs)
-        SyncObjectManager.register(self)
+        self.sync_manager.add(self)
 
     def __setattr__(self, name, value):
         object.__setattr__(self, name, value)
-        if name in self.sync_var:
-            SyncObjectManager.changed(self, name)
+        if name in self._sync_names:
+            self.sync_manager.changed(self, name)
 
     def on_change(self, var_names):
         """Callback when variable(s) was changed by remote host
@@ -48,57 +67,985 @@ class SyncObject(object):
     def send_changes(self):
         """Prepare update message to send
 
-        When sync_mode is SYNCOBJECT_MODE_MANUAL,
+        When sync_mode is Mode.MANUAL,
         notify SyncObjectManager to prepare update message
         """
-        pass
+        self.sync_manager.schedule(self)
 
     def notify_change(self, var_name):
         """Notify SyncObjectManager that variable was changed
         """
-        SyncObjectManager.changed(self, var_name)
+        self.sync_manager.changed(self, var_name)
+
+
+class _Column(object):
+    """Descriptor of variable stored in column of _ColumnStore.
+
+    Before object is added to manager, values are kept in its __dict__.
+    """
+    def __init__(self, name, index, default):
+        self.name = name
+        self.index = index
+        self.default = default
+
+    def __get__(self, obj, _=None):
+        if obj is None:
+            return self
+        store = obj._sync_store
+        if store is None:
+            return obj.__dict__.get(self.name, self.default)
+        return store.columns[self.index].item(obj._sync_row)
+
+    def __set__(self, obj, value):
+        store = obj._sync_store
+        if store is None:
+            obj.__dict__[self.name] = value
+            return
+        row = obj._sync_row
+        store.columns[self.index][row] = value
+        store.dirty[row, self.index] = True
+
+
+def _dtypes(sync_cls, names):
+    return [sync_cls.sync_dtypes.get(n, numpy.float64) for n in names]
+
+
+class _ColumnStore(object):
+    """Column arrays with values of objects of ColumnarSyncObject type
+    added to one manager."""
+    def __init__(self, names, dtypes, capacity=64):
+        self.names = names
+        self.dtypes = dtypes
+        self.defaults = [numpy.zeros(1, d).item(0) for d in dtypes]
+        self.columns = [numpy.zeros(capacity, d) for d in self.dtypes]
+        self.dirty = numpy.zeros((capacity, len(names)), bool)
+        self.ids = numpy.zeros(capacity, numpy.int64)  # obj_id, 0 - unused
+        self.refs = {}  # row -> weak reference to obj
+        self.free = []
+        self.size = 0  # number of used rows
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        self.columns = [numpy.resize(c, capacity) for c in self.columns]
+        self.dirty = numpy.resize(self.dirty, (capacity, self.dirty.shape[1]))
+        self.ids = numpy.resize(self.ids, capacity)
+
+    def allocate(self, obj, obj_id):
+        if self.free:
+            row = self.free.pop()
+        else:
+            row = self.size
+            self.size += 1
+            if row == len(self.ids):
+                self._grow()
+        # values assigned before object was added
+        pending = obj.__dict__
+        for c, n, d in izip(self.columns, self.names, self.defaults):
+            c[row] = pending.pop(n, d)
+        self.dirty[row] = False
+        self.ids[row] = obj_id
+        self.refs[row] = ref(obj, lambda r, row=row: self.release(row))
+        return row
+
+    def release(self, row):
+        """Stop synchronization of row and make it available when
+        object doesn't exist any longer."""
+        self.ids[row] = 0
+        self.dirty[row] = False
+        if self.refs.get(row) is not None and self.refs[row]() is None:
+            del self.refs[row]
+            self.free.append(row)
+
+    def collect(self):
+        """Return list of (obj_id, var ids, values) of changed objects
+        and clear dirty bitmap."""
+        n = self.size
+        dirty = self.dirty[:n]
+        rows = numpy.flatnonzero(dirty.any(1) & (self.ids[:n] != 0))
+        if not len(rows):
+            return []
+        masks = dirty[rows]
+        dirty[rows] = False
+        values = zip(*[c[rows].tolist() for c in self.columns])
+        return [(obj_id, [i for i, d in enumerate(m) if d], v)
+                for obj_id, m, v in izip(self.ids[rows].tolist(),
+                                         masks.tolist(), values)]
+
+
+class ColumnarSyncObject(SyncObject):
+    """SyncObject keeping variables in numpy column arrays of its type
+
+    Values of sync_var of all objects of type are stored in shared
+    column arrays and instances are only handles to their rows.
+    Assignment sets value and flag in dirty bitmap without calling
+    SyncObjectManager, changes of whole type are collected at once
+    by :meth:`SyncObjectManager.update`, which makes this class suitable
+    for large numbers of objects.
+
+    sync_dtypes maps variable names to numpy dtypes (default: float64),
+    use object dtype for non numeric values. sync_mode is ignored,
+    changes are always sent with next update. Variables have default
+    value of dtype until they are assigned, also before
+    SyncObject.__init__ was called. Each manager keeps its own columns.
+    """
+    sync_dtypes = {}
+    _sync_store = None  # _ColumnStore of manager, set by add
+    _sync_row = None
+    __setattr__ = object.__setattr__
+
+    def send_changes(self):
+        pass
+
+    def notify_change(self, var_name):
+        store = self._sync_store
+        if store is None:
+            return
+        store.dirty[self._sync_row,
+                    self.sync_manager._var_ids[self.__class__][var_name]] = True
+
+
+_NAN = float('nan')
+_STAMP_RANGE = 65536  # timestamps are milliseconds modulo 2 ** 16
+
+
+def _stamp(connection):
+    """Return timestamp of state sent through connection (3 bytes in
+    message instead of 9 of float)."""
+    return int(connection.server_time() * 1000) % _STAMP_RANGE
+
+
+def _unstamp(connection, stamp):
+    """Return server time of received timestamp, sent less than
+    32 seconds ago (or ahead because of clock error)."""
+    now = connection.server_time() * 1000
+    age = (now - stamp) % _STAMP_RANGE
+    if age >= _STAMP_RANGE // 2:
+        age -= _STAMP_RANGE
+    return (now - age) / 1000.0
+
+
+def _value(value, state=_NAN):
+    """Return recorded or interpolated value, given state if it's NaN
+    (computed from None) and None if state is NaN too."""
+    if value != value:
+        return None if state != state else state
+    return value
+
+
+class RemoteObject(object):
+    """Class representing remote SyncObject locally
+
+    Variables listed in sync_var of corresponding SyncObject are set as
+    attributes of object when they are received from remote host.
+
+    Numeric variables listed in interpolate are additionally recorded
+    with time of sending in ring buffers of buffer_size states, which
+    allows rendering smooth movement with :meth:`get` delayed by
+    render_delay seconds. When newer state is missing, value is
+    extrapolated for at most max_extrapolation seconds. States are
+    timestamped by sender with :meth:`.Connection.server_time`, and
+    clock of objects created by manager is server_time of their
+    connection, so network jitter doesn't distort movement. None values
+    aren't interpolated, state before None or after it is held until
+    the next one.
+    """
+    sync_id = None  # object identifier
+    sync_type = None  # corresponding SyncObject class
+    sync_var = ()
+    interpolate = ()  # names of interpolated variables
+    render_delay = 0.1  # seconds
+    max_extrapolation = 0.25  # seconds
+    buffer_size = 16  # number of recorded states
+    clock = staticmethod(time.time)
+    _times = None  # ring buffer of sending times
+
+    def _record(self, t=None):
+        """Record current values of interpolated variables.
+
+        :param t: time of state (default: current time)
+        """
+        size = self.buffer_size
+        if self._times is None:
+            self._times = array('d', [0.0]) * size
+            # name -> ring buffer, None is recorded as NaN
+            self._buffers = dict((name, array('d', [0.0]) * size)
+                                 for name in self.interpolate)
+            self._head = -1
+            self._count = 0
+        head = self._head = (self._head + 1) % size
+        self._times[head] = self.clock() if t is None else t
+        for name, buf in self._buffers.iteritems():
+            value = getattr(self, name)
+            buf[head] = _NAN if value is None else value
+        if self._count < size:
+            self._count += 1
+
+    def get(self, name, t=None):
+        """Return value of interpolated variable at given time.
+
+        :param name: name of variable listed in interpolate
+        :param t: time (default: current time - render_delay)
+        :return: float
+        """
+        if self._times is None:
+            return getattr(self, name)
+        if t is None:
+            t = self.clock() - self.render_delay
+        buf = self._buffers[name]
+        times = self._times
+        size = self.buffer_size
+        k = self._head
+        if t >= times[k]:
+            if self._count < 2:
+                return _value(buf[k])
+            prev = (k - 1) % size
+            dt = times[k] - times[prev]
+            if dt <= 0:
+                return _value(buf[k])
+            e = min(t - times[k], self.max_extrapolation)
+            return _value(buf[k] + (buf[k] - buf[prev]) * e / dt, buf[k])
+        for _ in xrange(self._count - 1):
+            prev = (k - 1) % size
+            if times[prev] <= t:
+                dt = times[k] - times[prev]
+                if dt <= 0:
+                    return _value(buf[k])
+                return _value(buf[prev] + (buf[k] - buf[prev]) *
+                              (t - times[prev]) / dt, buf[prev])
+            k = prev
+        return _value(buf[k])  # older than recorded states
+
+    def sample(self, t=None):
+        """Return dict with values of all interpolated variables at
+        given time.
+
+        :param t: time (default: current time - render_delay)
+        """
+        if t is None:
+            t = self.clock() - self.render_delay
+        return dict((n, self.get(n, t)) for n in self.interpolate)
+
+    def on_create(self):
+        """Callback when object was created by remote host
+        """
+        pass
+
+    def on_change(self, var_names):
+        """Callback when variable(s) was changed by remote host
+        """
+        pass
+
+    def on_remove(self):
+        """Callback when object was removed by remote host
+        """
+        pass
+
+
+class _ConnectionState(object):
+    """Replication state of single connection."""
+    def __init__(self, pending):
+        self.known = set()  # ids of objects created on remote host
+        self.pending = pending  # obj_id -> set of var ids, None - all
+        self.removed = []  # ids of objects to remove on remote host
 
 
 class SyncObjectManager(object):
-    """Manager of SyncObject instances, shouldn't be used by user
+    """Manager of SyncObject types and instances
+
+    Changes of SyncObjects are collected and sent by :meth:`update` at the
+    end of tick, batched in few messages per connection. Received changes
+    are applied to :class:`RemoteObject` instances stored in
+    :attr:`.Connection.remote_objects`.
 
     note:
-        Class used by SyncObject automatically, no need to use it.
+        Types have to be registered in the same order on both hosts.
     """
-    _known_types = {}
-    _sync_objs = WeakKeyDictionary()
-    _type_id_cnt = 0
-    _obj_id_cnt = 0
+    batch_size = 64  # maximum number of objects in single message
+    _state_cls = _ConnectionState
 
-    @classmethod
-    def register(cls, obj):
-        """Registers new object deriving from SyncObject
+    def __init__(self):
+        self._types = {}  # type_id -> sync class, remote class, var names
+        self._type_ids = {}  # sync class -> type_id
+        self._var_ids = {}  # sync class -> {var name: var id}
+        self._layouts = {}  # type_id -> quantize.Layout of quantized types
+        self._stores = {}  # columnar sync class -> _ColumnStore
+        self._values = {}  # obj_id -> values collected from columns in tick
+        self._sync_objs = WeakKeyDictionary()  # obj -> type_id, obj_id, changed
+        self._objs = {}  # obj_id -> weak reference to obj
+        self._scheduled = {}  # obj_id -> obj with changes to send
+        self._created = []
+        self._removed = []
+        self._states = WeakKeyDictionary()  # connection -> _ConnectionState
+        self._type_id_cnt = 0
+        self._obj_id_cnt = 0
+
+    def register(self, sync_cls, remote_cls=None):
+        """Register SyncObject type.
+
+        Can be used as class decorator.
+
+        :param sync_cls: class derived from :class:`SyncObject`
+        :param remote_cls:
+            class derived from :class:`RemoteObject` representing objects
+            on remote host (default: :class:`RemoteObject`)
+        :return: sync_cls
+        """
+        if sync_cls in self._type_ids:
+            raise ValueError('SyncObject type already registered')
+        type_id = self._type_id_cnt = self._type_id_cnt + 1
+        names = tuple(quantize.field_name(f) for f in sync_cls.sync_var)
+        self._types[type_id] = (sync_cls, remote_cls or RemoteObject, names)
+        self._type_ids[sync_cls] = type_id
+        self._var_ids[sync_cls] = dict((n, i) for i, n in enumerate(names))
+        sync_cls._sync_names = frozenset(names)
+        if issubclass(sync_cls, ColumnarSyncObject):
+            if numpy is None:
+                raise ImportError('ColumnarSyncObject requires numpy')
+            # columns are created by add, separately for each manager
+            dtypes = _dtypes(sync_cls, names)
+            for i, (n, d) in enumerate(izip(names, dtypes)):
+                setattr(sync_cls, n, _Column(n, i, numpy.zeros(1, d).item(0)))
+        layout = quantize.layout(sync_cls.sync_var)
+        if layout is not None:
+            self._layouts[type_id] = layout
+        return sync_cls
+
+    def get_type_id(self, sync_cls):
+        """Return type_id of registered SyncObject class
+
+        :param sync_cls: class derived from :class:`SyncObject`
+        :return: int
         """
         try:
-            type_id = cls._known_types[obj.__class__]
+            return self._type_ids[sync_cls]
         except KeyError:
-            type_id = cls._type_id_cnt + 1
-            cls._known_types[obj.__class__] = type_id
-            cls._type_id_cnt = type_id
-        obj_id = cls._obj_id_cnt + 1
-        cls._sync_objs[obj] = (type_id, obj_id, set())
-        cls._obj_id_cnt = obj_id
+            raise ValueError('Unregistered SyncObject type')
 
-    @classmethod
-    def changed(cls, obj, var_name):
-        """Prepares update message
+    def add(self, obj):
+        """Registers new object deriving from SyncObject
         """
-        cls._sync_objs[obj][2].add(var_name)
-        # TODO: finish this
-        # TODO: push update message to queue if in auto mode
+        type_id = self.get_type_id(obj.__class__)
+        obj_id = self._obj_id_cnt = self._obj_id_cnt + 1
+        self._sync_objs[obj] = [type_id, obj_id, set()]
+        self._objs[obj_id] = ref(obj,
+            lambda r, obj_id=obj_id: self._removed.append(obj_id))
+        self._created.append(obj_id)
+        if isinstance(obj, ColumnarSyncObject):
+            cls = obj.__class__
+            store = self._stores.get(cls)
+            if store is None:
+                names = self._types[type_id][2]
+                store = self._stores[cls] = _ColumnStore(
+                    names, _dtypes(cls, names))
+            obj._sync_row = store.allocate(obj, obj_id)
+            obj._sync_store = store
 
-# TODO: pushing update messages from SyncObject
-# TODO: mapping obj type and variables to ints
+    def remove(self, obj):
+        """Stop synchronization of object and remove it from remote hosts
+        """
+        rec = self._sync_objs.pop(obj, None)
+        if rec is not None:
+            if isinstance(obj, ColumnarSyncObject):
+                obj._sync_store.release(obj._sync_row)
+            del self._objs[rec[1]]
+            self._scheduled.pop(rec[1], None)
+            self._removed.append(rec[1])
 
+    def get_id(self, obj):
+        """Return identifier of synchronized object
+        """
+        return self._sync_objs[obj][1]
 
-class RemoteObject(object):
-    """Class representing remote SyncObject locally
+    def changed(self, obj, var_name):
+        """Records change of variable
+        """
+        rec = self._sync_objs.get(obj)
+        if rec is not None:  # None when object isn't initialized yet
+            rec[2].add(var_name)
+            if obj.sync_mode == Mode.AUTO:
+                self._scheduled[rec[1]] = obj
+
+    def schedule(self, obj):
+        """Schedule recorded changes of object to send with next update
+        """
+        rec = self._sync_objs.get(obj)
+        if rec is not None and rec[2]:
+            self._scheduled[rec[1]] = obj
+
+    def _collect(self):
+        changes = []
+        for obj_id, obj in self._scheduled.iteritems():
+            rec = self._sync_objs.get(obj)
+            if rec is not None and rec[2]:
+                var_ids = self._var_ids[obj.__class__]
+                changes.append((obj_id, [var_ids[n] for n in rec[2]]))
+                rec[2] = set()
+        self._scheduled.clear()
+        # values of changed columnar objects are read at once for whole type
+        values = self._values = {}
+        for store in self._stores.itervalues():
+            for obj_id, var_ids, v in store.collect():
+                changes.append((obj_id, var_ids))
+                values[obj_id] = v
+        created, self._created = self._created, []
+        removed, self._removed = self._removed, []
+        for obj_id in removed:
+            self._objs.pop(obj_id, None)
+        return created, changes, removed
+
+    def _get_state(self, connection, created, changes, removed):
+        state = self._states.get(connection)
+        if state is None:
+            # new connection, send all objects
+            state = self._state_cls(dict.fromkeys(self._objs))
+            self._states[connection] = state
+            return state
+        pending = state.pending
+        for obj_id in created:
+            pending[obj_id] = None
+        for obj_id, var_ids in changes:
+            if obj_id not in pending:
+                pending[obj_id] = set(var_ids)
+            elif pending[obj_id] is not None:
+                pending[obj_id].update(var_ids)
+        for obj_id in removed:
+            pending.pop(obj_id, None)
+            if obj_id in state.known:
+                state.known.discard(obj_id)
+                state.removed.append(obj_id)
+        return state
+
+    def update(self, connections):
+        """Send changes of synchronized objects to connections.
+
+        Should be called once per tick, after state of objects was updated.
+
+        :param connections: iterable over connections
+        """
+        created, changes, removed = self._collect()
+        connections = list(connections)
+        for connection in connections:
+            state = self._get_state(connection, created, changes, removed)
+            self._send(connection, state, sorted(state.pending))
+        self._keep_changes(connections, created, changes, removed)
+
+    def _keep_changes(self, connections, created, changes, removed):
+        """Record changes in states of connections which weren't updated
+        (suspended sessions), to send only them when session resumes."""
+        updated = set(connections)
+        for connection in self._states.keys():
+            if connection not in updated:
+                self._get_state(connection, created, changes, removed)
+
+    def transfer(self, old, new):
+        """Move replication state of connection to connection resuming
+        its session.
+
+        Only changes made since the last update sent to old connection
+        are sent, changes sent shortly before disconnection could be lost
+        with it (:class:`SnapshotManager` resends all changes since
+        acknowledged snapshot).
+
+        :param old: suspended connection
+        :param new: connection resuming session
+        """
+        state = self._states.pop(old, None)
+        if state is not None:
+            self._states[new] = state
+
+    def reset(self, connection):
+        """Forget replication state of connection, all objects will be
+        sent again."""
+        self._states.pop(connection, None)
+
+    def _entries(self, state, obj_ids):
+        """Return dict: sync_flags -> (created entries, updated entries)."""
+        groups = {}
+        known = state.known
+        pending = state.pending
+        for obj_id in obj_ids:
+            r = self._objs.get(obj_id)
+            obj = r() if r is not None else None
+            rec = self._sync_objs.get(obj) if obj is not None else None
+            var_ids = pending.pop(obj_id)
+            if rec is None:
+                continue
+            names = self._types[rec[0]][2]
+            values = self._values.get(obj_id)
+            created, updated = groups.setdefault(obj.sync_flags, ([], []))
+            if var_ids is None or obj_id not in known:
+                known.add(obj_id)
+                if values is None:
+                    values = tuple(getattr(obj, n, None) for n in names)
+                created.append((rec[0], obj_id, values))
+            else:
+                changes = []
+                for i in sorted(var_ids):
+                    changes.append(i)
+                    changes.append(getattr(obj, names[i], None)
+                                   if values is None else values[i])
+                updated.append((obj_id, self._encode_changes(rec[0],
+                                                             changes)))
+        if self._layouts:
+            for flags, (created, updated) in groups.items():
+                groups[flags] = (self._encode_created(created), updated)
+        return groups
+
+    def _encode_created(self, created):
+        """Return created entries with quantized values bit-packed."""
+        layouts = self._layouts
+        if not layouts:
+            return created
+        types = {}
+        for k, entry in enumerate(created):
+            if entry[0] in layouts:
+                types.setdefault(entry[0], []).append(k)
+        created = list(created)
+        for type_id, ks in types.iteritems():
+            rows = layouts[type_id].encode_many([created[k][2] for k in ks])
+            for k, values in izip(ks, rows):
+                created[k] = (type_id, created[k][1], values)
+        return created
+
+    def _decode_created(self, created):
+        """Return created entries with bit-packed values decoded."""
+        layouts = self._layouts
+        if not layouts:
+            return created
+        types = {}
+        for k, entry in enumerate(created):
+            if entry[0] in layouts:
+                types.setdefault(entry[0], []).append(k)
+        created = list(created)
+        for type_id, ks in types.iteritems():
+            rows = layouts[type_id].decode_many([created[k][2] for k in ks])
+            for k, values in izip(ks, rows):
+                created[k] = (type_id, created[k][1], values)
+        return created
+
+    def _encode_changes(self, type_id, changes):
+        """Return (var_id, value, ...) tuple with quantized values
+        bit-packed.
+
+        Changed quantized variables are removed from pairs and appended
+        as single string, containing presence bit of each quantized
+        variable of type followed by code of its value, if present.
+        """
+        layout = self._layouts.get(type_id)
+        if layout is None:
+            return tuple(changes)
+        plain = []
+        codes = {}
+        for i in xrange(0, len(changes), 2):
+            if changes[i] in layout.q_ids:
+                codes[changes[i]] = changes[i + 1]
+            else:
+                plain.append(changes[i])
+                plain.append(changes[i + 1])
+        if not codes:
+            return tuple(plain)
+        w = quantize.BitWriter()
+        for i, q in layout.quantized:
+            if i in codes:
+                w.write(1, 1)
+                w.write(q.encode(codes[i]), q.bits)
+            else:
+                w.write(0, 1)
+        plain.append(w.getvalue())
+        return tuple(plain)
+
+    def _decode_changes(self, type_id, changes):
+        """Return (var_id, value, ...) list with quantized values decoded."""
+        changes = list(changes)
+        layout = self._layouts.get(type_id)
+        if layout is None or len(changes) % 2 == 0:
+            return changes
+        r = quantize.BitReader(changes.pop())
+        for i, q in layout.quantized:
+            if r.read(1):
+                changes.append(i)
+                changes.append(q.decode(r.read(q.bits)))
+        return changes
+
+    def _send(self, connection, state, obj_ids):
+        groups = self._entries(state, obj_ids)
+        removed, state.removed = state.removed, []
+        if removed and None not in groups:
+            groups[None] = ([], [])
+        message = connection.message_factory.get_internal('sync_batch')
+        now = _stamp(connection)
+        n = self.batch_size
+        for flags, (created, updated) in groups.iteritems():
+            params = {} if flags is None else {'flags': flags}
+            if flags is not None:
+                removed_ = []
+            else:
+                removed_, removed = removed, []
+            while created or updated or removed_:
+                c, created = created[:n], created[n:]
+                u, updated = updated[:n - len(c)], updated[n - len(c):]
+                k = n - len(c) - len(u)
+                r, removed_ = removed_[:k], removed_[k:]
+                connection._send(message(tuple(c), tuple(u), tuple(r), now),
+                                 **params)
+
+    def apply(self, connection, message):
+        """Apply received changes to remote objects of connection
+        """
+        updated = message.updated
+        if self._layouts:
+            objs = connection.remote_objects
+            type_ids = self._type_ids
+            updated = [(obj_id, self._decode_changes(type_ids.get(
+                           getattr(objs.get(obj_id), 'sync_type', None)),
+                           changes))
+                       for obj_id, changes in updated]
+        self._apply(connection, self._decode_created(message.created),
+                    updated, message.removed,
+                    _unstamp(connection, message.time))
+
+    def _apply(self, connection, created, updated, removed, t=None):
+        objs = connection.remote_objects
+        for type_id, obj_id, values in created:
+            try:
+                sync_cls, remote_cls, names = self._types[type_id]
+            except KeyError:
+                _logger.error('Unknown SyncObject type_id: %s', type_id)
+                continue
+            obj = objs.get(obj_id)
+            new = obj is None
+            if new:
+                obj = objs[obj_id] = remote_cls()
+                obj.sync_id = obj_id
+                obj.sync_type = sync_cls
+                obj.sync_var = names
+                if obj.interpolate:
+                    obj.clock = connection.server_time
+            for name, value in zip(names, values):
+                setattr(obj, name, value)
+            if obj.interpolate:
+                obj._record(t)
+            if new:
+                obj.on_create()
+            else:
+                obj.on_change(names)
+        for obj_id, changes in updated:
+            obj = objs.get(obj_id)
+            if obj is None:
+                _logger.warning('Update of unknown object: %s', obj_id)
+                continue
+            names = obj.sync_var
+            changed = []
+            for i in xrange(0, len(changes), 2):
+                name = names[changes[i]]
+                setattr(obj, name, changes[i + 1])
+                changed.append(name)
+            if obj.interpolate:
+                obj._record(t)
+            obj.on_change(changed)
+        for obj_id in removed:
+            obj = objs.pop(obj_id, None)
+            if obj is not None:
+                obj.on_remove()
+
+
+class _PriorityState(_ConnectionState):
+    """Replication state of connection with priorities and budget."""
+    def __init__(self, pending):
+        super(_PriorityState, self).__init__(pending)
+        self.priority = {}  # obj_id -> accumulated priority
+        self.budget = None  # bytes per tick
+        self.min_rtt = None
+        self.cooldown = 0  # ticks until next budget decrease is possible
+
+
+class PriorityManager(SyncObjectManager):
+    """Manager sending most important changes within bandwidth budget
+
+    Every tick each changed object accumulates priority for each
+    connection, equal to sync_priority of its type multiplied by
+    :meth:`relevance`. Objects with highest priority fitting into byte
+    budget of connection are sent and their priority is reset, the rest
+    waits for next tick with increased priority.
+
+    Budget grows additively while link is healthy and is halved when
+    :attr:`.Connection.packet_loss` or growth of :attr:`.Connection.rtt`
+    indicate congestion.
+    """
+    budget = 1200  # initial bytes per tick
+    min_budget = 256
+    max_budget = 16384
+    budget_increase = 64  # bytes per tick added when link is healthy
+    budget_decrease = 0.5  # budget multiplier on congestion
+    max_loss = 0.02  # packet loss treated as congestion
+    rtt_tolerance = 1.5  # rtt / minimal rtt treated as congestion
+    rtt_slack = 0.02  # seconds of rtt growth always tolerated
+    cooldown = 10  # minimal number of ticks between decreases
+    _state_cls = _PriorityState
+
+    def relevance(self, obj, connection):
+        """Return weight of object for connection.
+
+        Override or replace to take distance to player into account,
+        0 means object isn't sent to connection at all.
+
+        :param obj: synchronized object
+        :param connection: :class:`~.connection.Connection`
+        :return: float
+        """
+        return 1.0
+
+    def update(self, connections):
+        """Send most important changes of synchronized objects to
+        connections.
+
+        Should be called once per tick, after state of objects was updated.
+
+        :param connections: iterable over connections
+        """
+        created, changes, removed = self._collect()
+        connections = list(connections)
+        for connection in connections:
+            state = self._get_state(connection, created, changes, removed)
+            self._adapt_budget(connection, state)
+            self._send(connection, state, self._select(connection, state))
+        self._keep_changes(connections, created, changes, removed)
+
+    def _adapt_budget(self, connection, state):
+        if state.budget is None:
+            state.budget = self.budget
+        rtt = getattr(connection, 'rtt', None)
+        loss = getattr(connection, 'packet_loss', None)
+        congested = loss is not None and loss > self.max_loss
+        if rtt:
+            if state.min_rtt is None or rtt < state.min_rtt:
+                state.min_rtt = rtt
+            congested = congested or \
+                rtt > state.min_rtt * self.rtt_tolerance + self.rtt_slack
+        if state.cooldown > 0:
+            state.cooldown -= 1
+        if congested:
+            if state.cooldown == 0:
+                state.budget = max(self.min_budget,
+                                   int(state.budget * self.budget_decrease))
+                state.cooldown = self.cooldown
+        else:
+            state.budget = min(self.max_budget,
+                               state.budget + self.budget_increase)
+
+    def _select(self, connection, state):
+        """Return ids of objects to send, ordered by priority."""
+        priority = {}
+        old_priority = state.priority
+        objs = self._objs
+        for obj_id in state.pending:
+            r = objs.get(obj_id)
+            obj = r() if r is not None else None
+            if obj is None:
+                continue
+            weight = self.relevance(obj, connection)
+            if weight > 0:
+                priority[obj_id] = (old_priority.get(obj_id, 0) +
+                                    obj.sync_priority * weight)
+        state.priority = priority
+        pack = connection.message_factory._pack
+        budget = state.budget
+        selected = []
+        for obj_id in sorted(priority, key=priority.get, reverse=True):
+            obj = objs[obj_id]()
+            var_ids = state.pending[obj_id]
+            names = self._types[self._sync_objs[obj][0]][2]
+            if var_ids is None or obj_id not in state.known:
+                var_ids = xrange(len(names))
+            size = len(pack(tuple(getattr(obj, names[i], None)
+                                  for i in var_ids))) + 4
+            if selected and size > budget:
+                break
+            budget -= size
+            selected.append(obj_id)
+            del priority[obj_id]
+        return selected
+
+
+class _SnapshotState(object):
+    """Snapshot history of single connection."""
+    def __init__(self):
+        self.ring = OrderedDict()  # seq -> snapshot (obj_id -> type_id, values)
+        self.acked = 0  # sequence number of newest acknowledged snapshot
+        self.applied = 0  # sequence number of newest applied snapshot
+
+
+class SnapshotManager(SyncObjectManager):
+    """Manager replicating world state as snapshots
+
+    Every :meth:`update` creates snapshot of all synchronized objects,
+    which is sent to connection as delta against newest snapshot
+    acknowledged by remote host (or full snapshot when there is none).
+    Unchanged objects aren't sent, removed cost only their id.
+    Snapshots are sent unreliably, lost ones are superseded by next,
+    so there is no need to resend them.
+
+    note:
+        Both hosts have to use SnapshotManager.
     """
-    pass
+    ring_size = 32  # number of snapshots kept per connection
+    send_params = {'flags': 0}  # unreliable for enet
+
+    def __init__(self):
+        super(SnapshotManager, self).__init__()
+        self._seq = 0
+        self._snapshot = {}
+
+    def _take_snapshot(self):
+        created, changes, removed = self._collect()
+        snapshot = dict(self._snapshot)
+        for obj_id in removed:
+            snapshot.pop(obj_id, None)
+        # values of unchanged objects are shared with previous snapshot
+        for obj_id in created + [c[0] for c in changes]:
+            obj = self._objs[obj_id]() if obj_id in self._objs else None
+            rec = self._sync_objs.get(obj) if obj is not None else None
+            if rec is not None:
+                values = self._values.get(obj_id)
+                if values is None:
+                    names = self._types[rec[0]][2]
+                    values = tuple(getattr(obj, n, None) for n in names)
+                snapshot[obj_id] = (rec[0], values)
+        self._snapshot = snapshot
+        self._seq += 1
+        return snapshot
+
+    def _get_state(self, connection):
+        state = self._states.get(connection)
+        if state is None:
+            state = self._states[connection] = _SnapshotState()
+        return state
+
+    def update(self, connections):
+        """Send snapshot of synchronized objects to connections.
+
+        Should be called once per tick, after state of objects was updated.
+
+        :param connections: iterable over connections
+        """
+        snapshot = self._take_snapshot()
+        seq = self._seq
+        for connection in connections:
+            state = self._get_state(connection)
+            base_seq = state.acked
+            base = state.ring.get(base_seq)
+            if base is None:
+                base_seq = 0
+                base = {}
+            created, updated, removed = self._delta(base, snapshot)
+            state.ring[seq] = snapshot
+            while len(state.ring) > self.ring_size:
+                state.ring.popitem(False)
+            message = connection.message_factory.get_internal('sync_snapshot')
+            connection._send(message(seq, base_seq, created, updated,
+                                     removed, _stamp(connection)),
+                             **self.send_params)
+
+    def _delta(self, base, snapshot):
+        created = []
+        updated = []
+        for obj_id, obj in snapshot.iteritems():
+            b = base.get(obj_id)
+            if b is obj:
+                continue
+            if b is None or b[0] != obj[0]:
+                created.append((obj[0], obj_id, obj[1]))
+            elif b[1] != obj[1]:
+                changes = []
+                for i, (old, new) in enumerate(izip(b[1], obj[1])):
+                    if old != new:
+                        changes.append(i)
+                        changes.append(new)
+                updated.append((obj_id, self._encode_changes(obj[0],
+                                                             changes)))
+        removed = tuple(obj_id for obj_id in base if obj_id not in snapshot)
+        return tuple(self._encode_created(created)), tuple(updated), removed
+
+    def transfer(self, old, new):
+        """Move snapshot history of connection to connection resuming
+        its session, next snapshot is sent as delta against last
+        acknowledged one.
+
+        :param old: suspended connection
+        :param new: connection resuming session
+        """
+        state = self._states.pop(old, None)
+        if state is not None:
+            self._states[new] = state
+
+    def ack(self, connection, seq):
+        """Mark snapshot as received by remote host
+        """
+        state = self._get_state(connection)
+        if seq > state.acked and seq in state.ring:
+            state.acked = seq
+
+    def apply_snapshot(self, connection, message):
+        """Apply received snapshot to remote objects of connection
+        """
+        state = self._get_state(connection)
+        if message.seq <= state.applied:
+            return  # outdated or duplicated
+        if message.base_seq == 0:
+            base = {}
+        else:
+            base = state.ring.get(message.base_seq)
+            if base is None:
+                _logger.debug('Missing base of snapshot %d', message.seq)
+                return
+        snapshot = dict(base)
+        for type_id, obj_id, values in self._decode_created(message.created):
+            snapshot[obj_id] = (type_id, tuple(values))
+        for obj_id, changes in message.updated:
+            try:
+                type_id, values = snapshot[obj_id]
+            except KeyError:
+                _logger.warning('Update of unknown object: %s', obj_id)
+                continue
+            values = list(values)
+            changes = self._decode_changes(type_id, changes)
+            for i in xrange(0, len(changes), 2):
+                values[changes[i]] = changes[i + 1]
+            snapshot[obj_id] = (type_id, tuple(values))
+        for obj_id in message.removed:
+            snapshot.pop(obj_id, None)
+        previous = state.ring.get(state.applied, {})
+        state.ring[message.seq] = snapshot
+        while len(state.ring) > self.ring_size:
+            state.ring.popitem(False)
+        state.applied = message.seq
+        ack = connection.message_factory.get_internal('sync_ack')
+        connection._send(ack(message.seq), **self.send_params)
+        self._apply_changes(connection, previous, snapshot,
+                            _unstamp(connection, message.time))
+
+    def _apply_changes(self, connection, previous, snapshot, t=None):
+        objs = connection.remote_objects
+        created = []
+        updated = []
+        for obj_id, obj in snapshot.iteritems():
+            p = previous.get(obj_id)
+            if p is obj:
+                continue
+            if p is None or p[0] != obj[0]:
+                created.append((obj[0], obj_id, obj[1]))
+            else:
+                changes = []
+                for i, (old, new) in enumerate(izip(p[1], obj[1])):
+                    if old != new:
+                        changes.append(i)
+                        changes.append(new)
+                if changes:
+                    updated.append((obj_id, changes))
+        created.sort(key=lambda c: c[1])
+        removed = [obj_id for obj_id in previous if obj_id not in snapshot]
+        self._apply(connection, created, updated, removed, t)
+
 
-# TODO: add methods faking SyncObject attributes
+sync_manager = SyncObjectManager()
+SyncObject.sync_manager = sync_manager
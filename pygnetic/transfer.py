@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Module containing bulk transfers of large data over connections.
+
+Data sent with :meth:`~.connection.Connection.send_file` is split into
+chunks, which are sent by update of client / server interleaved with
+other messages, at most :attr:`~.connection.Connection.bulk_budget`
+bytes per update, so large payload doesn't block other traffic. Amount
+of sent and not acknowledged data of transfer is limited by
+:attr:`~.connection.Connection.transfer_window`. Chunks are sent on
+:attr:`~.connection.Connection.bulk_channel` (second channel of enet).
+Files are read through mmap. Receiver writes chunks directly to preallocated
+bytearray or file and acknowledges them, so interrupted transfer can be
+continued from acknowledged offset.
+
+Example::
+
+    # sender
+    transfer = connection.send_file('maps/level1.map', 'level1')
+
+    # receiver
+    class Handler(pygnetic.Handler):
+        def on_transfer_start(self, transfer):
+            transfer.target = 'cache/%s.map' % transfer.name
+
+        def on_transfer_progress(self, transfer):
+            progress_bar.value = transfer.received / float(transfer.size)
+
+        def on_transfer_done(self, transfer):
+            load_map(transfer.target)
+
+note:
+    Chunks are sent as binary strings, which requires serialization
+    adapter supporting binary data (msgpack).
+"""
+
+import os
+import mmap
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+class Outgoing(object):
+    """Data sent to remote host.
+
+    :param connection: :class:`~.connection.Connection`
+    :param tid: transfer id
+    :param source:
+        path of file, file object or buffer (bytearray, str wrapped
+        with :func:`buffer`, mmap)
+    :param name: name of transfer, passed to receiver
+    :param offset: position to start from (e.g. acknowledged one)
+    :param chunk_size: maximum size of chunk in bytes
+    :param on_progress:
+        function(transfer) called when remote host acknowledges chunks
+    """
+    def __init__(self, connection, tid, source, name=None, offset=0,
+                 chunk_size=16384, on_progress=None):
+        self.connection = connection
+        self.tid = tid
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self._file = None
+        if isinstance(source, basestring):
+            if name is None:
+                name = os.path.basename(source)
+            source = self._file = open(source, 'rb')
+        if hasattr(source, 'fileno'):
+            size = os.fstat(source.fileno()).st_size
+            # empty files can't be mapped
+            self._data = mmap.mmap(source.fileno(), 0,
+                                   access=mmap.ACCESS_READ) if size else ''
+        else:
+            self._data = buffer(source)
+            size = len(self._data)
+        self.name = name
+        self.size = size
+        self.sent = self.acked = offset  # positions in data
+        self.cancelled = False
+
+    def __repr__(self):
+        return '<Outgoing #%d %r %d/%d>' % (self.tid, self.name, self.acked,
+                                            self.size)
+
+    @property
+    def done(self):
+        """True when all data was acknowledged by remote host."""
+        return self.acked >= self.size
+
+    def _start(self):
+        start = self.connection.message_factory.get_internal('transfer_start')
+        # sent on the same channel as chunks, which mustn't overtake it
+        self.connection._send(start(self.tid, self.name, self.size,
+                                    self.sent),
+                              channel=self.connection.bulk_channel)
+
+    def _send_chunk(self, budget):
+        offset = self.sent
+        end = min(self.size, offset + self.chunk_size, offset + budget)
+        chunk = self.connection.message_factory.get_internal(
+            'transfer_chunk')
+        self.connection._send(chunk(self.tid, offset,
+                                    self._data[offset:end]),
+                              channel=self.connection.bulk_channel)
+        self.sent = end
+        return end - offset
+
+    def _ack(self, offset):
+        if offset <= self.acked:
+            return
+        self.acked = offset
+        if self.on_progress is not None:
+            self.on_progress(self)
+        if self.done:
+            self.close()
+
+    def cancel(self):
+        """Stop transfer and notify remote host."""
+        if self.cancelled or self.done:
+            return
+        self.cancelled = True
+        c = self.connection
+        c._outgoing.pop(self.tid, None)
+        if c.connected:
+            cancel = c.message_factory.get_internal('transfer_cancel')
+            c._send(cancel(self.tid, False))
+        self.close()
+
+    def close(self):
+        """Release mapped file."""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._data = ''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class Incoming(object):
+    """Data received from remote host.
+
+    Target is chosen by :meth:`~.handler.Handler.on_transfer_start` by
+    setting :attr:`target` to path of file (preallocated to size of
+    transfer, opened without truncating when offset isn't 0) or
+    bytearray. By default new bytearray is allocated.
+
+    :param connection: :class:`~.connection.Connection`
+    :param tid: transfer id
+    :param name: name of transfer
+    :param size: size of data in bytes
+    :param offset: position of first sent chunk
+    """
+    def __init__(self, connection, tid, name, size, offset=0):
+        self.connection = connection
+        self.tid = tid
+        self.name = name
+        self.size = size
+        self.offset = offset
+        self.received = offset  # position of contiguous data
+        self.target = None  # path of file or bytearray
+        self.cancelled = False
+        self._buffer = None
+        self._file = None
+
+    def __repr__(self):
+        return '<Incoming #%d %r %d/%d>' % (self.tid, self.name,
+                                            self.received, self.size)
+
+    @property
+    def done(self):
+        """True when all data was received."""
+        return self.received >= self.size
+
+    def _open(self):
+        target = self.target
+        if target is None:
+            target = self.target = bytearray(self.size)
+        if isinstance(target, basestring):
+            exists = self.offset and os.path.exists(target)
+            f = self._file = open(target, 'r+b' if exists else 'w+b')
+            f.truncate(self.size)
+            self._buffer = mmap.mmap(f.fileno(), 0) if self.size else ''
+        else:
+            if len(target) < self.size:
+                raise ValueError('Target of transfer is too small')
+            self._buffer = target
+
+    def _write(self, offset, data):
+        if offset != self.received:
+            _logger.warning('#%s Chunk of transfer %d at %d, expected %d',
+                            self.connection.id, self.tid, offset,
+                            self.received)
+            return False
+        end = offset + len(data)
+        if end > self.size:
+            _logger.warning('#%s Chunk of transfer %d beyond its size',
+                            self.connection.id, self.tid)
+            return False
+        self._buffer[offset:end] = data
+        self.received = end
+        return True
+
+    def cancel(self):
+        """Stop transfer and notify remote host."""
+        if self.cancelled or self.done:
+            return
+        self.cancelled = True
+        c = self.connection
+        c._incoming.pop(self.tid, None)
+        if c.connected:
+            cancel = c.message_factory.get_internal('transfer_cancel')
+            c._send(cancel(self.tid, True))
+        self.close()
+
+    def close(self):
+        """Flush and close target file."""
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.flush()
+            self._buffer.close()
+        self._buffer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,448 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import time
+import socket
+import threading
+import unittest
+import pygnetic
+from pygnetic import discovery
+
+
+class ServerStoreTests(unittest.TestCase):
+    def setUp(self):
+        self.store = store = discovery.ServerStore()
+        for i in range(100):
+            store.add(u'%s %d' % (('Alpha', 'Beta')[i % 2], i), '10.0.0.1',
+                      1000 + i, ('ctf', 'dm', 'race')[i % 3], i % 5)
+
+    def pages(self, limit=7, **filters):
+        cursor = 0
+        result = []
+        while cursor is not None:
+            page, cursor = self.store.snapshot().query(cursor, limit,
+                                                       **filters)
+            result.extend(s.sid for s in page)
+        return result
+
+    def test_pagination(self):
+        self.assertListEqual(self.pages(), range(1, 101))
+
+    def test_filters(self):
+        sids = self.pages(prefix=u'alp', mode='ctf', min_slots=3)
+        self.assertListEqual(sids, [i + 1 for i in range(100)
+                                    if i % 2 == 0 and i % 3 == 0 and
+                                    i % 5 >= 3])
+        self.assertListEqual(self.pages(mode='none'), [])
+
+    def test_churn(self):
+        page, cursor = self.store.snapshot().query(0, 10)
+        self.store.remove([s.sid for s in page[-3:]] + [11, 12])
+        self.store.add(u'Gamma', '10.0.0.2', 2000)
+        page, cursor = self.store.snapshot().query(cursor, 10)
+        self.assertEqual(page[0].sid, 13)
+
+    def test_ping(self):
+        snapshot = self.store.snapshot()
+        self.assertTrue(self.store.ping(5, 4))
+        self.assertIs(self.store.snapshot(), snapshot)  # slots unchanged
+        self.assertTrue(self.store.ping(1, 4))
+        self.assertIsNot(self.store.snapshot(), snapshot)
+        self.assertFalse(self.store.ping(1000))
+        self.assertEqual(self.store.expire(time.time() + 59), [])
+        self.assertEqual(len(self.store.expire(time.time() + 61)), 100)
+        self.assertEqual(len(self.store), 0)
+
+    def test_incremental_indexes(self):
+        import random
+        rng = random.Random(1)
+        for i in range(300):
+            op = rng.random()
+            sids = list(self.store._servers)
+            if op < 0.3 and sids:
+                self.store.remove([rng.choice(sids)])
+            elif op < 0.6 and sids:
+                self.store.ping(rng.choice(sids), rng.randrange(5))
+            else:
+                self.store.add(u'Game %d' % rng.randrange(50), '10.0.0.1', 1,
+                               ('ctf', 'dm')[i % 2], rng.randrange(5))
+            if i % 7 == 0:
+                self.store.snapshot()
+        snapshot = self.store.snapshot()
+        rebuilt = discovery.Snapshot(dict(snapshot.servers))
+        for attr in ('sids', 'names', 'slots', 'modes'):
+            self.assertListEqual(getattr(snapshot, attr),
+                                 getattr(rebuilt, attr))
+        for filters in ({}, {'prefix': u'game 1'}, {'mode': 'dm'},
+                        {'min_slots': 3, 'mode': 'ctf'}):
+            self.assertEqual(snapshot.query(0, 1000, **filters),
+                             rebuilt.query(0, 1000, **filters))
+
+    def test_shared_indexes(self):
+        snapshot = self.store.snapshot()
+        sid = snapshot.slots[0][1]
+        self.store.ping(sid, 4)
+        updated = self.store.snapshot()
+        self.assertIs(updated.names, snapshot.names)
+        self.assertIs(updated.modes, snapshot.modes)
+        self.assertIsNot(updated.slots, snapshot.slots)
+        self.assertNotIn((4, sid), snapshot.slots)  # old snapshot unchanged
+        self.assertIn((4, sid), updated.slots)
+
+
+class DiscoveryTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        self.server = discovery.DiscoveryServer('127.0.0.1', 0)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = discovery.DiscoveryClient('127.0.0.1',
+                                                self.server.server_address[1])
+        self.responses = []
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def request(self, oid):
+        self.client.add_callback(oid, self.responses.append)
+        for _ in range(100):
+            self.client.update(10)
+            if self.responses:
+                return self.responses.pop()
+        self.fail('No response')
+
+    def test_discovery(self):
+        r = self.request(self.client.register(u'Game', 1337, u'ctf', 4))
+        sid = r.value
+        self.request(self.client.register(u'Other', 1338))
+        r = self.request(self.client.ping(sid, 3))
+        self.assertEqual(r.error, discovery.Errors.NO_ERROR)
+        r = self.request(self.client.get_servers(0, 10, mode=u'ctf'))
+        servers, cursor = r.value
+        self.assertEqual(len(servers), 1)
+        self.assertEqual(tuple(servers[0]),
+                         (sid, u'Game', u'127.0.0.1', 1337, u'ctf', 3))
+        self.assertIsNone(cursor)
+        r = self.request(self.client.ping(1000))
+        self.assertEqual(r.error, discovery.Errors.TIMEOUT)
+
+    def test_invalid(self):
+        c = self.client
+        for send, args, kwargs in ((c.register, (5, 1337), {}),
+                                   (c.register, (u'Game', '1337'), {}),
+                                   (c.ping, (1, u'3'), {}),
+                                   (c.get_servers, (), {'prefix': 1})):
+            r = self.request(send(*args, **kwargs))
+            self.assertEqual(r.error, discovery.Errors.INVALID)
+        self.assertEqual(len(self.server.store), 0)
+        self.assertEqual(len(self.server.store._wheel), 0)
+
+    def test_chunk_total(self):
+        oid = self.client.get_servers()
+        self.client._receive(discovery.chunk(oid, 0, 10 ** 12, 'x', 'c'))
+        self.assertDictEqual(self.client._partial, {})
+        self.assertIsNotNone(self.request(oid))
+
+    def test_chunked_listing(self):
+        for i in range(500):
+            self.server.store.add(u'Game %d' % i, '10.0.0.1', 1000 + i)
+        received = []
+        recvfrom = self.client.socket.recvfrom
+
+        def lossy_recvfrom(size):
+            data, address = recvfrom(size)
+            received.append(data)
+            if len(received) in (2, 4):
+                raise socket.error('dropped')
+            return data, address
+        self.client.socket.recvfrom = lossy_recvfrom
+        self.client.chunk_timeout = 0.05
+        r = self.request(self.client.get_servers(0, None))
+        servers, cursor = r.value
+        self.assertListEqual([s[0] for s in servers], range(1, 101))
+        self.assertIsNotNone(cursor)
+        chunk = discovery.message_factory.unpack(received[0])
+        self.assertIsInstance(chunk, discovery.chunk)
+        self.assertGreater(chunk.total, 2)
+        self.assertEqual(len(received), chunk.total + 2)  # 2 resent
+
+    def test_spoofed_request(self):
+        for i in range(500):
+            self.server.store.add(u'Game %d' % i, '10.0.0.1', 1000 + i)
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.settimeout(1)
+        try:
+            mf = discovery.message_factory
+            s.sendto(mf.pack(discovery.get_servers(1, 0, None, None)),
+                     self.server.server_address)
+            chunk = mf.unpack(s.recvfrom(8192)[0])
+            self.assertIsInstance(chunk, discovery.chunk)
+            # remaining chunks are sent only with cookie of first one
+            s.sendto(mf.pack(discovery.resend(1, [1, 2], 'guess')),
+                     self.server.server_address)
+            s.sendto(mf.pack(discovery.resend(1, [1], chunk.cookie)),
+                     self.server.server_address)
+            chunk = mf.unpack(s.recvfrom(8192)[0])
+            self.assertEqual(chunk.seq, 1)
+            # resending is limited
+            for _ in range(self.server.max_resends):
+                s.sendto(mf.pack(discovery.resend(1, [1], chunk.cookie)),
+                         self.server.server_address)
+            for _ in range(self.server.max_resends - 1):
+                s.recvfrom(8192)
+            s.settimeout(0.1)
+            self.assertRaises(socket.timeout, s.recvfrom, 8192)
+        finally:
+            s.close()
+
+    def test_request_timeout(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))  # doesn't respond
+        try:
+            self.client.address = s.getsockname()
+            self.client.request_timeout = 0.05
+            r = self.request(self.client.get_servers())
+            self.assertEqual(r.error, discovery.Errors.NO_RESPONSE)
+            self.assertEqual(r.mid, discovery.message_factory.get_type_id(
+                discovery.get_servers))
+            self.assertEqual(len(self.client._requests), 0)
+        finally:
+            s.close()
+
+    def test_probe(self):
+        def free_port():
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+            s.close()
+            return port - discovery.probe_port_offset
+        responders = [discovery.ProbeResponder(free_port(), '127.0.0.1',
+                                               i, 8 - i) for i in range(2)]
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.1', 0))
+        servers = [discovery.ServerInfo(1, u'Silent', '127.0.0.1',
+                   silent.getsockname()[1] - discovery.probe_port_offset,
+                   u'', 0)]
+        servers += [('127.0.0.1', r.socket.getsockname()[1] -
+                     discovery.probe_port_offset) for r in responders]
+        try:
+            results = self.client.probe(servers, self.responses.append,
+                                        200, 2)
+            for _ in range(100):
+                for r in responders:
+                    r.update()
+                self.client.update(5)
+                if self.responses:
+                    break
+            self.assertEqual(len(self.responses), 1)
+            ordered = self.responses[0]
+            self.assertIs(ordered[-1], results[0])
+            self.assertLessEqual(ordered[0].rtt, ordered[1].rtt)
+            self.assertEqual(results[0].loss, 1)
+            self.assertIsNone(results[0].rtt)
+            for i, r in enumerate(results[1:]):
+                self.assertEqual((r.sent, r.received, r.players, r.slots),
+                                 (2, 2, i, 8 - i))
+                self.assertEqual(r.loss, 0)
+                self.assertGreater(r.rtt, 0)
+            self.assertEqual(self.client._nonces, {})
+        finally:
+            silent.close()
+            for r in responders:
+                r.close()
+
+    def test_probe_spoofed(self):
+        silent = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        silent.bind(('127.0.0.1', 0))
+        try:
+            address = silent.getsockname()
+            results = self.client.probe(
+                [('127.0.0.1', address[1] - discovery.probe_port_offset)],
+                count=1)
+            self.client.update(0)  # sends ping
+            nonce, = self.client._nonces
+            reply = discovery.probe_reply(0, nonce, 1, 1)
+            self.client._probe_reply(reply, ('127.0.0.1', 1))
+            self.assertEqual(results[0].received, 0)
+            self.client._probe_reply(reply, address)
+            self.assertEqual(results[0].received, 1)
+            self.assertEqual(self.client._nonces, {})
+        finally:
+            silent.close()
+
+
+class BatchedDiscoveryTests(DiscoveryTests):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        self.server = discovery.BatchedDiscoveryServer('127.0.0.1', 0)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.01})
+        self.thread.daemon = True
+        self.thread.start()
+        self.client = discovery.DiscoveryClient('127.0.0.1',
+                                                self.server.server_address[1])
+        self.responses = []
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def test_replication(self):
+        repl = []
+        for _ in range(2):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind(('127.0.0.1', 0))
+            repl.append(s)
+        workers = [discovery.BatchedDiscoveryServer('127.0.0.1', 0,
+            repl_socket=repl[i], peers=[repl[1 - i].getsockname()],
+            worker=i, workers=2) for i in range(2)]
+        try:
+            sids = [w.store.add(u'Game %d' % i, '10.0.0.1', 1000)
+                    for i, w in enumerate(workers)]
+            for _ in range(2):
+                for w in workers:
+                    w.update(10)
+            self.assertTrue(workers[0].store.ping(sids[1], 5))
+            for _ in range(2):
+                for w in workers:
+                    w.update(10)
+            self.assertNotEqual(sids[0], sids[1])
+            for w in workers:
+                page, _ = w.store.snapshot().query(0, 10)
+                self.assertListEqual([s.sid for s in page], sorted(sids))
+                self.assertEqual(page[-1].slots, 5)
+            self.assertGreater(workers[0].store.add(u'Next', '', 1), sids[1])
+        finally:
+            for w in workers:
+                w.server_close()
+
+    def test_replication_loss(self):
+        repl = []
+        for _ in range(2):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind(('127.0.0.1', 0))
+            repl.append(s)
+        workers = [discovery.BatchedDiscoveryServer('127.0.0.1', 0,
+            repl_socket=repl[i], peers=[repl[1 - i].getsockname()],
+            worker=i, workers=2) for i in range(2)]
+        try:
+            for w in workers:
+                w.update(0)  # initial sync of empty stores
+            sid = workers[0].store.add(u'Game', '10.0.0.1', 1000)
+            other = workers[1].store.add(u'Other', '10.0.0.2', 1000)
+            del workers[0].store.journal[:]  # lost replication
+            for w in workers + workers[:1]:
+                w.update(10)
+            self.assertEqual(len(workers[1].store), 1)
+            self.assertEqual(len(workers[0].store), 2)
+            snapshot = workers[0].store.snapshot()
+            for w in workers:
+                w._next_sync = 0
+                w.update(10)
+            workers[1].update(10)
+            for w in workers:
+                page, _ = w.store.snapshot().query(0, 10)
+                self.assertListEqual([s.sid for s in page], [sid, other])
+            # unchanged servers don't invalidate snapshot
+            self.assertIs(workers[0].store.snapshot(), snapshot)
+        finally:
+            for w in workers:
+                w.server_close()
+
+    def test_replication_size(self):
+        repl = []
+        for _ in range(2):
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.bind(('127.0.0.1', 0))
+            repl.append(s)
+        workers = [discovery.BatchedDiscoveryServer('127.0.0.1', 0,
+            repl_socket=repl[i], peers=[repl[1 - i].getsockname()],
+            worker=i, workers=2) for i in range(2)]
+        try:
+            for i in range(100):
+                workers[0].store.add(u'Game with quite long name %34d' % i,
+                                     '10.0.0.1', 1000 + i)
+            for _ in range(2):
+                for w in workers:
+                    w.update(10)
+            self.assertEqual(len(workers[1].store), 100)
+        finally:
+            for w in workers:
+                w.server_close()
+
+    def test_malformed(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for message in (discovery.register(1, 5, 1000, u'', 0),
+                            discovery.get_servers(2, 0, None, [1])):
+                s.sendto(discovery.message_factory.pack(message),
+                         self.server.server_address)
+            r = self.request(self.client.get_servers())
+            self.assertEqual(r.error, discovery.Errors.NO_ERROR)
+        finally:
+            s.close()
+
+
+class LanDiscoveryTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        # unicast to loopback, multicast routing may be unavailable
+        self.client = discovery.LanDiscoveryClient('127.0.0.1', 0, 0.2)
+        port = self.client.socket.getsockname()[1]
+        self.announcers = [discovery.LanAnnouncer(u'Game %d' % i, 1000 + i,
+                                                  u'ctf', i, '127.0.0.1',
+                                                  port, 0.05)
+                           for i in range(3)]
+
+    def tearDown(self):
+        self.client.close()
+        for a in self.announcers:
+            a.close()
+
+    def announce(self, announcers):
+        for a in announcers:
+            a.announce()
+        self.client.update(50)
+
+    def test_cache(self):
+        self.announce(self.announcers)
+        self.announce(self.announcers)  # duplicates
+        servers, cursor = self.client.get_servers()
+        self.assertListEqual([s.port for s in servers], [1000, 1001, 1002])
+        self.assertIsNone(cursor)
+        self.announcers[1].slots = 5
+        self.announcers[2].name = u'Renamed'
+        self.announce(self.announcers)
+        servers, _ = self.client.get_servers(min_slots=5)
+        self.assertListEqual([s.port for s in servers], [1001])
+        servers, _ = self.client.get_servers(prefix=u'ren')
+        self.assertListEqual([(s.port, s.host) for s in servers],
+                             [(1002, '127.0.0.1')])
+        self.assertEqual(len(self.client.get_servers()[0]), 3)
+
+    def test_expiry(self):
+        self.announce(self.announcers)
+        for _ in range(8):
+            time.sleep(0.05)
+            self.announce(self.announcers[:1])
+        servers, _ = self.client.get_servers()
+        self.assertListEqual([s.port for s in servers], [1000])
+
+    def test_invalid(self):
+        self.announcers[1].name = 5
+        self.announce(self.announcers)
+        servers, _ = self.client.get_servers()
+        self.assertListEqual([s.port for s in servers], [1000, 1002])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,101 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import unittest
+from pygnetic.history import History
+from pygnetic.syncobject import SyncObject, SyncObjectManager
+
+
+class Connection(object):
+    rtt = 0.1
+
+
+class HistoryTests(unittest.TestCase):
+    def setUp(self):
+        self.manager = manager = SyncObjectManager()
+
+        class Player(SyncObject):
+            sync_var = ('x', 'y', 'hp')
+            sync_manager = manager
+
+        class Flag(SyncObject):
+            sync_var = ('team',)
+            sync_manager = manager
+        manager.register(Player)
+        manager.register(Flag)
+        self.now = 0.0
+        self.history = History(manager, size=8, cell_size=10)
+        self.history.clock = lambda: self.now
+        self.players = [Player() for _ in range(20)]
+        self.flag = Flag()
+        self.flag.team = 1
+
+    def run_ticks(self, n):
+        for _ in range(n):
+            self.now += 0.05
+            for i, p in enumerate(self.players):
+                p.x, p.y, p.hp = i * 5 + self.history.tick, 0, 100
+            self.manager.update(())
+            self.history.record()
+
+    def test_rewind(self):
+        self.run_ticks(5)
+        frame = self.history.rewind(3)
+        p = self.manager.get_id(self.players[4])
+        self.assertEqual(frame.states[p][1], (22, 0, 100))
+        self.assertEqual(frame.positions[p], (22, 0))
+        self.assertEqual(len(frame.states), 21)
+        self.assertEqual(len(frame.positions), 20)
+        self.assertIsNone(self.history.rewind(6))
+
+    def test_ring(self):
+        self.run_ticks(20)
+        self.assertIsNone(self.history.rewind(12))
+        self.assertEqual(self.history.rewind(13).tick, 13)
+        del self.players[10:]
+        self.run_ticks(8)
+        self.assertEqual(len(self.history._objects), 11)
+
+    def test_rewind_for(self):
+        self.run_ticks(10)
+        # 0.05 latency + 0.1 render delay = 3 ticks back
+        frame = self.history.rewind_for(Connection())
+        self.assertEqual(frame.tick, 7)
+        self.assertEqual(self.history.tick_at(-1), 3)
+        self.assertEqual(self.history.tick_at(0.26), 5)
+        self.assertEqual(self.history.tick_at(10), 10)
+
+    def test_skipped_ticks(self):
+        history = self.history
+        self.run_ticks(4)
+        frame = history.rewind(3)
+        self.now += 0.05
+        history.record(10)  # ticks 5-9 skipped, 1 and 2 out of window
+        self.assertIs(history.rewind(3), frame)
+        self.assertIsNone(history.rewind(1))
+        self.assertIsNone(history.rewind(2))
+        self.assertEqual(history.tick_at(0.15), 3)
+        self.assertEqual(history.tick_at(0.24), 4)
+        self.assertEqual(history.tick_at(0.25), 10)
+        self.assertEqual(history.tick_at(0), 3)
+        history.record(20)
+        self.assertEqual(history._frames, {})
+        self.assertIsNone(history.rewind(3))
+        self.assertEqual(history.tick_at(0), 20)
+        self.assertIsNone(History(self.manager).tick_at(0))
+
+    def test_query(self):
+        self.run_ticks(1)
+        frame = self.history.rewind(1)
+        found = frame.query((20, 3), 6)
+        self.assertListEqual(
+            sorted(found),
+            sorted(self.manager.get_id(self.players[i]) for i in (3, 4, 5)))
+        self.assertListEqual(frame.query((-100, -100), 5), [])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
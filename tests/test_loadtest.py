@@ -0,0 +1,106 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import time
+import threading
+import unittest
+from Queue import Queue
+import pygnetic
+from pygnetic import loadtest
+from pygnetic.network import loopback_adapter
+
+
+class EchoHandler(pygnetic.Handler):
+    def net_echo(self, message, **kwargs):
+        if message.msg == 'ping':
+            self.connection.net_echo(message.msg, message.msg_id)
+
+
+class LoadTestTests(unittest.TestCase):
+    def test_loopback(self):
+        pygnetic.serialization.select_adapter('json')
+        mf = pygnetic.message.MessageFactory()
+        mf.register('echo', ('msg', 'msg_id'))
+        server = loopback_adapter.Server(conn_limit=8, handler=EchoHandler,
+                                         message_factory=mf)
+        stop = threading.Event()
+
+        def serve():
+            while not stop.is_set():
+                server.update()
+                time.sleep(0.001)
+        thread = threading.Thread(target=serve)
+        thread.daemon = True
+        thread.start()
+        config = dict(loadtest.defaults, n_adapter='loopback',
+                      s_adapter='json', port=server.address[1], clients=4,
+                      connect_rate=1000, duration=0.5, report_interval=0.25,
+                      messages=[['echo', ['msg', 'msg_id']]],
+                      mix=[{'message': 'echo', 'rate': 20,
+                            'args': ['move', '$client']},
+                           {'message': 'echo', 'rate': 0}],
+                      ping={'message': 'echo', 'rate': 10, 'field': 'msg_id',
+                            'args': ['ping', '$seq']})
+        queue = Queue()
+        try:
+            loadtest.worker(0, config, 4, queue)
+        finally:
+            stop.set()
+            thread.join()
+        intervals = []
+        reports = loadtest.collect(queue, 1, 1, intervals.append)
+        self.assertEqual(len(reports), 2)
+        self.assertListEqual(intervals, reports)
+        s = loadtest.summary(reports, config)
+        self.assertEqual(s['connected'], 4)
+        self.assertEqual(s['errors'], 0)
+        self.assertGreater(s['sent_per_sec'], s['received_per_sec'])
+        self.assertGreater(s['received_per_sec'], 0)
+        self.assertGreater(s['bytes_received_per_sec'], 0)
+        self.assertIsNotNone(s['rtt'][50])
+        loadtest.format_interval(reports[0], config['report_interval'])
+
+    def test_collect(self):
+        queue = Queue()
+        intervals = []
+
+        def report(index, t):
+            r = loadtest.Stats().as_dict()
+            r.update(t=t, connected=1, sent=1)
+            queue.put((index, r))
+        # worker 1 runs ahead of worker 0
+        report(1, 1)
+        report(1, 2)
+        report(0, 1)
+        queue.put((1, None))
+        report(0, 2)
+        report(0, 3)
+        queue.put((0, None))
+        with_callback = []
+
+        def callback(r):
+            # interval isn't reported before all workers completed it
+            with_callback.append((r['t'], r['connected']))
+        reports = loadtest.collect(queue, 2, 1, callback)
+        self.assertListEqual(with_callback, [(1, 2), (2, 2), (3, 1)])
+        self.assertListEqual([r['sent'] for r in reports], [2, 2, 1])
+
+    def test_ping_expiry(self):
+        mf = pygnetic.message.MessageFactory()
+        mf.register('echo', ('msg', 'msg_id'))
+        stats = loadtest.Stats()
+        config = dict(loadtest.defaults, ping={
+            'message': 'echo', 'rate': 10, 'field': 'msg_id',
+            'args': ['ping', '$seq'], 'timeout': 1})
+        bot = loadtest.Bot(0, config, mf, stats)
+        bot.pings.update((seq, 10.0 + seq * 0.1) for seq in range(20))
+        bot._expire_pings(11.55)
+        self.assertEqual(stats.lost, 6)
+        self.assertEqual(len(bot.pings), 14)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,138 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import unittest
+import pygnetic
+from pygnetic.network import loopback_adapter, netsim_adapter
+from pygnetic.lockstep import LockstepServer, LockstepClient
+
+
+class LockstepTests(unittest.TestCase):
+    n_players = 3
+
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        mf = pygnetic.message.MessageFactory()
+        self.server = self.adapter.Server(handler=pygnetic.Handler,
+                                          message_factory=mf, **self.kwargs)
+        self.clients = []
+        self.sessions = []
+        for _ in range(self.n_players):
+            client = self.adapter.Client(message_factory=mf, **self.kwargs)
+            connection = client.connect('localhost', self.server.address[1])
+            self.clients.append(client)
+            self.sessions.append(LockstepClient(connection))
+        self.update()
+        self.session = LockstepServer(self.server, input_delay=2)
+        self.session.start(self.server.connections())
+        self.update()
+
+    adapter = loopback_adapter
+    kwargs = {}
+
+    def update(self):
+        self.server.update()
+        if self.server.lockstep is not None:
+            self.server.lockstep.update()
+        for c in self.clients:
+            c.update()
+
+    def run_frames(self, n, checksum=lambda player, frame: frame):
+        # every client simulates sum of inputs of all players
+        states = [0] * self.n_players
+        for tick in range(n * 4):
+            for p, s in enumerate(self.sessions):
+                inputs = s.next_frame()
+                if inputs is None:
+                    s.update()
+                    continue
+                states[p] += sum(i or 0 for i in inputs)
+                if s._next_input < n:
+                    s.send_input(p + 1)
+                s.report_checksum(s.frame - 1, checksum(p, states[p]))
+            self.update()
+        return states
+
+    def test_frames(self):
+        n = 30
+        states = self.run_frames(n)
+        self.assertEqual([s.frame for s in self.sessions],
+                         [n] * self.n_players)
+        self.assertEqual(states, [(n - 2) * 6] * self.n_players)
+        self.assertIsNone(self.session.desynced)
+        self.assertLess(len(self.session._frames), 8)
+
+    def test_desync(self):
+        self.run_frames(10, lambda p, frame: frame if p else -frame)
+        self.assertIsNotNone(self.session.desynced)
+        self.assertEqual([s.desynced for s in self.sessions],
+                         [self.session.desynced] * self.n_players)
+
+    def test_drop(self):
+        # last player disconnects without sending any input
+        self.sessions.pop().connection.disconnect()
+        self.n_players -= 1
+        n = 20
+        states = self.run_frames(n)
+        self.assertSetEqual(self.session._dropped, set([2]))
+        self.assertEqual([s.frame for s in self.sessions],
+                         [n] * self.n_players)
+        self.assertEqual(states, [(n - 2) * 3] * self.n_players)
+        self.assertIsNone(self.session.desynced)
+
+    def test_future_input(self):
+        message = self.server.message_factory.get_internal('lockstep_input')
+        connection = self.session.players[0]
+        limit = self.session.complete + self.session.input_delay + \
+            self.session.redundancy
+        self.session.on_input(connection, message(2, (1,) * 100, 1, None,
+                                                  None))
+        self.assertEqual(max(self.session._inputs[0]), limit)
+
+    def test_resend_window(self):
+        session = self.sessions[0]
+        start = self.server.message_factory.get_internal('lockstep_start')
+        session.on_start(start(0, self.n_players, 2))
+        session.redundancy = 2
+        sent = []
+        session.connection._send = lambda message, **kwargs: \
+            sent.append(message)
+        for i in range(4):
+            session.send_input(i)
+        # unacknowledged inputs are resent without gaps
+        self.assertEqual([(m.frame, m.inputs) for m in sent],
+                         [(2, (0,)), (2, (0, 1)), (2, (0, 1)), (2, (0, 1))])
+
+    def test_lost_checksum(self):
+        session = self.session
+        session._checksum(0, 5, 1)
+        session._checksum(1, 5, 2)  # report of player 2 was lost
+        for p in range(self.n_players):
+            session._checksum(p, 6, 1)
+        self.assertDictEqual(session._checksums, {})
+        self.assertEqual(session.desynced, 5)
+
+    def test_unexpected_messages(self):
+        mf = self.server.message_factory
+        frames = mf.get_internal('lockstep_frames')
+        inputs = mf.get_internal('lockstep_input')
+        self.server.lockstep = None
+        self.sessions[0].connection._send(frames(0, (), 0, None))
+        self.sessions[1].connection._send(inputs(2, (1,), 1, None, None))
+        # input sent to client
+        next(self.server.connections())._send(inputs(2, (1,), 1, None,
+                                                     None))
+        for _ in range(3):
+            self.update()
+
+
+class LossyLockstepTests(LockstepTests):
+    adapter = netsim_adapter.wrap(loopback_adapter)
+    kwargs = {'conditions': netsim_adapter.Conditions(loss=0.3), 'seed': 3}
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
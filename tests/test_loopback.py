@@ -0,0 +1,174 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import time
+import unittest
+import pygnetic
+from pygnetic.network import loopback_adapter
+
+
+class EchoHandler(pygnetic.Handler):
+    def net_echo(self, message, **kwargs):
+        self.connection.net_echo(message.msg.upper(), message.msg_id)
+
+
+class ClientHandler(pygnetic.Handler):
+    def __init__(self):
+        self.events = []
+
+    def on_connect(self):
+        self.events.append('connect')
+
+    def on_disconnect(self):
+        self.events.append('disconnect')
+
+    def net_echo(self, message, **kwargs):
+        self.events.append(tuple(message))
+
+
+class LoopbackAdapterTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('json')
+        self.mf = pygnetic.message.MessageFactory()
+        self.mf.register('echo', ('msg', 'msg_id'))
+        self.server = loopback_adapter.Server(conn_limit=2,
+            handler=EchoHandler, message_factory=self.mf)
+        self.client = loopback_adapter.Client(message_factory=self.mf)
+
+    def connect(self, message_factory=None):
+        connection = self.client.connect('localhost', self.server.address[1],
+                                         message_factory)
+        handler = ClientHandler()
+        connection.add_handler(handler)
+        return connection, handler
+
+    def update(self, count=2):
+        for _ in range(count):
+            self.server.update()
+            self.client.update()
+
+    def test_echo(self):
+        connection, handler = self.connect()
+        connection.net_echo('abc', 1)  # sent before acceptance
+        self.update()
+        self.assertTrue(connection.connected)
+        self.assertEqual(len(self.server.conn_map), 1)
+        connection.net_echo('def', 2)
+        self.update()
+        self.assertListEqual(handler.events,
+                             ['connect', (u'ABC', 1), (u'DEF', 2)])
+
+    def test_zero_copy(self):
+        connection, handler = self.connect()
+        self.update()
+        data = self.mf.pack(self.mf.get_by_name('echo')('abc', 1))
+        connection._send_data(data)
+        s_conn = next(self.server.connections())
+        self.assertIs(self.server._events[0][2], data)
+        self.assertIs(self.server._events[0][1], s_conn)
+
+    def test_disconnect(self):
+        connection, handler = self.connect()
+        self.update()
+        connection.disconnect()
+        self.update()
+        self.assertListEqual(handler.events, ['connect', 'disconnect'])
+        self.assertEqual(len(self.server.conn_map), 0)
+        self.assertEqual(len(self.client.conn_map), 0)
+
+    def test_refused(self):
+        mf = pygnetic.message.MessageFactory()
+        mf.register('other')
+        connection, handler = self.connect(mf)
+        self.update()
+        self.assertListEqual(handler.events, ['disconnect'])
+        self.assertEqual(len(self.server.conn_map), 0)
+
+    def test_conn_limit(self):
+        handlers = [self.connect()[1] for _ in range(3)]
+        self.update()
+        self.assertEqual(len(self.server.conn_map), 2)
+        self.assertListEqual([h.events for h in handlers],
+                             [['connect'], ['connect'], ['disconnect']])
+
+    def test_clock_sync(self):
+        connection, handler = self.connect()
+        connection.clock = lambda: time.time() - 100  # client clock behind
+        self.update(3)
+        s_conn = next(self.server.connections())
+        self.assertIsNotNone(connection.rtt)
+        self.assertIsNotNone(s_conn.rtt)
+        self.assertGreaterEqual(connection.rtt_var, 0)
+        self.assertAlmostEqual(connection.clock_offset, 100, 1)
+        self.assertAlmostEqual(connection.server_time(), time.time(), 1)
+        self.assertEqual(s_conn.clock_offset, 0)
+
+    def test_disconnect_in_handler(self):
+        connection, handler = self.connect()
+        self.update()
+        s_conn = next(self.server.connections())
+        s_conn.handlers = []
+        s_conn.add_handler(type('Handler', (pygnetic.Handler,), {
+            'net_echo': lambda self, message, **kwargs:
+                self.connection.disconnect()})())
+        pings = []
+        s_conn.ping = lambda: pings.append(1)
+        s_conn._next_ping = 0
+        connection.net_echo('bye', 1)
+        self.update()
+        self.assertFalse(s_conn.connected)
+        self.assertListEqual(pings, [])
+
+
+class HeartbeatTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('json')
+        self.mf = pygnetic.message.MessageFactory()
+        self.mf.register('echo', ('msg', 'msg_id'))
+        loopback_adapter.Connection.heartbeat_interval = 0.02
+        loopback_adapter.Connection.idle_timeout = 0.1
+        self.server = loopback_adapter.Server(handler=EchoHandler,
+                                              message_factory=self.mf)
+        self.client = loopback_adapter.Client(message_factory=self.mf)
+        self.connection = self.client.connect('localhost',
+                                              self.server.address[1])
+        self.heartbeats = []
+        self.connection._net_heartbeat = \
+            lambda message, **kwargs: self.heartbeats.append(message)
+        self.connection.add_handler(ClientHandler())
+
+    def tearDown(self):
+        del loopback_adapter.Connection.heartbeat_interval
+        del loopback_adapter.Connection.idle_timeout
+
+    def run_for(self, duration, client=True, send=False):
+        end = time.time() + duration
+        while time.time() < end:
+            if send:
+                self.connection.net_echo('a', 0)
+            self.server.update()
+            if client:
+                self.client.update()
+            time.sleep(0.005)
+
+    def test_idle(self):
+        self.run_for(0.3)
+        self.assertTrue(self.connection.connected)
+        self.assertEqual(len(self.server.conn_map), 1)
+        self.assertGreater(len(self.heartbeats), 3)
+
+    def test_busy(self):
+        self.run_for(0.3, send=True)
+        self.assertEqual(len(self.heartbeats), 0)
+
+    def test_dead_peer(self):
+        self.run_for(0.05)
+        self.run_for(0.3, client=False)  # client doesn't respond
+        self.assertEqual(len(self.server.conn_map), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
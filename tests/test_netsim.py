@@ -0,0 +1,106 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import unittest
+import pygnetic
+from pygnetic.network import loopback_adapter, netsim_adapter
+
+
+class RecordingHandler(pygnetic.Handler):
+    received = None
+
+    def net_echo(self, message, **kwargs):
+        self.received.append(message.msg)
+
+
+class NetsimAdapterTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('json')
+        self.now = 1000.0
+        self.mf = pygnetic.message.MessageFactory()
+        self.echo = self.mf.register('echo', ('msg',))
+        self.received = []
+        self.adapter = netsim_adapter.wrap(loopback_adapter)
+        handler = type('Handler', (RecordingHandler,),
+                       {'received': self.received})
+        self.server = self.adapter.Server(handler=handler,
+                                          message_factory=self.mf)
+        self.server.clock = self.clock
+        self.client = None
+
+    def clock(self):
+        return self.now
+
+    def connect(self, conditions):
+        self.client = self.adapter.Client(message_factory=self.mf,
+                                          conditions=conditions, seed=1)
+        self.client.clock = self.clock
+        return self.client.connect('localhost', self.server.address[1])
+
+    def update(self, count=2):
+        for _ in range(count):
+            self.server.update()
+            self.client.update()
+
+    def test_latency(self):
+        connection = self.connect(netsim_adapter.Conditions(latency=100))
+        self.update()
+        self.assertTrue(connection.connected)
+        connection.net_echo('a')
+        self.update()
+        self.assertListEqual(self.received, [])
+        self.now += 0.1
+        self.update()
+        self.assertListEqual(self.received, ['a'])
+
+    def test_loss(self):
+        connection = self.connect(netsim_adapter.Conditions())
+        self.update()
+        self.client.set_conditions(connection,
+                                   netsim_adapter.Conditions(loss=1))
+        for i in range(10):
+            connection.net_echo(i)
+        self.update()
+        self.assertListEqual(self.received, [])
+        link = self.client.links[connection._key]
+        self.assertEqual(link.dropped, 10)
+
+    def test_reorder(self):
+        connection = self.connect(netsim_adapter.Conditions(latency=100))
+        self.update()
+        connection.net_echo('a')
+        self.client.set_conditions(connection, netsim_adapter.Conditions(
+            latency=100, reorder=1))
+        connection.net_echo('b')
+        self.update()
+        self.assertListEqual(self.received, ['b'])
+        self.now += 0.1
+        self.update()
+        self.assertListEqual(self.received, ['b', 'a'])
+
+    def test_send_before_accept(self):
+        connection = self.connect(netsim_adapter.Conditions(latency=100))
+        connection.net_echo('a')
+        self.now += 0.1
+        # released before server accepted connection, kept as pending
+        self.client.update()
+        self.assertListEqual([d for d, _ in connection._pending],
+                             [self.mf.pack(self.echo('a'))])
+        self.server.update()  # accept
+        self.server.update()  # delivered without delaying it again
+        self.assertListEqual(self.received, ['a'])
+
+    def test_send_before_accept_no_latency(self):
+        connection = self.connect(netsim_adapter.Conditions())
+        connection.net_echo('a')
+        connection.net_echo('b')
+        self.update()
+        self.assertTrue(connection.connected)
+        self.assertListEqual(self.received, ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
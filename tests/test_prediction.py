@@ -0,0 +1,81 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import unittest
+import pygnetic
+from pygnetic.network import loopback_adapter
+from pygnetic.prediction import Predictor
+from pygnetic.syncobject import SyncObject, RemoteObject, SyncObjectManager
+
+
+def step(state, move):
+    return state[0] + move.dx, state[1] + move.dy
+
+
+class PredictionTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        self.mf = pygnetic.message.MessageFactory()
+        self.move = self.mf.register('move', ('seq', 'dx', 'dy'))
+
+    def test_reconcile(self):
+        p = Predictor(step, (0, 0))
+        for i in range(1, 6):
+            p.predict(self.move(i, 1, 0))
+        self.assertEqual(p.state, (5, 0))
+        # server processed 3 inputs, but was blocked by wall at x=2
+        self.assertEqual(p.reconcile(3, (2, 0)), (4, 0))
+        self.assertEqual(p.replayed, 2)
+        self.assertEqual(len(p.pending), 2)
+        self.assertEqual(p.reconcile(1, (1, 0)), (4, 0))  # outdated
+
+    def test_max_pending(self):
+        p = Predictor(step, (0, 0), max_pending=4)
+        for i in range(1, 11):
+            p.predict(self.move(i, 0, 1))
+        self.assertEqual(len(p.pending), 4)
+        self.assertEqual(p.reconcile(8, (0, 8)), (0, 10))
+
+    def test_replication(self):
+        manager = SyncObjectManager()
+        predictor = Predictor(step, (0, 0), state_vars=('x', 'y'))
+
+        class Player(SyncObject):
+            sync_var = ('x', 'y', 'last_input')
+            sync_manager = manager
+
+        class RemotePlayer(RemoteObject):
+            def on_change(self, var_names):
+                predictor.update(self)
+        manager.register(Player, RemotePlayer)
+        player = Player()
+        player.x = player.y = player.last_input = 0
+
+        class Handler(pygnetic.Handler):
+            def net_move(self, message, **kwargs):
+                player.x, player.y = step((player.x, player.y), message)
+                player.last_input = message.seq
+
+        server = loopback_adapter.Server(handler=Handler,
+                                         message_factory=self.mf)
+        server.sync_manager = manager
+        client = loopback_adapter.Client(message_factory=self.mf)
+        client.sync_manager = manager
+        connection = client.connect('localhost', server.address[1])
+        for i in range(5):
+            predictor.send(connection, 'move', dx=1, dy=2)
+            self.assertEqual(predictor.state, (i + 1, 2 * i + 2))
+            client.update()
+            server.update()
+            server.send_updates()
+        client.update()
+        self.assertEqual(predictor.acked, 5)
+        self.assertEqual(predictor.state, (5, 10))
+        self.assertEqual(len(predictor.pending), 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
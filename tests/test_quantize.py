@@ -0,0 +1,78 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import random
+import unittest
+import pygnetic
+from pygnetic import quantize
+from pygnetic.quantize import Quantized, BitWriter, BitReader, Layout
+
+
+class QuantizeTests(unittest.TestCase):
+    def setUp(self):
+        self.pos = Quantized(0, 4096, 0.01)
+        self.angle = Quantized(-180, 180, 1)
+
+    def test_quantized(self):
+        q = self.pos
+        self.assertEqual(q.bits, 19)
+        self.assertAlmostEqual(q.decode(q.encode(123.456)), 123.46)
+        self.assertEqual(q.decode(q.encode(-5)), 0)
+        self.assertEqual(q.decode(q.encode(5000)), 4096)
+
+    def test_bits(self):
+        w = BitWriter()
+        values = [(1, 1), (5, 3), (1000, 10), (0, 2), (123456, 17)]
+        for v, bits in values:
+            w.write(v, bits)
+        data = w.getvalue()
+        self.assertEqual(len(data), 5)
+        r = BitReader(data)
+        self.assertListEqual([r.read(bits) for _, bits in values],
+                             [v for v, _ in values])
+        self.assertRaises(ValueError, r.read, 8)
+
+    def test_layout(self):
+        layout = Layout((('x', self.pos), 'name', ('a', self.angle)))
+        data = layout.encode((1.5, 'abc', 90))
+        self.assertEqual(data[0], 'abc')
+        self.assertEqual(len(data[1]), 4)  # 19 + 9 bits
+        self.assertEqual(layout.decode(data), (1.5, 'abc', 90))
+
+    def test_many(self):
+        layout = Layout((('x', self.pos), ('y', self.pos), 'id',
+                         ('a', self.angle)))
+        rng = random.Random(1)
+        rows = [(rng.uniform(0, 4096), rng.uniform(0, 4096), i,
+                 rng.randint(-180, 180)) for i in range(100)]
+        encoded = layout.encode_many(rows)
+        self.assertListEqual(encoded, [layout.encode(r) for r in rows])
+        self.assertListEqual(layout.decode_many(encoded),
+                             [layout.decode(r) for r in encoded])
+        if quantize.numpy is not None:
+            numpy, quantize.numpy = quantize.numpy, None
+            try:
+                self.assertListEqual(layout.encode_many(rows), encoded)
+            finally:
+                quantize.numpy = numpy
+
+    def test_message(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        mf = pygnetic.message.MessageFactory()
+        move = mf.register('move', (('x', self.pos), ('y', self.pos),
+                                    'name'))
+        self.assertTupleEqual(move._fields, ('x', 'y', 'name'))
+        data = mf.pack(move(10.004, 4000.5, 'abc'))
+        self.assertLess(len(data), 16)  # 24 with floats
+        m = mf.unpack(data)
+        self.assertIs(m.__class__, move)
+        self.assertAlmostEqual(m.x, 10)
+        self.assertAlmostEqual(m.y, 4000.5)
+        self.assertEqual(m.name, 'abc')
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
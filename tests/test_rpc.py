@@ -0,0 +1,86 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import time
+import unittest
+import pygnetic
+from pygnetic import rpc
+from pygnetic.network import loopback_adapter
+
+
+class InventoryHandler(pygnetic.Handler):
+    items = {1: (u'sword', 1), 2: (u'arrow', 50)}
+
+    def __init__(self):
+        self.delayed = []
+
+    def net_get_item(self, message, reply=None, **kwargs):
+        if message.item_id == 3:
+            self.delayed.append(reply)  # answered later
+        elif message.item_id in self.items:
+            reply(*self.items[message.item_id])
+        elif message.item_id != 4:  # 4 - never answered
+            reply.error(u'no such item')
+
+
+class RPCTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('json')
+        self.mf = pygnetic.message.MessageFactory()
+        self.get_item, self.item = self.mf.register_call(
+            'get_item', ('item_id',), 'item', ('name', 'count'))
+        self.server = loopback_adapter.Server(handler=InventoryHandler,
+                                              message_factory=self.mf)
+        self.client = loopback_adapter.Client(message_factory=self.mf)
+        self.connection = self.client.connect('localhost',
+                                              self.server.address[1])
+        self.update()
+
+    def update(self, count=2):
+        for _ in range(count):
+            self.server.update()
+            self.client.update()
+
+    def test_pipelining(self):
+        done = []
+        futures = [self.connection.call(self.get_item(i), done.append)
+                   for i in (2, 1, 5)]
+        self.assertFalse(any(f.done for f in futures))
+        self.update()
+        self.assertListEqual(done, futures)
+        self.assertEqual(futures[0].result, self.item(u'arrow', 50))
+        self.assertEqual(futures[1].result, self.item(u'sword', 1))
+        self.assertIsNone(futures[2].result)
+        self.assertEqual(futures[2].error, u'no such item')
+        self.assertEqual(self.connection._calls, {})
+
+    def test_async_reply(self):
+        future = self.connection.call(self.get_item(3))
+        self.update()
+        self.assertFalse(future.done)
+        handler = next(self.server.handlers())
+        handler.delayed.pop()(u'bow', 1)
+        self.update()
+        self.assertEqual(future.result, self.item(u'bow', 1))
+
+    def test_timeout(self):
+        future = self.connection.call(self.get_item(4), timeout=0.05)
+        other = self.connection.call(self.get_item(4))
+        self.update()
+        time.sleep(0.15)
+        self.update()
+        self.assertEqual(future.error, rpc.TIMEOUT)
+        self.assertFalse(other.done)
+        self.connection.disconnect()
+        self.update()
+        self.assertEqual(other.error, rpc.DISCONNECTED)
+
+    def test_not_request(self):
+        self.assertRaises(ValueError, self.connection.call, self.item(u'', 0))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
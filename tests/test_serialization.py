@@ -23,6 +23,9 @@ class CommonTests(object):
         self.assertEqual(pygnetic.serialization.unpacker,
                          self.adapter.unpacker,
                          'incorrect selected adapter unpacker class')
+        self.assertEqual(pygnetic.serialization.packer,
+                         self.adapter.packer,
+                         'incorrect selected adapter packer function')
 
     def test_get_adapter(self):
         adapter = pygnetic.serialization.get_adapter(self.adapter_lib_name)
@@ -36,6 +39,41 @@ class MsgpackAdapterTests(unittest.TestCase, CommonTests):
         self.adapter = adapter
         self.adapter_lib_name = 'msgpack'
 
+    def test_unpack_tuples(self):
+        pack = self.adapter.packer()
+        data = (1, ('abc', u'\u0105'), [2.5, None])
+        self.assertTupleEqual(self.adapter.unpack(pack(data)),
+                              (1, ('abc', u'\u0105'), (2.5, None)))
+        unpacker = self.adapter.unpacker()
+        unpacker.feed(pack(data) + pack(data))
+        self.assertEqual(len(list(unpacker)), 2)
+
+    def test_ext_types(self):
+        try:
+            import pygame
+        except ImportError:
+            self.skipTest('pygame not available')
+        pack = self.adapter.packer()
+        data = (pygame.Rect(1, -2, 30, 40), pygame.math.Vector2(0.5, -1.5))
+        r, v = self.adapter.unpack(pack(data))
+        self.assertIsInstance(r, pygame.Rect)
+        self.assertEqual(r, data[0])
+        self.assertIsInstance(v, pygame.math.Vector2)
+        self.assertEqual(v, data[1])
+        # payload of wrong length
+        import msgpack
+        corrupted = pack(msgpack.ExtType(self.adapter.EXT_RECT, 'abc'))
+        self.assertIsNone(self.adapter.unpack(corrupted))
+        unpacker = self.adapter.unpacker()
+        unpacker.feed(corrupted)
+        self.assertRaises(ValueError, list, unpacker)
+
+    def test_limits(self):
+        pack = self.adapter.packer()
+        max_len = self.adapter.unpacker_options['max_str_len']
+        self.assertIsNone(self.adapter.unpack(pack(u'x' * (max_len + 1))))
+        self.assertIsNone(self.adapter.unpack(pack('abc')[:-1]))
+
 
 class JsonAdapterTests(unittest.TestCase, CommonTests):
     def setUp(self):
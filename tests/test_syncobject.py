@@ -0,0 +1,484 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import time
+import unittest
+import pygnetic
+from pygnetic import syncobject
+from pygnetic.network import loopback_adapter, netsim_adapter
+from pygnetic.syncobject import (SyncObject, RemoteObject, SyncObjectManager,
+                                 SnapshotManager, PriorityManager, Mode,
+                                 ColumnarSyncObject)
+
+
+class SyncObjectTests(unittest.TestCase):
+    manager_cls = SyncObjectManager
+    n_adapter = loopback_adapter
+
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        self.manager = manager = self.manager_cls()
+        self.remote_manager = remote_manager = self.manager_cls()
+        self.events = events = []
+
+        class Player(SyncObject):
+            sync_var = ('x', 'y', 'name')
+            sync_manager = manager
+
+        class Door(SyncObject):
+            sync_var = ('opened',)
+            sync_mode = Mode.MANUAL
+            sync_manager = manager
+
+        class RemotePlayer(RemoteObject):
+            def on_create(self):
+                events.append(('create', self.sync_id))
+
+            def on_change(self, var_names):
+                events.append(('change', self.sync_id, tuple(var_names)))
+
+            def on_remove(self):
+                events.append(('remove', self.sync_id))
+
+        for m in (manager, remote_manager):
+            m.register(Player, RemotePlayer)
+            m.register(Door)
+        self.Player = Player
+        self.Door = Door
+        mf = pygnetic.message.MessageFactory()
+        self.server = self.n_adapter.Server(handler=pygnetic.Handler,
+                                            message_factory=mf)
+        self.server.sync_manager = manager
+        self.client = self.n_adapter.Client(message_factory=mf)
+        self.client.sync_manager = remote_manager
+        self.connection = self.client.connect('localhost',
+                                              self.server.address[1])
+        self.update()
+        self.update()  # exchange of initial rtt pings
+
+    def update(self):
+        self.server.update()
+        self.server.send_updates()
+        self.client.update()
+
+    def test_replication(self):
+        p = self.Player()
+        p.x, p.y, p.name = 1, 2, 'abc'
+        self.update()
+        objs = self.connection.remote_objects
+        self.assertEqual(len(objs), 1)
+        r = objs[self.manager.get_id(p)]
+        self.assertEqual((r.x, r.y, r.name), (1, 2, 'abc'))
+        self.assertIs(r.sync_type, self.Player)
+        p.y = 5
+        self.update()
+        self.assertEqual(r.y, 5)
+        del p
+        self.update()
+        self.assertEqual(len(objs), 0)
+        self.assertListEqual(self.events, [
+            ('create', r.sync_id), ('change', r.sync_id, ('y',)),
+            ('remove', r.sync_id)])
+
+    def test_only_changed(self):
+        p = self.Player()
+        p.x, p.y, p.name = 1, 2, 'abc'
+        self.update()
+        data_sent = next(self.server.connections()).data_sent
+        p.x = 3
+        self.update()
+        c = next(self.server.connections())
+        self.assertLess(c.data_sent - data_sent, 16)
+
+    def test_manual_mode(self):
+        d = self.Door()
+        d.opened = False
+        self.update()
+        r = self.connection.remote_objects[self.manager.get_id(d)]
+        d.opened = True
+        self.update()
+        self.assertFalse(r.opened)
+        d.send_changes()
+        self.update()
+        self.assertTrue(r.opened)
+
+    def test_batches(self):
+        players = [self.Player() for _ in range(150)]
+        sent = next(self.server.connections()).messages_sent
+        self.update()
+        self.assertEqual(next(self.server.connections()).messages_sent - sent,
+                         3)
+        self.assertEqual(len(self.connection.remote_objects), 150)
+        # removed objects count to size of batch
+        del players[:60]
+        players += [self.Player() for _ in range(10)]
+        sent = next(self.server.connections()).messages_sent
+        self.update()
+        self.assertEqual(next(self.server.connections()).messages_sent - sent,
+                         2)
+        self.assertEqual(len(self.connection.remote_objects), 100)
+
+    def test_quantized(self):
+        pos = pygnetic.quantize.Quantized(0, 1024, 0.01)
+
+        class Ball(SyncObject):
+            sync_var = (('x', pos), ('y', pos), 'color')
+            sync_manager = self.manager
+        for m in (self.manager, self.remote_manager):
+            m.register(Ball)
+        balls = [Ball() for _ in range(10)]
+        for i, b in enumerate(balls):
+            b.x, b.y, b.color = i + 0.123, 2000, 'red'
+        self.update()
+        objs = self.connection.remote_objects
+        r = objs[self.manager.get_id(balls[3])]
+        self.assertAlmostEqual(r.x, 3.12)
+        self.assertEqual((r.y, r.color), (1024, 'red'))
+        balls[3].y = 5.555
+        self.update()
+        self.assertAlmostEqual(r.y, 5.56)
+        self.assertAlmostEqual(r.x, 3.12)
+        balls[3].x, balls[3].color = 7.777, 'blue'
+        self.update()
+        self.assertEqual((round(r.x, 2), round(r.y, 2), r.color),
+                         (7.78, 5.56, 'blue'))
+        # codes of changed quantized variables share single string
+        type_id = self.manager.get_type_id(Ball)
+        changes = self.manager._encode_changes(type_id,
+                                               [0, 1.0, 1, 2.0, 2, 'blue'])
+        self.assertEqual(changes[:2], (2, 'blue'))
+        self.assertEqual(len(changes[2]), 5)  # 2 + 2 * 17 bits
+        self.assertEqual(self.manager._decode_changes(type_id, changes),
+                         [2, 'blue', 0, 1.0, 1, 2.0])
+
+    def test_columnar(self):
+        class Npc(ColumnarSyncObject):
+            sync_var = ('x', 'y', 'name')
+            sync_dtypes = {'name': object}
+            sync_manager = self.manager
+        for m in (self.manager, self.remote_manager):
+            m.register(Npc)
+        npcs = [Npc() for _ in range(20)]
+        for i, n in enumerate(npcs):
+            n.x, n.y, n.name = i, -i, 'npc%d' % i
+        self.assertEqual((npcs[5].x, npcs[5].y, npcs[5].name),
+                         (5.0, -5.0, 'npc5'))
+        self.update()
+        objs = self.connection.remote_objects
+        r = objs[self.manager.get_id(npcs[7])]
+        self.assertEqual((r.x, r.y, r.name), (7, -7, 'npc7'))
+        npcs[7].y = 3
+        self.update()
+        self.assertEqual(r.y, 3)
+        self.assertEqual(r.x, 7)
+        self.manager.remove(npcs[8])
+        del npcs[9]
+        self.update()
+        self.assertEqual(len(objs), 18)
+        store = self.manager._stores[Npc]
+        self.assertListEqual(store.free, [9])
+        n = Npc()
+        self.assertEqual(n._sync_row, 9)
+        self.assertEqual(store.size, 20)
+
+    def test_columnar_managers(self):
+        manager = self.manager
+
+        class Npc(ColumnarSyncObject):
+            sync_var = ('x', 'name')
+            sync_dtypes = {'name': object}
+            sync_manager = manager
+
+            def __init__(self):
+                self.name = 'npc%d' % self.x  # before SyncObject.__init__
+                super(Npc, self).__init__()
+        other = SyncObjectManager()
+        Other = type('Other', (Npc,), {'sync_manager': other})
+        for m in (self.manager, self.remote_manager):
+            m.register(Npc)
+        other.register(Other)
+        a, b = Npc(), Other()
+        self.assertEqual((a.x, a.name), (0.0, 'npc0'))
+        self.assertEqual(b.name, 'npc0')
+        self.assertIsNot(a._sync_store, b._sync_store)
+        a.x = b.x = 1
+        other.update(())
+        self.assertEqual(b._sync_store.dirty.sum(), 0)
+        self.assertEqual(a._sync_store.dirty.sum(), 1)
+        self.update()
+        r = self.connection.remote_objects[self.manager.get_id(a)]
+        self.assertEqual((r.x, r.name), (1, 'npc0'))
+
+    def test_unregistered(self):
+        class Other(SyncObject):
+            sync_manager = self.manager
+        self.assertRaises(ValueError, Other)
+
+    def test_resume(self):
+        p = self.Player()
+        q = self.Player()
+        p.x, q.x = 1, 2
+        self.update()
+        handler = next(self.server.handlers())
+        objs = self.connection.remote_objects
+        self.connection.disconnect()
+        self.update()
+        self.assertEqual(len(self.server.conn_map), 0)
+        p.x = 3
+        del q
+        r = self.Player()
+        r.x = 4
+        self.update()
+        del self.events[:]
+        connection = self.client.reconnect(self.connection)
+        self.update()
+        self.update()
+        self.assertIs(next(self.server.handlers()), handler)
+        self.assertIs(handler.connection.remote_objects,
+                      next(self.server.connections()).remote_objects)
+        self.assertIs(connection.remote_objects, objs)
+        self.assertListEqual(sorted((o.sync_id, o.x)
+                                    for o in objs.itervalues()),
+                             [(1, 3), (3, 4)])
+        self.assertNotIn('remove', [e[0] for e in self.events
+                                    if e[1] == 1])
+        self.assertIn(('create', 3), self.events)
+
+    def test_resume_size(self):
+        players = [self.Player() for _ in range(500)]
+        for i, p in enumerate(players):
+            p.x, p.y, p.name = i, -i, 'player%d' % i
+        s_conn = next(self.server.connections())
+        sent = s_conn.data_sent
+        objs = self.connection.remote_objects
+        while len(objs) < 500:
+            self.update()
+        full = s_conn.data_sent - sent
+        self.connection.disconnect()
+        self.update()
+        players[7].x = -1
+        self.update()
+        self.client.reconnect(self.connection)
+        for _ in range(3):
+            self.update()
+        new = next(self.server.connections())
+        self.assertIsNot(new, s_conn)
+        self.assertEqual(objs[self.manager.get_id(players[7])].x, -1)
+        # only change made while session was suspended
+        self.assertLess(new.data_sent, full / 20)
+
+    def test_takeover(self):
+        p = self.Player()
+        p.x = 1
+        self.update()
+        handlers = []
+        handler = next(self.server.handlers())
+        handler.on_disconnect = lambda: handlers.append('disconnect')
+        old = next(self.server.connections())
+        # link broken only on client side
+        old.peer = None
+        self.connection.peer = None
+        self.connection.connected = False
+        self.connection._disconnect()
+        disconnected = []
+        self.addCleanup(setattr, pygnetic.event, 'disconnected',
+                        pygnetic.event.disconnected)
+        pygnetic.event.disconnected = disconnected.append
+        connection = self.client.reconnect(self.connection)
+        for _ in range(3):
+            self.update()
+        new = next(self.server.connections())
+        self.assertEqual(len(self.server.conn_map), 1)
+        self.assertNotEqual(new.id, old.id)
+        self.assertListEqual(new.handlers, [handler])
+        self.assertFalse(old.connected)
+        self.assertListEqual(disconnected, [old])
+        self.assertListEqual(handlers, [])
+        self.assertListEqual([(o.sync_id, o.x) for o in
+                              connection.remote_objects.itervalues()],
+                             [(1, 1)])
+        self.assertNotIn(('remove', 1), self.events)
+
+    def test_expired_session(self):
+        self.server.resume_grace = 0.0
+        p = self.Player()
+        p.x = 1
+        self.update()
+        self.connection.disconnect()
+        self.update()
+        time.sleep(0.1)
+        self.update()  # session expires
+        connection = self.client.reconnect(self.connection)
+        self.update()
+        self.update()
+        self.assertEqual([(o.sync_id, o.x) for o in
+                          connection.remote_objects.itervalues()], [(1, 1)])
+        self.assertIn(('remove', 1), self.events)
+
+
+class InterpolationTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+
+        class Ball(RemoteObject):
+            interpolate = ('x', 'y')
+            render_delay = 0.1
+            buffer_size = 4
+            clock = lambda _: self.now
+        self.ball = Ball()
+
+    def receive(self, t, x, y):
+        self.now = t
+        self.ball.x, self.ball.y = x, y
+        self.ball._record()
+
+    def test_interpolation(self):
+        b = self.ball
+        self.receive(1.0, 0, 10)
+        self.assertEqual(b.get('x', 0.5), 0)
+        self.assertEqual(b.get('x', 1.5), 0)  # no velocity yet
+        self.receive(1.1, 10, 10)
+        self.receive(1.2, 30, 0)
+        self.now = 1.25
+        self.assertAlmostEqual(b.get('x'), 20)  # at 1.15
+        self.assertAlmostEqual(b.get('x', 1.1), 10)
+        self.assertAlmostEqual(b.sample(1.15)['y'], 5)
+
+    def test_extrapolation(self):
+        b = self.ball
+        self.receive(1.0, 0, 0)
+        self.receive(1.1, 10, 0)
+        self.assertAlmostEqual(b.get('x', 1.2), 20)
+        self.assertAlmostEqual(b.get('x', 5), 35)  # max 0.25s
+
+    def test_ring(self):
+        b = self.ball
+        for i in range(10):
+            self.receive(i, i * 10, 0)
+        self.assertAlmostEqual(b.get('x', 7.5), 75)
+        self.assertAlmostEqual(b.get('x', 2), 60)  # oldest recorded
+
+    def test_none(self):
+        b = self.ball
+        self.receive(1.0, None, 0)
+        self.assertIsNone(b.get('x', 1.0))
+        self.receive(1.1, 10, 10)
+        self.assertIsNone(b.get('x', 1.05))  # held until next state
+        self.assertAlmostEqual(b.get('y', 1.05), 5)
+        self.receive(1.2, None, 20)
+        self.assertIsNone(b.get('x', 1.3))
+        self.assertEqual(b.get('x', 1.1), 10)
+
+    def test_sender_time(self):
+        class Connection(object):
+            server_time = lambda _: self.now
+        c = Connection()
+        self.now = 100000.0
+        stamp = syncobject._stamp(c)
+        self.assertLess(stamp, 65536)
+        self.now += 0.05  # delay of message
+        self.assertAlmostEqual(syncobject._unstamp(c, stamp), 100000.0)
+        self.now -= 0.1  # clock estimate of receiver behind sender
+        self.assertAlmostEqual(syncobject._unstamp(c, stamp), 100000.0)
+
+
+class SnapshotTests(SyncObjectTests):
+    manager_cls = SnapshotManager
+
+    def test_batches(self):
+        players = [self.Player() for _ in range(150)]
+        self.update()
+        self.assertEqual(len(self.connection.remote_objects), 150)
+
+    def test_unchanged(self):
+        players = [self.Player() for _ in range(100)]
+        self.update()
+        self.update()  # delivers ack
+        c = next(self.server.connections())
+        data_sent = c.data_sent
+        self.update()
+        self.assertLess(c.data_sent - data_sent, 16)
+        players[0].x = 5
+        players.pop()
+        self.update()
+        self.assertLess(c.data_sent - data_sent, 32)
+        self.assertEqual(len(self.connection.remote_objects), 99)
+
+    def test_packet_loss(self):
+        adapter = netsim_adapter.wrap(loopback_adapter)
+        mf = pygnetic.message.MessageFactory()
+        server = adapter.Server(handler=pygnetic.Handler, message_factory=mf,
+            conditions=netsim_adapter.Conditions(loss=0.5), seed=1)
+        server.sync_manager = self.manager
+        client = adapter.Client(message_factory=mf,
+            conditions=netsim_adapter.Conditions(loss=0.5), seed=1)
+        client.sync_manager = self.remote_manager
+        connection = client.connect('localhost', server.address[1])
+        players = [self.Player() for _ in range(10)]
+        for i in range(100):
+            players[i % len(players)].x = i
+            if i == 50:
+                del players[5:]
+            server.update()
+            server.sync_manager.update(server.connections())
+            client.update()
+        for _ in range(20):
+            server.update()
+            server.sync_manager.update(server.connections())
+            client.update()
+        objs = connection.remote_objects
+        self.assertEqual(len(objs), 5)
+        self.assertListEqual(sorted(o.x for o in objs.itervalues()),
+                             [95, 96, 97, 98, 99])
+
+
+class PriorityTests(SyncObjectTests):
+    manager_cls = PriorityManager
+
+    def test_budget(self):
+        self.manager.budget_increase = 0
+        self.manager.budget = self.manager.min_budget = 300
+        players = [self.Player() for _ in range(100)]
+        for i, p in enumerate(players):
+            p.x, p.y, p.name = i, i, 'player%d' % i
+        players[99].sync_priority = 10
+        self.update()
+        objs = self.connection.remote_objects
+        self.assertIn(self.manager.get_id(players[99]), objs)
+        self.assertLess(len(objs), 100)
+        for _ in range(20):
+            self.update()
+        self.assertEqual(len(objs), 100)
+
+    def test_relevance(self):
+        self.manager.relevance = lambda obj, connection: obj.x
+        near, far = self.Player(), self.Player()
+        near.x, far.x = 1, 0
+        self.update()
+        objs = self.connection.remote_objects
+        self.assertListEqual(objs.keys(), [self.manager.get_id(near)])
+        far.x = 2
+        self.update()
+        self.assertEqual(len(objs), 2)
+
+    def test_congestion(self):
+        c = next(self.server.connections())
+        state = self.manager._states[c]
+        budget = state.budget
+        state.min_rtt = None  # forget rtt measured by loopback pings
+        c._measure_rtt = False
+        c.rtt, c.packet_loss = 0.05, 0.0
+        self.update()
+        self.assertGreater(state.budget, budget)
+        budget = state.budget
+        c.packet_loss = 0.1
+        self.update()
+        self.update()
+        self.assertEqual(state.budget, budget // 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,149 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import os
+import shutil
+import tempfile
+import unittest
+import pygnetic
+from pygnetic.network import loopback_adapter
+
+
+class ReceiverHandler(pygnetic.Handler):
+    def __init__(self):
+        self.events = []
+        self.target = None
+
+    def net_echo(self, message, **kwargs):
+        self.events.append('echo')
+
+    def on_transfer_start(self, transfer):
+        self.events.append('start')
+        if self.target is not None:
+            transfer.target = self.target
+
+    def on_transfer_progress(self, transfer):
+        self.events.append(transfer.received)
+
+    def on_transfer_done(self, transfer):
+        self.events.append('done')
+        self.transfer = transfer
+
+
+class TransferTests(unittest.TestCase):
+    def setUp(self):
+        pygnetic.serialization.select_adapter('msgpack')
+        self.dir = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        self.mf = pygnetic.message.MessageFactory()
+        self.mf.register('echo', ('msg',))
+        self.server = loopback_adapter.Server(handler=ReceiverHandler,
+                                              message_factory=self.mf)
+        self.client = loopback_adapter.Client(message_factory=self.mf)
+        self.connection = self.client.connect('localhost',
+                                              self.server.address[1])
+        self.connection.bulk_budget = 20000
+        self.update()
+        self.handler = next(self.server.handlers())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def update(self, count=2):
+        for _ in range(count):
+            self.client.update()
+            self.server.update()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def test_buffer(self):
+        progress = []
+        t = self.connection.send_file(bytearray(self.data), 'data',
+                                      chunk_size=8192,
+                                      on_progress=progress.append)
+        self.connection.net_echo('a')
+        self.update(1)
+        # budget limits data sent in one update, other messages aren't
+        # blocked by transfer
+        self.assertListEqual(self.handler.events[:2], ['start', 'echo'])
+        self.assertEqual(t.sent, 20000)
+        self.update(10)
+        self.assertTrue(t.done)
+        self.assertEqual(self.handler.events[-1], 'done')
+        self.assertEqual(self.handler.events[-2], 100000)
+        self.assertEqual(str(self.handler.transfer.target), self.data)
+        self.assertEqual(len(progress), 15)  # 3 chunks per budget
+
+    def test_file_resume(self):
+        source = self.path('source')
+        with open(source, 'wb') as f:
+            f.write(self.data)
+        self.handler.target = self.path('target')
+        t = self.connection.send_file(source)
+        self.assertEqual(t.name, 'source')
+        self.update(2)
+        t.cancel()
+        self.update()
+        self.assertEqual(t.acked, 20000)
+        self.assertEqual(self.connection._outgoing, {})
+        self.assertEqual(self.connection.parent._sending, set())
+        t = self.connection.send_file(source, offset=t.acked)
+        self.update(10)
+        self.assertTrue(t.done)
+        self.assertEqual(self.handler.events[-1], 'done')
+        with open(self.handler.target, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_window(self):
+        self.connection.transfer_window = 10000
+        t = self.connection.send_file(bytearray(self.data), 'data',
+                                      chunk_size=8192)
+        self.client.update()
+        # budget allows more, but nothing is acknowledged yet
+        self.assertEqual(t.sent, 10000)
+        self.assertEqual(t.acked, 0)
+        self.client.update()
+        self.assertEqual(t.sent, 10000)
+        self.server.update()
+        self.client.update()
+        self.assertEqual(t.acked, 10000)
+        self.assertEqual(t.sent, 20000)
+        self.update(20)
+        self.assertTrue(t.done)
+        self.assertEqual(str(self.handler.transfer.target), self.data)
+
+    def test_size_limit(self):
+        s_conn = next(self.server.connections())
+        s_conn.max_transfer_size = 50000
+        t = self.connection.send_file(bytearray(self.data), 'data')
+        self.update()
+        self.assertTrue(t.cancelled)
+        self.assertEqual(t.acked, 0)
+        self.assertListEqual(self.handler.events, [])
+        self.assertEqual(s_conn._incoming, {})
+        self.assertEqual(self.connection._outgoing, {})
+
+    def test_incoming_limit(self):
+        s_conn = next(self.server.connections())
+        s_conn.max_incoming_size = 2500
+        start = self.mf.get_internal('transfer_start')
+        for tid in range(3):
+            self.connection._send(start(tid, 'data', 1000, 0))
+        self.update()
+        self.assertListEqual(sorted(s_conn._incoming), [0, 1])
+
+    def test_empty_file(self):
+        source = self.path('empty')
+        open(source, 'wb').close()
+        t = self.connection.send_file(source)
+        self.update()
+        self.assertTrue(t.done)
+        self.assertListEqual(self.handler.events, ['start', 0, 'done'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
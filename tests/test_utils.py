@@ -0,0 +1,43 @@
+if __name__ == '__main__':
+    import sys
+    import os
+    pkg_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir, pkg_name = os.path.split(pkg_dir)
+    sys.path.insert(0, parent_dir)
+import unittest
+from pygnetic._utils import TimerWheel
+
+
+class TimerWheelTests(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(1.0, 8)
+
+    def test_expiry(self):
+        w = self.wheel
+        w.schedule('a', 102.5)
+        w.schedule('b', 104)
+        w.schedule('c', 130)  # few rounds later
+        self.assertListEqual(w.advance(100), [])
+        self.assertListEqual(w.advance(102.9), [])
+        self.assertListEqual(w.advance(103), ['a'])
+        self.assertListEqual(w.advance(110), ['b'])
+        self.assertListEqual(w.advance(129.5), [])
+        self.assertListEqual(w.advance(200), ['c'])
+        self.assertEqual(len(w), 0)
+
+    def test_reschedule(self):
+        w = self.wheel
+        w.schedule('a', 10)
+        w.schedule('b', 10)
+        self.assertListEqual(w.advance(5), [])
+        w.schedule('a', 15)
+        self.assertTrue(w.cancel('b'))
+        self.assertFalse(w.cancel('b'))
+        self.assertListEqual(w.advance(12), [])
+        self.assertEqual(w.deadline('a'), 15)
+        w.schedule('b', 1)  # already passed
+        self.assertListEqual(sorted(w.advance(15)), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)